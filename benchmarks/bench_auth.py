@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Measures the cost of authorising a request in workspaces_auth - decoding
+# the token and checking its RS256 signature against a JWKS - for the first
+# request with a token and for the cached requests that follow, as in an
+# administrator firing a burst of actions. The key pair is generated here so
+# the JWKS is a stand-in for the one published by the Cognito user pool.
+#
+# Usage: python benchmarks/bench_auth.py [requests-per-token] [tokens]
+#
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import workspaces_auth
+
+SmallPrimes = [Number for Number in range(3, 2000, 2) if all([Number%Divisor != 0 for Divisor in range(3, int(Number**0.5)+1, 2)])]
+
+def IsPrime(Number, Rounds=32):
+    if Number%2 == 0 or any([Number%Prime == 0 for Prime in SmallPrimes]): return(False)
+    (Odd, Twos) = (Number-1, 0)
+    while Odd%2 == 0: (Odd, Twos) = (Odd//2, Twos+1)
+
+    for Round in range(Rounds):
+        Witness = pow(random.randrange(2, Number-1), Odd, Number)
+        if Witness in (1, Number-1): continue
+        for Square in range(Twos-1):
+            Witness = pow(Witness, 2, Number)
+            if Witness == Number-1: break
+        else:
+            return(False)
+    return(True)
+
+def MakePrime(Bits):
+    while True:
+        Candidate = random.getrandbits(Bits) | (1 << (Bits-1)) | 1
+        if IsPrime(Candidate): return(Candidate)
+
+def MakeKey(Bits=2048):
+    Exponent = 65537
+    while True:
+        (P, Q) = (MakePrime(Bits//2), MakePrime(Bits//2))
+        Totient = (P-1)*(Q-1)
+        if P != Q and Totient%Exponent != 0: return((P*Q, Exponent, pow(Exponent, -1, Totient)))
+
+def Encode(Data):
+    return(base64.urlsafe_b64encode(Data).decode().rstrip("="))
+
+def Sign(Key, Claims):
+    (Modulus, Exponent, Private) = Key
+    Length  = (Modulus.bit_length()+7)//8
+    Signing = Encode(json.dumps({"alg":"RS256", "kid":"test"}).encode())+"."+Encode(json.dumps(Claims).encode())
+
+    Digest  = workspaces_auth.SHA256Prefix+hashlib.sha256(Signing.encode()).digest()
+    Padded  = b"\x00\x01"+b"\xff"*(Length-len(Digest)-3)+b"\x00"+Digest
+    return(Signing+"."+Encode(pow(int.from_bytes(Padded, "big"), Private, Modulus).to_bytes(Length, "big")))
+
+def main():
+    Requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    Tokens   = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    logging.disable(logging.ERROR)
+
+    Key = MakeKey()
+    workspaces_auth.SetKeys({"keys":[{"kty":"RSA", "kid":"test", "alg":"RS256", "use":"sig",
+                                      "n":Encode(Key[0].to_bytes((Key[0].bit_length()+7)//8, "big")),
+                                      "e":Encode(Key[1].to_bytes(3, "big"))}]})
+
+    Expires = int(time.time())+3600
+    Signed  = [Sign(Key, {"identities":[{"userId":"CORP\\admin%04d" % Index}], "exp":Expires,
+                          "custom:ADGroups":"[AdminGroupMember, UserGroupMember]"}) for Index in range(Tokens)]
+
+    # Sanity checks - a tampered or expired token must be refused
+    Tampered = Signed[0].split(".")
+    Tampered[1] = Encode(json.dumps({"identities":[{"userId":"CORP\\someoneelse"}], "exp":Expires, "custom:ADGroups":"AdminGroupMember"}).encode())
+    for (Label, Token) in [("tampered", ".".join(Tampered)), ("expired", Sign(Key, {"identities":[{"userId":"CORP\\x"}], "exp":1}))]:
+        try:
+            workspaces_auth.Authorise(Token)
+            print("ERROR: "+Label+" token was accepted")
+        except workspaces_auth.AuthError:
+            pass
+
+    Start = time.perf_counter()
+    for Token in Signed:
+        workspaces_auth.TokenCache.Clear()
+        User = workspaces_auth.Authorise(Token)
+    Uncached = (time.perf_counter()-Start)/Tokens
+
+    workspaces_auth.TokenCache.Clear()
+    Start = time.perf_counter()
+    for Token in Signed:
+        for Request in range(Requests): User = workspaces_auth.Authorise(Token)
+    Burst = (time.perf_counter()-Start)/(Tokens*Requests)
+
+    print("%d tokens, %d requests each, 2048 bit RS256 keys" % (Tokens, Requests))
+    print("first request:  %8.1f us per request (decode and verify)" % (Uncached*1000000))
+    print("burst average:  %8.1f us per request" % (Burst*1000000))
+    print("cache:          "+json.dumps(workspaces_auth.TokenCache.Stats()))
+    print("admin:          "+str(User.IsAdmin)+" groups "+",".join(sorted(User.Groups)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Measures warm-invocation latency of the API-facing Lambda functions when
+# boto3 clients are built on every invocation (what the functions used to do)
+# against reusing the cached clients from workspaces_clients. API calls are
+# answered in-process by a botocore before-call hook, so request validation
+# and response parsing still run but nothing goes over the network - the TLS
+# handshake that a cached client also saves is therefore not included.
+#
+# Usage: python benchmarks/bench_clients.py [invocations]
+#
+
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+import fakeaws
+import workspaces_clients
+
+Item = {"WorkspaceId":  {"S":"ws-000000001"},
+        "UserName":     {"S":"user1"},
+        "Region":       {"S":"ap-southeast-2"},
+        "InstanceState":{"S":"STOPPED"},
+        "RunningMode":  {"S":"AUTO_STOP"},
+        "RegCode":      {"S":"SLiad+ABCDEF"},
+        "LastTouched":  {"N":"1700000000"}}
+
+Responses = {"GetItem":        {"Item":Item},
+             "UpdateItem":     {},
+             "Query":          {"Items":[Item], "Count":1, "ScannedCount":1},
+             "StartWorkspaces":{"FailedRequests":[]}}
+
+def Measure(Handler, Event, Invocations, Cached):
+    Times = []
+    for Invocation in range(Invocations):
+        if not Cached: workspaces_clients.ResetClients()
+        Start = time.perf_counter()
+        Handler.lambda_handler(Event, None)
+        Times.append((time.perf_counter()-Start)*1000)
+    Times.sort()
+    return(statistics.mean(Times), Times[len(Times)//2], Times[int(len(Times)*0.95)])
+
+def main():
+    Invocations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    logging.disable(logging.INFO)
+    fakeaws.CannedResponses(Responses).Register(workspaces_clients.Session)
+
+    import lambda_workspaces_actions
+    import lambda_workspaces_list_instances
+
+    Token   = fakeaws.MakeToken("user1", "UserGroupMember")
+    Targets = [("actions", lambda_workspaces_actions,
+                {"headers":{"Authorization":Token}, "queryStringParameters":{"InstanceId":"ws-000000001", "Action":"Start"}}),
+               ("list_instances", lambda_workspaces_list_instances,
+                {"headers":{"Authorization":Token}})]
+
+    print("%d warm invocations per case (milliseconds)" % Invocations)
+    print("%-16s %-12s %8s %8s %8s" % ("Function", "Clients", "mean", "p50", "p95"))
+    for (Name, Handler, Event) in Targets:
+        Measure(Handler, Event, 5, True) # Load service models before timing anything
+        for Cached in [False, True]:
+            (Mean, P50, P95) = Measure(Handler, Event, Invocations, Cached)
+            print("%-16s %-12s %8.2f %8.2f %8.2f" % (Name, "cached" if Cached else "per-call", Mean, P50, P95))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Cold start profile for each Lambda function. Every run starts a fresh Python
+# process which imports boto3, imports the function module (which logs its own
+# init report) and invokes the handler twice against canned API responses.
+# The median of several runs is reported per module and can be saved to a
+# JSON file and compared against a previous run to catch regressions.
+#
+# Usage: python benchmarks/bench_coldstart.py [--runs N] [--save FILE] [--baseline FILE]
+#
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+Here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(Here))
+sys.path.insert(0, Here)
+
+Modules = ["lambda_workspaces_actions",
+           "lambda_workspaces_list_instances",
+           "lambda_workspaces_import",
+           "lambda_workspaces_reaper",
+           "lambda_workspaces_events"]
+
+Item = {"WorkspaceId":  {"S":"ws-000000001"},
+        "UserName":     {"S":"user1"},
+        "Region":       {"S":"ap-southeast-2"},
+        "InstanceState":{"S":"STOPPED"},
+        "RunningMode":  {"S":"AUTO_STOP"},
+        "RegCode":      {"S":"SLiad+ABCDEF"},
+        "ComputerName": {"S":"WSAMZN-0000001"},
+        "LastTouched":  {"N":"1700000000"}}
+
+Workspace = {"WorkspaceId":"ws-000000001", "DirectoryId":"d-0000000001", "UserName":"user1",
+             "State":"STOPPED", "ComputerName":"WSAMZN-0000001", "IpAddress":"10.0.0.1",
+             "WorkspaceProperties":{"RunningMode":"AUTO_STOP"}}
+
+Responses = {"GetItem":                            {"Item":Item},
+             "UpdateItem":                         {},
+             "Query":                              {"Items":[Item], "Count":1, "ScannedCount":1},
+             "Scan":                               {"Items":[Item], "Count":1, "ScannedCount":1},
+             "BatchWriteItem":                     {"UnprocessedItems":{}},
+             "StartWorkspaces":                    {"FailedRequests":[]},
+             "DescribeWorkspaces":                 {"Workspaces":[Workspace]},
+             "DescribeWorkspacesConnectionStatus": {"WorkspacesConnectionStatus":[]},
+             "DescribeWorkspaceDirectories":       {"Directories":[{"DirectoryId":"d-0000000001", "RegistrationCode":"SLiad+ABCDEF"}]}}
+
+def MakeEvent(Module):
+    import fakeaws # Already loaded by Child
+    Token = fakeaws.MakeToken("user1", "UserGroupMember")
+    if Module == "lambda_workspaces_actions":
+        return({"headers":{"Authorization":Token}, "queryStringParameters":{"InstanceId":"ws-000000001", "Action":"Start"}})
+    if Module == "lambda_workspaces_list_instances":
+        return({"headers":{"Authorization":Token}})
+    if Module == "lambda_workspaces_events":
+        return({"detail-type":"AWS API Call via CloudTrail", "source":"aws.workspaces",
+                "detail":{"eventName":"StartWorkspaces", "eventTime":"2024-05-01T09:00:00Z",
+                          "requestParameters":{"startWorkspaceRequests":[{"workspaceId":"ws-000000001"}]}}})
+    return({})
+
+def Child(Module):
+    #
+    # Runs in a fresh process - everything here is a genuine cold start
+    #
+    logging.disable(logging.INFO)
+
+    Start = time.perf_counter()
+    import workspaces_clients
+    import fakeaws
+    Boto3Ms = (time.perf_counter()-Start)*1000
+
+    fakeaws.CannedResponses(Responses).Register(workspaces_clients.Session)
+
+    import importlib
+    import workspaces_startup
+    Start   = time.perf_counter()
+    Handler = importlib.import_module(Module)
+    ImportMs = (time.perf_counter()-Start)*1000
+
+    Event = MakeEvent(Module)
+    Start = time.perf_counter()
+    Handler.lambda_handler(Event, None)
+    FirstMs = (time.perf_counter()-Start)*1000
+
+    Start = time.perf_counter()
+    Handler.lambda_handler(Event, None)
+    WarmMs = (time.perf_counter()-Start)*1000
+
+    Report = workspaces_startup.Reports.get(Module, {})
+    print(json.dumps({"Module":Module,
+                      "Boto3Ms":Boto3Ms,
+                      "InitMs":ImportMs,
+                      "Phases":Report.get("Phases", {}),
+                      "FirstInvokeMs":FirstMs,
+                      "WarmInvokeMs":WarmMs,
+                      "ColdStartMs":Boto3Ms+ImportMs+FirstMs}))
+
+def Profile(Module, Runs):
+    Environment = dict(os.environ)
+    Environment.setdefault("AWS_REGION", "ap-southeast-2")
+    Environment.setdefault("AWS_DEFAULT_REGION", Environment["AWS_REGION"])
+    Environment.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    Environment.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    Environment["REGIONLIST"] = Environment["AWS_REGION"]
+
+    Results = []
+    for Run in range(Runs):
+        Output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", Module],
+                                env=Environment, capture_output=True, text=True, check=True)
+        Results.append(json.loads(Output.stdout.strip().splitlines()[-1]))
+
+    Summary = {"Module":Module}
+    for Name in ["Boto3Ms", "InitMs", "FirstInvokeMs", "WarmInvokeMs", "ColdStartMs"]:
+        Summary[Name] = round(statistics.median([Result[Name] for Result in Results]), 2)
+    Summary["Phases"] = {Name:round(statistics.median([Result["Phases"].get(Name, 0) for Result in Results]), 2)
+                         for Name in Results[0]["Phases"]}
+    return(Summary)
+
+def main():
+    Parser = argparse.ArgumentParser(description="Cold start profile for the Workspaces portal Lambda functions")
+    Parser.add_argument("--runs", type=int, default=5, help="fresh processes per module (median is reported)")
+    Parser.add_argument("--save", help="write the results to this JSON file")
+    Parser.add_argument("--baseline", help="compare against results saved by an earlier --save")
+    Parser.add_argument("--child", help=argparse.SUPPRESS)
+    Arguments = Parser.parse_args()
+
+    if Arguments.child:
+        Child(Arguments.child)
+        return
+
+    Baseline = {}
+    if Arguments.baseline:
+        with open(Arguments.baseline) as File:
+            Baseline = {Result["Module"]:Result for Result in json.load(File)}
+
+    print("Median of %d cold starts per module (milliseconds)" % Arguments.runs)
+    print("%-34s %8s %8s %8s %8s %8s" % ("Module", "boto3", "init", "first", "warm", "cold"))
+    Summaries = []
+    for Module in Modules:
+        Summary = Profile(Module, Arguments.runs)
+        Summaries.append(Summary)
+
+        Line = "%-34s %8.1f %8.1f %8.1f %8.1f %8.1f" % (Module, Summary["Boto3Ms"], Summary["InitMs"],
+                                                       Summary["FirstInvokeMs"], Summary["WarmInvokeMs"], Summary["ColdStartMs"])
+        if Module in Baseline:
+            Line += "  (%+.1f%% vs baseline)" % ((Summary["ColdStartMs"]/Baseline[Module]["ColdStartMs"]-1)*100)
+        print(Line)
+        print("%-34s %s" % ("", json.dumps(Summary["Phases"])))
+
+    if Arguments.save:
+        with open(Arguments.save, "w") as File:
+            json.dump(Summaries, File, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Compares lambda_workspaces_import run as one invocation against the
+# coordinator/worker mode with 2, 4 and 8 shards. Workers are run in a
+# process pool (workspaces_dispatch.ProcessPoolDispatcher) in place of
+# separate Lambda invocations, against stand-in Workspaces and DynamoDB APIs
+# that sleep for a fixed time per call.
+#
+# Usage: python benchmarks/bench_fanout.py [instances] [directories-per-region] [latency-ms-per-call]
+#
+
+import datetime
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ["REGIONLIST"] = "us-east-1,us-west-2,eu-west-1,ap-southeast-2"
+os.environ["IMPORTDIFF"] = "false" # Write every instance so each run does the same work
+
+import fakeaws
+import workspaces_clients
+
+def MakeFleet(Instances, DirectoriesPerRegion, Regions):
+    Fleet = {Region:{"Instances":[], "Directories":[], "Connected":{}} for Region in Regions}
+    for Region in Regions:
+        for Index in range(DirectoriesPerRegion):
+            Fleet[Region]["Directories"].append({"DirectoryId":"d-%s-%02d" % (Region, Index), "RegistrationCode":"SLiad+%s%02d" % (Region[:2].upper(), Index)})
+
+    for Index in range(Instances):
+        Region    = Regions[Index%len(Regions)]
+        Directory = Fleet[Region]["Directories"][(Index//len(Regions))%DirectoriesPerRegion]
+        Instance  = {"WorkspaceId":"ws-%09d" % Index,
+                     "DirectoryId":Directory["DirectoryId"],
+                     "UserName":"user%06d" % Index,
+                     "IpAddress":"10.0.%d.%d" % ((Index//256)%256, Index%256),
+                     "State":"AVAILABLE",
+                     "ComputerName":"WSAMZN-%07d" % Index,
+                     "WorkspaceProperties":{"RunningMode":"AUTO_STOP"}}
+        Fleet[Region]["Instances"].append(Instance)
+        if Index%3 != 0:
+            Fleet[Region]["Connected"][Instance["WorkspaceId"]] = datetime.datetime.fromtimestamp(1700000000+Index)
+
+    return(Fleet)
+
+def main():
+    Instances   = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    Directories = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    Latency     = float(sys.argv[3])/1000 if len(sys.argv) > 3 else 0.02
+
+    logging.disable(logging.INFO)
+
+    Regions = os.environ["REGIONLIST"].split(",")
+    Fleet   = MakeFleet(Instances, Directories, Regions)
+
+    Table = fakeaws.FakeDynamoDB(Latency=Latency/4)
+    workspaces_clients.SetClient("dynamodb", Table)
+    for Region in Regions:
+        workspaces_clients.SetClient("workspaces", fakeaws.FakeWorkspaces(Fleet[Region]["Instances"], Fleet[Region]["Directories"],
+                                                                          Fleet[Region]["Connected"], Latency), Region)
+
+    import lambda_workspaces_import as Import
+    import workspaces_dispatch
+
+    print("%d instances, %d regions, %d directories per region, %.0f ms per call" % (Instances, len(Regions), Directories, Latency*1000))
+
+    for Shards in [1, 2, 4, 8]:
+        Import.ShardCount = Shards
+        Import.Dispatcher = workspaces_dispatch.ProcessPoolDispatcher(Import.lambda_handler, Workers=Shards)
+
+        Start  = time.perf_counter()
+        Result = Import.lambda_handler({}, None)
+        Elapsed = time.perf_counter()-Start
+
+        Written = Result["Writes"]["Written"]
+        Label   = "single" if Shards == 1 else str(Shards)+" shards"
+        Sizes   = ",".join([str(Shard["Weight"]) for Shard in Result.get("Shards", [])])
+        print("%-10s %8.2f s %8d written %9.0f instances/s  %s" % (Label, Elapsed, Written, Written/Elapsed, Sizes))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Compares the per-user page load of lambda_workspaces_list_instances when it
+# scans the whole table against a Query on the UserName index, and the admin
+# ListAll view with a sequential scan against a parallel (segmented) scan,
+# using a synthetic table held in memory. It then repeats page loads against
+# the response cache: a hit, a revalidation that gets a 304, and a miss after
+# the table generation has been bumped.
+#
+# Usage: python benchmarks/bench_list_instances.py [rows] [latency-ms-per-call]
+#
+
+import json
+import logging
+import os
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakeaws
+import workspaces_clients
+import workspaces_metadata
+
+def MakeFleet(Rows):
+    Items = []
+    for Index in range(Rows):
+        Items.append({"WorkspaceId":  "ws-%09d" % Index,
+                      "UserName":     "user%06d" % (Index//2), # Two instances per user
+                      "Region":       "ap-southeast-2",
+                      "InstanceState":"AVAILABLE",
+                      "LastTouched":  Decimal("1700000000.123456"),
+                      "RunningMode":  "AUTO_STOP",
+                      "RegCode":      "SLiad+ABCDEF",
+                      "ComputerName": "WSAMZN-%07d" % Index,
+                      "IPAddress":    "10.0.%d.%d" % ((Index//256)%256, Index%256),
+                      "LastConnected":Decimal(1700000000+Index)})
+    return(Items)
+
+def Run(Handler, Table, Event, Label):
+    Table.Calls     = {}
+    Table.ReadUnits = 0.0
+    Table.ItemsRead = 0
+
+    Start    = time.perf_counter()
+    Response = Handler.lambda_handler(Event, None)
+    Elapsed  = time.perf_counter()-Start
+
+    Returned = len(json.loads(Response["body"])["Workspaces"]) if Response["statusCode"] == 200 else 0
+    print("%-12s %9.1f ms %6d calls %9.1f RCU %7d items read %3d returned %3d status %7d bytes" %
+          (Label, Elapsed*1000, sum(Table.Calls.values()), Table.ReadUnits, Table.ItemsRead, Returned,
+           Response["statusCode"], len(Response["body"])))
+    return(Response)
+
+def main():
+    Rows    = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    Latency = float(sys.argv[2])/1000 if len(sys.argv) > 2 else 0.005
+
+    logging.disable(logging.INFO)
+
+    Table = fakeaws.FakeTable(Indexes={"UserName-index":"UserName"}, Latency=Latency, SecondsPerMB=0.05)
+    Table.Load(MakeFleet(Rows))
+    workspaces_clients.SetResource("dynamodb", fakeaws.FakeResource([Table]))
+    Metadata = fakeaws.FakeDynamoDB(Latency=Latency) # Only used for the table generation
+    workspaces_clients.SetClient("dynamodb", Metadata)
+
+    import lambda_workspaces_list_instances as Handler
+
+    Event = {"headers":{"Authorization":fakeaws.MakeToken("user%06d" % (Rows//4), "UserGroupMember")}}
+    print("Synthetic table: %d rows, %.1f ms per call" % (Rows, Latency*1000))
+
+    Handler.ListCacheTTL = 0 # Measure the table reads first
+
+    Handler.UserNameIndex = ""
+    Run(Handler, Table, Event, "Scan")
+
+    Handler.UserNameIndex = "UserName-index"
+    Run(Handler, Table, Event, "Query")
+
+    Handler.UserNameIndex = "Missing-index"
+    Run(Handler, Table, Event, "Fallback")
+
+    Event = {"headers":{"Authorization":fakeaws.MakeToken("admin", "AdminGroupMember")},
+             "queryStringParameters":{"ListAll":"True"}}
+    for Segments in [1, 4, 8]:
+        Handler.ScanSegments = Segments
+        Run(Handler, Table, Event, "ListAll/%d" % Segments)
+
+    #
+    # Table calls and RCUs below don't include the consistent read of the
+    # generation, which is one more call and 1 RCU per request
+    #
+    print("Response cache (each request also reads the generation)")
+    Handler.ListCacheTTL = 60
+    Handler.ScanSegments = 4
+    Handler.ListCache.Clear()
+    Response = Run(Handler, Table, Event, "ListAll/miss")
+    Run(Handler, Table, Event, "ListAll/hit")
+    Revalidate = {"headers":dict(Event["headers"], **{"If-None-Match":Response["headers"]["ETag"]}),
+                  "queryStringParameters":Event["queryStringParameters"]}
+    Run(Handler, Table, Revalidate, "ListAll/304")
+    workspaces_metadata.BumpGeneration(Metadata)
+    Run(Handler, Table, Revalidate, "ListAll/bump")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#
+# Reaps a mass decommission. A fleet is imported, then --decommission of
+# its instances disappear from the stand-in Workspaces API and the reaper
+# is run in "check" and then "diff" mode (each against a freshly imported
+# table). AD computer objects are removed from a fakeaws.FakeDirectory in
+# place of the domain controllers, through the same rate limited queue.
+#
+# For each mode it reports the time taken, the Workspaces API calls made,
+# the computer objects removed and the rate they were removed at, and how
+# many stale rows were left in the table. Rows are only deleted once their
+# computer object has gone, so with a short --timeout (the function's
+# remaining time) or --ad-errors some are left for the next run.
+#
+# Usage: python benchmarks/bench_reaper.py [--instances 20000] [--decommission 5000]
+#            [--latency MS] [--ad-latency MS] [--ad-rate N] [--ad-shards N]
+#            [--ad-errors FRACTION] [--timeout SECONDS]
+#
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+class FakeContext:
+    def __init__(self, Seconds):
+        self.Until = time.monotonic()+Seconds
+
+    def get_remaining_time_in_millis(self):
+        return(int((self.Until-time.monotonic())*1000))
+
+def main():
+    Parser = argparse.ArgumentParser(description="Reaper check and diff modes against a mass decommission")
+    Parser.add_argument("--instances", type=int, default=20000, help="instances in the fleet")
+    Parser.add_argument("--decommission", type=int, default=5000, help="instances that have gone")
+    Parser.add_argument("--latency", type=float, default=5.0, help="milliseconds per API call")
+    Parser.add_argument("--ad-latency", type=float, default=2.0, help="milliseconds per LDAP operation")
+    Parser.add_argument("--ad-rate", type=float, default=500, help="ADRATE - computer objects removed per second")
+    Parser.add_argument("--ad-shards", type=int, default=4, help="ADSHARDS - LDAP connections")
+    Parser.add_argument("--ad-errors", type=float, default=0.0, help="fraction of LDAP removals that fail")
+    Parser.add_argument("--timeout", type=float, default=300, help="seconds the reaper has to run")
+    Arguments = Parser.parse_args()
+
+    # Read when the modules are first imported
+    os.environ["REGIONLIST"] = "us-east-1,us-west-2,eu-west-1,ap-southeast-2"
+    os.environ["ADRATE"]     = str(Arguments.ad_rate)
+    os.environ["ADSHARDS"]   = str(Arguments.ad_shards)
+    logging.disable(logging.CRITICAL) # --ad-errors makes plenty of expected errors
+
+    import bench_fanout
+    import fakeaws
+    import workspaces_clients
+    import lambda_workspaces_import as Import
+    import lambda_workspaces_reaper as Reaper
+
+    Regions = os.environ["REGIONLIST"].split(",")
+    Latency = Arguments.latency/1000
+    Fleet   = bench_fanout.MakeFleet(Arguments.instances, 5, Regions)
+    Gone    = set(["ws-%09d" % Index for Index in range(0, Arguments.instances, max(1, Arguments.instances//max(1, Arguments.decommission)))][:Arguments.decommission])
+
+    print("%d instances in %d regions, %d decommissioned, %.1f ms per API call, AD: %.0f removals/s over %d shards" %
+          (Arguments.instances, len(Regions), len(Gone), Arguments.latency, Arguments.ad_rate, Arguments.ad_shards))
+    print("%-6s %8s %10s %10s %9s %10s %11s" % ("Mode", "Seconds", "API calls", "AD removed", "AD per s", "Rows left", "AD deferred"))
+    for Mode in ["check", "diff"]:
+        Table = fakeaws.FakeDynamoDB(Latency=Latency)
+        workspaces_clients.SetClient("dynamodb", Table)
+        Clients = []
+        for Region in Regions:
+            Client = fakeaws.FakeWorkspaces(Fleet[Region]["Instances"], Fleet[Region]["Directories"], Fleet[Region]["Connected"], Latency)
+            workspaces_clients.SetClient("workspaces", Client, Region)
+            Clients.append(Client)
+        Import.lambda_handler({}, None)
+
+        for Client in Clients:
+            Client.SetInstances([Instance for Instance in Client.Instances if Instance["WorkspaceId"] not in Gone])
+            Client.ResetCounters()
+        Directory = fakeaws.FakeDirectory([Instance["ComputerName"] for Region in Regions for Instance in Fleet[Region]["Instances"]],
+                                          Arguments.ad_latency/1000, Arguments.ad_errors)
+        Reaper.GetTarget  = lambda: Directory
+        Reaper.ReaperMode = Mode
+
+        Start   = time.time()
+        Summary = Reaper.lambda_handler({}, FakeContext(Arguments.timeout))
+        Seconds = time.time()-Start
+
+        Calls   = sum([sum(Client.Calls.values()) for Client in Clients])
+        Removed = len(Directory.Removals)
+        Rate    = (Removed-1)/(Directory.Removals[-1]-Directory.Removals[0]) if Removed > 1 else 0
+        Left    = len([Key for Key in Table.Items if Table.Items[Key]["WorkspaceId"]["S"] in Gone])
+        print("%-6s %8.2f %10d %10d %9.0f %10d %11d" % (Mode, Seconds, Calls, Removed, Rate, Left, Summary.get("AD", {}).get("Deferred", 0)))
+        if Directory.MostOpen > Arguments.ad_shards: print("  More LDAP connections open at once than shards: %d" % Directory.MostOpen)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Measures what the compact schema (workspaces_schema.py) saves on a
+# synthetic fleet: item size, the read units of a full table scan (as the
+# import, reaper and admin view do), and the bytes list_instances returns
+# for each view. The table is converted with migrate_schema.py along the way
+# and every item is checked to read back the same as before.
+#
+# Usage: python benchmarks/bench_schema.py [instances]
+#
+
+import json
+import logging
+import os
+import sys
+import time
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench_list_instances
+import fakeaws
+import migrate_schema
+import workspaces_clients
+import workspaces_schema
+
+def MakeItems(Instances):
+    Serialiser = TypeSerializer()
+    Items      = []
+    for (Index, Item) in enumerate(bench_list_instances.MakeFleet(Instances)):
+        Item["DirectoryId"]   = "d-%010d" % (Index%20)
+        Item["Version"]       = Decimal(1700000000123456+Index)
+        Item["InstanceState"] = ["AVAILABLE", "STOPPED", "STARTING"][Index%3]
+        Items.append({Name:Serialiser.serialize(Value) for Name, Value in Item.items()})
+    return(Items)
+
+def ScanUnits(Table, **Args):
+    # Read units for a full scan and the bytes the scan returns
+    Table.ReadUnits = 0.0
+    Bytes    = 0
+    StartKey = None
+    while True:
+        Result = Table.scan(Table.TableName, ExclusiveStartKey=StartKey, **Args)
+        Bytes += sum([fakeaws.TypedItemSize(Item) for Item in Result["Items"]])
+        if "LastEvaluatedKey" not in Result: return(Table.ReadUnits, Bytes)
+        StartKey = Result["LastEvaluatedKey"]
+
+def ListBytes(Handler, Items, View):
+    Deserialiser = TypeDeserializer()
+    Table = fakeaws.FakeTable(Indexes={"UserName-index":"UserName"})
+    Table.Load([{Name:Deserialiser.deserialize(Value) for Name, Value in Item.items()} for Item in Items])
+    workspaces_clients.SetResource("dynamodb", fakeaws.FakeResource([Table]))
+
+    Event = {"headers":{"Authorization":fakeaws.MakeToken("admin", "AdminGroupMember")},
+             "queryStringParameters":{"ListAll":"True"}}
+    if View is not None: Event["queryStringParameters"]["View"] = View
+    Response = Handler.lambda_handler(Event, None)
+    return(Table.ReadUnits, len(Response["body"]))
+
+def main():
+    Instances = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    logging.disable(logging.WARNING)
+
+    Table = fakeaws.FakeDynamoDB()
+    workspaces_clients.SetClient("dynamodb", Table)
+    import lambda_workspaces_list_instances as Handler
+    import lambda_workspaces_reaper as Reaper
+    Handler.ListCacheTTL = 0
+
+    Long = MakeItems(Instances)
+    for Item in Long: Table.Items[Item["WorkspaceId"]["S"]] = Item
+    print("Synthetic fleet: %d instances" % Instances)
+
+    def Report(Label, Items):
+        (Units, Bytes) = ScanUnits(Table)
+        (Projection, Names) = workspaces_schema.Projection(Reaper.ReaperAttributes)
+        (ReaperUnits, ReaperBytes) = ScanUnits(Table, ProjectionExpression=Projection, ExpressionAttributeNames=Names)
+        print("%-8s %6.1f bytes/item %8.1f RCU per scan %9d bytes scanned %9d bytes to the reaper" %
+              (Label, sum(map(workspaces_schema.ItemSize, Items))/len(Items), Units, Bytes, ReaperBytes))
+        for View in [None, "user", "admin"]:
+            (ListUnits, ListBody) = ListBytes(Handler, Items, View)
+            print("         ListAll View=%-6s %8.1f RCU %9d bytes returned" % (View, ListUnits, ListBody))
+
+    Report("Long", Long)
+
+    workspaces_schema.CompactWrites = True
+    Start   = time.perf_counter()
+    Summary = migrate_schema.Migrate(Table, Table.TableName)
+    print("Migrated in %.2f s: %s" % (time.perf_counter()-Start, json.dumps(Summary)))
+    print("Second run: %s" % json.dumps(migrate_schema.Migrate(Table, Table.TableName)))
+
+    Compact = list(Table.Items.values())
+    Report("Compact", Compact)
+
+    #
+    # Apart from LastTouched (now whole seconds) every item must read back
+    # exactly as it was written in the long form
+    #
+    Different = 0
+    for Item in Long:
+        Before = dict(Item, LastTouched={"N":str(int(float(Item["LastTouched"]["N"])))})
+        if workspaces_schema.Expand(Table.Items[Item["WorkspaceId"]["S"]]) != Before: Different += 1
+    print("%d items read back differently" % Different)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Runs the import, reaper, list and actions functions against synthetic
+# fleets spread over several regions, using the in-process stand-ins in
+# fakeaws.py (with per call latency, 25 item pages and optional throttling).
+# For each step it reports the wall time, the API calls made (and how many
+# were throttled), DynamoDB read and write units and the peak memory used
+# above what the process held before the step.
+#
+# The stand-in tables live in the same process, so memory they gain (all
+# of the items, in import/initial) counts towards a step's peak.
+#
+# Each fleet runs in its own process so that module level caches and memory
+# don't carry over. The steps for a fleet run in order against the same
+# table, as they would in an account:
+#
+#   import/initial    first import into an empty table
+#   import/unchanged  second import, nothing has changed
+#   list/user         one user's instances, View=user (UserName index)
+#   list/admin        the ListAll view, View=admin (parallel scan)
+#   list/summary      the fleet summary the import saved, Summary=True
+#   actions/single    stop one instance
+#   actions/bulk      stop 1,000 instances with one bulk request
+#   reaper            1% of the instances have been deleted
+#
+# --save writes the results as JSON. --baseline compares against a saved
+# run and exits with status 1 if any step got slower, made more calls, used
+# more read or write units or more memory than --tolerance allows.
+#
+# Usage: python benchmarks/bench_suite.py [--fleets 1000,10000,100000] [--regions 4]
+#            [--directories 5] [--latency MS] [--throttle RATE] [--save FILE]
+#            [--baseline FILE] [--tolerance FRACTION]
+#
+
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+AllRegions = ["us-east-1", "us-west-2", "eu-west-1", "eu-central-1", "ap-southeast-2", "ap-northeast-1",
+              "ap-south-1", "sa-east-1", "ca-central-1", "eu-west-2"]
+BulkSize   = 1000
+
+#
+# Differences smaller than these are noise whatever the tolerance
+#
+NoiseFloor = {"Seconds":0.05, "Calls":2, "RCU":1.0, "WCU":2, "PeakMB":5.0}
+
+def MemoryStatus(Field):
+    Match = re.search(Field+r":\s+(\d+) kB", open("/proc/self/status").read())
+    return(int(Match.group(1))/1024)
+
+class PeakMemory:
+    #
+    # Peak memory of a step above what the process held when it started. On
+    # Linux the kernel's high water mark is reset (clear_refs) so this costs
+    # nothing while the step runs. Elsewhere tracemalloc is used, which
+    # only sees Python allocations and slows the step down.
+    #
+    def __enter__(self):
+        try:
+            with open("/proc/self/clear_refs", "w") as File: File.write("5")
+            self.Start = MemoryStatus("VmRSS")
+            self.Traced = False
+        except Exception:
+            tracemalloc.start()
+            self.Traced = True
+        return(self)
+
+    def __exit__(self, *Args):
+        if self.Traced:
+            self.MB = tracemalloc.get_traced_memory()[1]/(1024*1024)
+            tracemalloc.stop()
+        else:
+            self.MB = max(0.0, MemoryStatus("VmHWM")-self.Start)
+
+def Measure(Clients, Tables, Label, Step):
+    for Client in Clients+Tables: Client.ResetCounters()
+
+    with PeakMemory() as Memory:
+        Start  = time.perf_counter()
+        Step()
+        Elapsed = time.perf_counter()-Start
+
+    Calls = {}
+    for Client in Clients+Tables:
+        for Child in [Client]+list(getattr(Client, "Others", {}).values()):
+            for (Operation, Count) in Child.Calls.items(): Calls[Operation] = Calls.get(Operation, 0)+Count
+
+    Reads  = sum([Table.ReadUnits for Table in Tables])+sum([Other.ReadUnits for Table in Tables for Other in getattr(Table, "Others", {}).values()])
+    Writes = sum([getattr(Table, "WriteUnits", 0) for Table in Tables])+sum([Other.WriteUnits for Table in Tables for Other in getattr(Table, "Others", {}).values()])
+    return({"Step":Label, "Seconds":round(Elapsed, 3), "Calls":sum(Calls.values()), "ByOperation":Calls,
+            "Throttled":sum([Client.Throttles for Client in Clients+Tables]),
+            "RCU":Reads, "WCU":Writes, "PeakMB":round(Memory.MB, 1)})
+
+def RunFleet(Options):
+    # Imported here because bench_fanout sets its own environment when loaded
+    import bench_fanout
+    import fakeaws
+    import workspaces_clients
+    from boto3.dynamodb.types import TypeDeserializer
+
+    Regions = AllRegions[:Options.regions]
+    os.environ["REGIONLIST"]        = ",".join(Regions)
+    os.environ["IMPORTDIFF"]        = "true"
+    os.environ["BULKMAXINSTANCES"]  = str(BulkSize)
+    logging.disable(logging.WARNING)
+
+    Latency = Options.latency/1000
+    Fleet   = bench_fanout.MakeFleet(Options.fleet, Options.directories, Regions)
+    Table   = fakeaws.FakeDynamoDB(Latency=Latency, ThrottleRate=Options.throttle)
+    workspaces_clients.SetClient("dynamodb", Table)
+    Clients = []
+    for Region in Regions:
+        Client = fakeaws.FakeWorkspaces(Fleet[Region]["Instances"], Fleet[Region]["Directories"], Fleet[Region]["Connected"],
+                                        Latency, Options.throttle)
+        workspaces_clients.SetClient("workspaces", Client, Region)
+        Clients.append(Client)
+
+    import lambda_workspaces_import as Import
+    import lambda_workspaces_list_instances as List
+    import lambda_workspaces_actions as Actions
+    import lambda_workspaces_reaper as Reaper
+    List.ListCacheTTL = 0 # Measure the table reads rather than the response cache
+
+    Results = []
+    Results.append(Measure(Clients, [Table], "import/initial", lambda: Import.lambda_handler({}, None)))
+    Results.append(Measure(Clients, [Table], "import/unchanged", lambda: Import.lambda_handler({}, None)))
+
+    #
+    # list_instances reads through a boto3 resource so it gets a resource
+    # style copy of what the import wrote
+    #
+    Deserialiser = TypeDeserializer()
+    ListTable = fakeaws.FakeTable(Indexes={"UserName-index":"UserName"}, Latency=Latency, ThrottleRate=Options.throttle)
+    ListTable.Load([{Name:Deserialiser.deserialize(Value) for Name, Value in Item.items()} for Item in Table.Items.values()])
+    workspaces_clients.SetResource("dynamodb", fakeaws.FakeResource([ListTable]))
+
+    User  = {"headers":{"Authorization":fakeaws.MakeToken("user%06d" % (Options.fleet//2), "UserGroupMember")},
+             "queryStringParameters":{"View":"user"}}
+    Admin = {"headers":{"Authorization":fakeaws.MakeToken("admin", "AdminGroupMember")},
+             "queryStringParameters":{"ListAll":"True", "View":"admin"}}
+    Results.append(Measure(Clients, [Table, ListTable], "list/user", lambda: List.lambda_handler(User, None)))
+    Results.append(Measure(Clients, [Table, ListTable], "list/admin", lambda: List.lambda_handler(Admin, None)))
+    Summary = {"headers":Admin["headers"], "queryStringParameters":{"Summary":"True"}}
+    Results.append(Measure(Clients, [Table, ListTable], "list/summary", lambda: List.lambda_handler(Summary, None)))
+    del ListTable
+
+    Single = {"headers":Admin["headers"], "queryStringParameters":{"InstanceId":"ws-%09d" % 0, "Action":"Stop"}}
+    Bulk   = {"headers":Admin["headers"], "httpMethod":"POST",
+              "body":json.dumps({"Action":"Stop", "InstanceIds":["ws-%09d" % Index for Index in range(1, min(BulkSize, Options.fleet-1)+1)]})}
+    Results.append(Measure(Clients, [Table], "actions/single", lambda: Actions.lambda_handler(Single, None)))
+    Results.append(Measure(Clients, [Table], "actions/bulk", lambda: Actions.lambda_handler(Bulk, None)))
+
+    for Client in Clients:
+        Client.SetInstances([Instance for Instance in Client.Instances if int(Instance["WorkspaceId"][3:])%100 != 50])
+    Results.append(Measure(Clients, [Table], "reaper", lambda: Reaper.lambda_handler({}, None)))
+
+    for Result in Results: Result["Fleet"] = Options.fleet
+    return(Results)
+
+def Regressions(Results, Baseline, Tolerance):
+    Before   = {(Result["Fleet"], Result["Step"]):Result for Result in Baseline}
+    Problems = []
+    for Result in Results:
+        Old = Before.get((Result["Fleet"], Result["Step"]))
+        if Old is None: continue
+        for (Metric, Floor) in NoiseFloor.items():
+            if Result[Metric]-Old[Metric] > max(Floor, Old[Metric]*Tolerance):
+                Problems.append("%d %s: %s went from %s to %s" % (Result["Fleet"], Result["Step"], Metric, Old[Metric], Result[Metric]))
+    return(Problems)
+
+def main():
+    Parser = argparse.ArgumentParser()
+    Parser.add_argument("--fleets", default="1000,10000,100000")
+    Parser.add_argument("--fleet", type=int, help=argparse.SUPPRESS) # Set on the process that runs one fleet
+    Parser.add_argument("--regions", type=int, default=4)
+    Parser.add_argument("--directories", type=int, default=5)
+    Parser.add_argument("--latency", type=float, default=5.0)
+    Parser.add_argument("--throttle", type=float, default=0.0)
+    Parser.add_argument("--save")
+    Parser.add_argument("--baseline")
+    Parser.add_argument("--tolerance", type=float, default=0.2)
+    Options = Parser.parse_args()
+
+    if Options.fleet is not None:
+        print(json.dumps(RunFleet(Options)))
+        return
+
+    print("%d regions, %d directories per region, %.1f ms per call, %.0f%% of calls throttled" %
+          (Options.regions, Options.directories, Options.latency, Options.throttle*100))
+    print("%8s %-18s %9s %8s %9s %10s %9s %9s" % ("Fleet", "Step", "Seconds", "Calls", "Throttled", "RCU", "WCU", "Peak MB"))
+
+    Results = []
+    for Fleet in [int(Size) for Size in Options.fleets.split(",")]:
+        Command = [sys.executable, os.path.abspath(__file__), "--fleet", str(Fleet), "--regions", str(Options.regions),
+                   "--directories", str(Options.directories), "--latency", str(Options.latency), "--throttle", str(Options.throttle)]
+        Output = subprocess.run(Command, check=True, stdout=subprocess.PIPE, text=True).stdout
+        for Result in json.loads(Output.strip().splitlines()[-1]):
+            print("%8d %-18s %9.2f %8d %9d %10.1f %9d %9.1f" %
+                  (Result["Fleet"], Result["Step"], Result["Seconds"], Result["Calls"], Result["Throttled"],
+                   Result["RCU"], Result["WCU"], Result["PeakMB"]))
+            Results.append(Result)
+
+    if Options.save:
+        with open(Options.save, "w") as File: json.dump(Results, File, indent=1)
+
+    if Options.baseline:
+        with open(Options.baseline) as File: Problems = Regressions(Results, json.load(File), Options.tolerance)
+        for Problem in Problems: print("REGRESSION "+Problem)
+        if len(Problems) > 0: sys.exit(1)
+        print("No regressions against "+Options.baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Measures how soon the table shows the real state of instances after an
+# asynchronous bulk action. A fleet is imported, every instance is stopped
+# with one Async request, and the stand-in Workspaces API moves each
+# instance from STOPPING to STOPPED at a random time around --settle
+# seconds later. The watcher runs in a thread in place of its asynchronous
+# invocation and the script polls the job's status the way the front end
+# does.
+#
+# For each instance it reports how long after it really stopped the table
+# (and so the list function) showed STOPPED. Without the watcher the table
+# would show STOPPING until the next import. It also reports the calls the
+# watcher made.
+#
+# Usage: python benchmarks/bench_watch.py [--instances 1000] [--settle 3]
+#            [--interval 0.5] [--max-interval 4] [--latency MS]
+#
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench_fanout
+import fakeaws
+import workspaces_clients
+
+def main():
+    Parser = argparse.ArgumentParser(description="Time for asynchronous actions to show real states in the table")
+    Parser.add_argument("--instances", type=int, default=1000, help="instances to stop (at most 5000)")
+    Parser.add_argument("--settle", type=float, default=3.0, help="average seconds for an instance to stop")
+    Parser.add_argument("--interval", type=float, default=0.5, help="WATCHINTERVAL for the watcher")
+    Parser.add_argument("--max-interval", type=float, default=4.0, help="WATCHMAXINTERVAL for the watcher")
+    Parser.add_argument("--latency", type=float, default=5.0, help="milliseconds per API call")
+    Arguments = Parser.parse_args()
+
+    os.environ["REGIONLIST"] = "us-east-1,eu-west-1"
+    logging.disable(logging.WARNING)
+
+    Regions = os.environ["REGIONLIST"].split(",")
+    Latency = Arguments.latency/1000
+    Fleet   = bench_fanout.MakeFleet(Arguments.instances, 5, Regions)
+    Table   = fakeaws.FakeDynamoDB(Latency=Latency)
+    workspaces_clients.SetClient("dynamodb", Table)
+    Clients = []
+    for Region in Regions:
+        Client = fakeaws.FakeWorkspaces(Fleet[Region]["Instances"], Fleet[Region]["Directories"], Fleet[Region]["Connected"],
+                                        Latency, SettleAfter=Arguments.settle)
+        workspaces_clients.SetClient("workspaces", Client, Region)
+        Clients.append(Client)
+
+    import lambda_workspaces_import as Import
+    import lambda_workspaces_actions as Actions
+    Import.lambda_handler({}, None)
+
+    Watchers = []
+    def Launch(Event):
+        Watcher = threading.Thread(target=Actions.lambda_handler, args=(Event, None))
+        Watcher.start()
+        Watchers.append(Watcher)
+    Actions.Launcher         = Launch
+    Actions.WatchInterval    = Arguments.interval
+    Actions.WatchMaxInterval = Arguments.max_interval
+
+    Headers     = {"Authorization":fakeaws.MakeToken("admin", "AdminGroupMember")}
+    InstanceIds = ["ws-%09d" % Index for Index in range(Arguments.instances)]
+    for Client in Clients: Client.ResetCounters()
+    Table.ResetCounters()
+
+    Start  = time.time()
+    Result = json.loads(Actions.lambda_handler({"headers":Headers, "httpMethod":"POST",
+                                                "body":json.dumps({"Action":"Stop", "InstanceIds":InstanceIds, "Async":True})}, None)["body"])
+    Stopped = {}
+    for Client in Clients: Stopped.update({WorkspaceId:When for WorkspaceId, (When, State) in Client.Settling.items()})
+    print("Stopped %d instances in %.2f s, job %s" % (Result["Summary"]["Succeeded"], time.time()-Start, Result.get("JobId")))
+
+    #
+    # Poll the job like the front end, noting when each instance is first
+    # shown as STOPPED
+    #
+    Shown  = {}
+    Status = {"Status":"Running"}
+    Polls  = 0
+    while Status.get("Status") == "Running":
+        time.sleep(1)
+        Polls += 1
+        Status = json.loads(Actions.lambda_handler({"headers":Headers, "queryStringParameters":{"JobId":Result["JobId"]}}, None)["body"])
+        Now = time.time()
+        for (WorkspaceId, State) in Status["States"].items():
+            if State == "STOPPED" and WorkspaceId not in Shown: Shown[WorkspaceId] = Now
+    for Watcher in Watchers: Watcher.join()
+
+    Lags = sorted([Shown[WorkspaceId]-Stopped[WorkspaceId] for WorkspaceId in Shown])
+    print("Job %s after %.1f s and %d status polls, %d of %d shown as STOPPED" % (Status["Status"], time.time()-Start, Polls, len(Shown), len(InstanceIds)))
+    if len(Lags) > 0:
+        print("Shown after really stopping: p50 %.2f s  p95 %.2f s  max %.2f s" %
+              (statistics.median(Lags), Lags[int(len(Lags)*0.95)-1 if len(Lags) > 1 else 0], Lags[-1]))
+
+    Calls = {}
+    for Client in Clients + [Table]:
+        for (Operation, Count) in Client.Calls.items(): Calls[Operation] = Calls.get(Operation, 0)+Count
+    print("Calls: "+json.dumps(dict(sorted(Calls.items()))))
+
+    Wrong = [Item["WorkspaceId"]["S"] for Item in Table.Items.values() if "InstanceState" in Item and Item["InstanceState"]["S"] != "STOPPED"]
+    print("Items in the table not STOPPED: %d" % len(Wrong))
+
+if __name__ == "__main__":
+    main()
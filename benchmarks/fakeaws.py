@@ -0,0 +1,717 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# In-process stand-ins for the AWS APIs used by the portal so that the Lambda
+# functions can be run and measured locally without an AWS account. These
+# only model what the functions use - they are not general purpose emulators.
+#
+
+import base64
+import copy
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+from decimal import Decimal
+
+# Harnesses print their own results so leave out the EMF records unless METRICS=true is set
+os.environ.setdefault("METRICS", "false")
+
+PageBytes = 1024*1024 # DynamoDB stops reading a Scan or Query page after 1MB
+
+def Error(Code, Message, Operation):
+    return(ClientError({"Error":{"Code":Code, "Message":Message}}, Operation))
+
+def MakeToken(Username, Groups):
+    #
+    # An unsigned token of the shape the API Gateway authorizer passes on,
+    # for functions that don't check signatures (JWKSFILE not set)
+    #
+    Claims  = {"identities":[{"userId":"CORP\\"+Username}], "custom:ADGroups":Groups}
+    Payload = base64.urlsafe_b64encode(json.dumps(Claims).encode()).decode().rstrip("=")
+    return("header."+Payload+".signature")
+
+def ValueSize(Value):
+    if isinstance(Value, str): return(len(Value.encode()))
+    if isinstance(Value, bool) or Value is None: return(1)
+    if isinstance(Value, (int, float)) or type(Value).__name__ == "Decimal":
+        return(math.ceil(len(str(Value).lstrip("-").replace(".", ""))/2)+1)
+    if isinstance(Value, dict): return(3+sum([len(Name)+ValueSize(Child) for Name, Child in Value.items()]))
+    if isinstance(Value, (list, set, tuple)): return(3+sum([ValueSize(Child) for Child in Value]))
+    return(len(str(Value)))
+
+def ItemSize(Item):
+    # Approximation of the DynamoDB item size rules - attribute names count too
+    return(sum([len(Name.encode())+ValueSize(Value) for Name, Value in Item.items()]))
+
+def TypedItemSize(Item):
+    # The same for items in the typed ({"S":...}) form that clients use
+    return(sum([len(Name.encode())+ValueSize(list(Value.values())[0]) for Name, Value in Item.items()]))
+
+def ReadUnits(Bytes):
+    # Eventually consistent reads cost half a unit per 4KB read
+    return(math.ceil(Bytes/4096)*0.5)
+
+def Matches(Item, Condition):
+    if Condition is None: return(True)
+
+    Expression = Condition.get_expression()
+    if Expression["operator"] == "AND":
+        return(all([Matches(Item, Child) for Child in Expression["values"]]))
+    if Expression["operator"] == "=":
+        (Name, Value) = Expression["values"]
+        return(Item.get(Name.name) == Value)
+
+    raise NotImplementedError("Condition not supported by the stand-in: "+Expression["operator"])
+
+class FakeClient:
+    #
+    # Latency, call counting and throttling shared by the stand-ins. Every
+    # call sleeps for Latency seconds (plus SecondsPerMB for each MB read).
+    # A ThrottleRate fraction of calls is throttled and, as botocore would,
+    # retried after a jittered backoff - each attempt counts as a call and
+    # in Throttles. The error only reaches the caller after MaxAttempts
+    # (MAXATTEMPTS in workspaces_clients). Backoff is much shorter than
+    # botocore's so throttled runs still finish quickly.
+    #
+    MaxAttempts  = 5
+    ThrottleCode = "ThrottlingException"
+
+    def __init__(self, Latency=0.0, ThrottleRate=0.0, Backoff=0.01, SecondsPerMB=0.0, Seed=1):
+        self.Latency      = Latency
+        self.ThrottleRate = ThrottleRate
+        self.Backoff      = Backoff
+        self.SecondsPerMB = SecondsPerMB
+        self.Random       = random.Random(Seed)
+        self.Lock         = threading.Lock() # Callers use several threads
+        self.Calls        = {}
+        self.Throttles    = 0
+
+    def Throttled(self):
+        if self.ThrottleRate <= 0: return(False)
+        with self.Lock:
+            return(self.Random.random() < self.ThrottleRate)
+
+    def Call(self, Operation, Bytes=0, Throttle=True):
+        Attempt = 0
+        while True:
+            Delay = self.Latency+self.SecondsPerMB*Bytes/(1024*1024)
+            if Delay > 0: time.sleep(Delay)
+            with self.Lock:
+                self.Calls[Operation] = self.Calls.get(Operation, 0)+1
+
+            if not Throttle or not self.Throttled(): return
+
+            Attempt += 1
+            with self.Lock:
+                self.Throttles += 1
+                Pause = self.Random.uniform(0, self.Backoff*(2**Attempt))
+            if Attempt >= self.MaxAttempts: raise Error(self.ThrottleCode, "Rate exceeded", Operation)
+            time.sleep(Pause)
+
+    def Unprocessed(self, Requests):
+        # Batch calls aren't retried by botocore - a throttled batch hands some requests back instead
+        if self.ThrottleRate <= 0: return(Requests, [])
+        with self.Lock:
+            Throttled = [self.Random.random() < self.ThrottleRate for Request in Requests]
+            self.Throttles += sum(Throttled)
+        return([Request for (Request, Skip) in zip(Requests, Throttled) if not Skip],
+               [Request for (Request, Skip) in zip(Requests, Throttled) if Skip])
+
+    def ResetCounters(self):
+        with self.Lock:
+            self.Calls     = {}
+            self.Throttles = 0
+
+class FakeTable(FakeClient):
+    #
+    # Resource style (boto3.resource("dynamodb").Table()) table held in memory.
+    # Items are stored in insertion order. Every call is counted and can be
+    # given a fixed latency to model the network round trip, plus a time per
+    # MB read to model the work DynamoDB does server side.
+    #
+    ThrottleCode = "ProvisionedThroughputExceededException"
+
+    def __init__(self, Name="WorkspacesPortal", HashKey="WorkspaceId", Indexes=None, Latency=0.0, SecondsPerMB=0.0, ThrottleRate=0.0):
+        FakeClient.__init__(self, Latency, ThrottleRate, SecondsPerMB=SecondsPerMB)
+        self.Name         = Name
+        self.HashKey      = HashKey
+        self.Indexes      = Indexes or {} # IndexName -> hash key attribute
+        self.Items        = {}
+        self.Sizes        = {}
+        self.Keys         = []
+        self.IndexKeys    = {IndexName:{} for IndexName in self.Indexes}
+        self.SegmentKeys  = {}
+        self.ReadUnits    = 0.0
+        self.ItemsRead    = 0
+
+    def Load(self, Items):
+        for Item in Items:
+            Key = Item[self.HashKey]
+            if Key not in self.Items:
+                self.Keys.append(Key)
+                for IndexName, Attribute in self.Indexes.items():
+                    if Attribute in Item: self.IndexKeys[IndexName].setdefault(Item[Attribute], []).append(Key)
+            self.Items[Key] = Item
+            self.Sizes[Key] = ItemSize(Item)
+        self.SegmentKeys = {}
+
+    def ResetCounters(self):
+        FakeClient.ResetCounters(self)
+        self.ReadUnits = 0.0
+        self.ItemsRead = 0
+
+    def Segments(self, TotalSegments):
+        if TotalSegments not in self.SegmentKeys:
+            Segments = [[] for Segment in range(TotalSegments)]
+            for Key in self.Keys: Segments[zlib.crc32(str(Key).encode())%TotalSegments].append(Key)
+            self.SegmentKeys[TotalSegments] = [(Keys, {Key:Index for Index, Key in enumerate(Keys)}) for Keys in Segments]
+        return(self.SegmentKeys[TotalSegments])
+
+    def ReadPage(self, Operation, Keys, Start, Condition, Limit, ProjectionExpression=None, ExpressionAttributeNames=None):
+        # A projection only trims what is returned - the whole item is still read and charged for
+        Wanted = None
+        if ProjectionExpression is not None:
+            Wanted = [(ExpressionAttributeNames or {}).get(Name.strip(), Name.strip()) for Name in ProjectionExpression.split(",")]
+
+        Items = []
+        Bytes = 0
+        Last  = None
+        Index = Start
+        while Index < len(Keys):
+            Key    = Keys[Index]
+            Item   = self.Items[Key]
+            Bytes += self.Sizes[Key]
+            Index += 1
+            if Matches(Item, Condition):
+                Items.append(dict(Item) if Wanted is None else {Name:Item[Name] for Name in Wanted if Name in Item})
+            if Bytes >= PageBytes or (Limit is not None and Index-Start >= Limit):
+                Last = Key
+                break
+
+        self.Call(Operation, Bytes)
+        with self.Lock:
+            self.ItemsRead += Index-Start
+            self.ReadUnits += ReadUnits(Bytes)
+
+        Result = {"Items":Items, "Count":len(Items), "ScannedCount":Index-Start}
+        if Last is not None and Index < len(Keys): Result["LastEvaluatedKey"] = {self.HashKey:Last}
+        return(Result)
+
+    def scan(self, FilterExpression=None, ExclusiveStartKey=None, Limit=None, Segment=None, TotalSegments=None, **Args):
+        if TotalSegments is None:
+            (Keys, Position) = (self.Keys, None)
+        else:
+            (Keys, Position) = self.Segments(TotalSegments)[Segment]
+
+        Start = 0
+        if ExclusiveStartKey is not None:
+            if Position is None: Position = self.Position()
+            Start = Position[ExclusiveStartKey[self.HashKey]]+1
+
+        return(self.ReadPage("Scan", Keys, Start, FilterExpression, Limit, Args.get("ProjectionExpression"), Args.get("ExpressionAttributeNames")))
+
+    def Position(self):
+        if None not in self.SegmentKeys: self.SegmentKeys[None] = {Key:Index for Index, Key in enumerate(self.Keys)}
+        return(self.SegmentKeys[None])
+
+    def query(self, IndexName=None, KeyConditionExpression=None, ExclusiveStartKey=None, Limit=None, **Args):
+        if IndexName is not None and IndexName not in self.Indexes:
+            self.Call("Query")
+            raise Error("ValidationException", "The table does not have the specified index: "+IndexName, "Query")
+
+        (Attribute, Value) = KeyConditionExpression.get_expression()["values"]
+        if IndexName is None:
+            Keys = [Value] if Value in self.Items else []
+        else:
+            Keys = self.IndexKeys[IndexName].get(Value, [])
+
+        Start = 0
+        if ExclusiveStartKey is not None: Start = Keys.index(ExclusiveStartKey[self.HashKey])+1
+
+        return(self.ReadPage("Query", Keys, Start, None, Limit, Args.get("ProjectionExpression"), Args.get("ExpressionAttributeNames")))
+
+class FakeResource:
+    def __init__(self, Tables):
+        self.Tables = {Table.Name:Table for Table in Tables}
+
+    def Table(self, Name):
+        return(self.Tables[Name])
+
+class CannedResponses:
+    #
+    # Answers API calls made by real boto3 clients with fixed responses by
+    # hooking botocore's before-call event, so parameter validation and the
+    # resource layer still run but nothing is sent over the network. Register
+    # it on a session before creating clients from it.
+    #
+    def __init__(self, Responses):
+        self.Responses = Responses
+        self.Calls     = {}
+
+    def Register(self, Session):
+        Session.events.register("before-call", self.Answer)
+
+    def Answer(self, model, **Kwargs):
+        self.Calls[model.name] = self.Calls.get(model.name, 0)+1
+
+        # Copied because the resource layer deserialises responses in place
+        Parsed = copy.deepcopy(self.Responses[model.name])
+        Parsed["ResponseMetadata"] = {"HTTPStatusCode":200, "RetryAttempts":0}
+
+        # Returning (http response, parsed response) from before-call skips the HTTP request
+        return((AWSResponse("https://localhost/", 200, {}, None), Parsed))
+
+def WriteUnits(Bytes):
+    # Standard writes cost a unit per 1KB written
+    return(max(1, math.ceil(Bytes/1024)))
+
+class FakePaginator:
+    def __init__(self, Method):
+        self.Method = Method
+
+    def paginate(self, PaginationConfig=None, **Args):
+        Token = None
+        while True:
+            if Token is None:
+                Page = self.Method(**Args)
+            else:
+                Page = self.Method(NextToken=Token, **Args)
+            yield(Page)
+
+            Token = Page.get("NextToken")
+            if Token is None: return
+
+class FakeWorkspaces(FakeClient):
+    #
+    # Client style Workspaces API for one region. Instances are given in the
+    # shape describe_workspaces returns them and Connected maps WorkspaceId
+    # to the last connection time. Pages are 25 long like the real API and
+    # every call sleeps for Latency seconds.
+    #
+    # Actions leave instances in their transitional state (STARTING and so
+    # on) unless SettleAfter is set. They then reach their final state
+    # somewhere between half and one and a half times SettleAfter seconds
+    # later, and terminated instances disappear.
+    #
+    PageSize = 25
+    Settled  = {"STARTING":"AVAILABLE", "STOPPING":"STOPPED", "REBOOTING":"AVAILABLE", "REBUILDING":"AVAILABLE", "TERMINATING":None}
+
+    def __init__(self, Instances, Directories, Connected=None, Latency=0.0, ThrottleRate=0.0, SettleAfter=None):
+        FakeClient.__init__(self, Latency, ThrottleRate)
+        self.Directories = Directories
+        self.Connected   = Connected or {}
+        self.SettleAfter = SettleAfter
+        self.Settling    = {} # WorkspaceId -> (time, final state)
+        self.SetInstances(Instances)
+
+    def SetInstances(self, Instances):
+        # Indexed so large fleets don't make every call walk the whole list
+        self.Instances   = Instances
+        self.ById        = {Instance["WorkspaceId"]:Instance for Instance in Instances}
+        self.ByDirectory = {}
+        for Instance in Instances: self.ByDirectory.setdefault(Instance["DirectoryId"], []).append(Instance)
+
+    def Act(self, Operation, Requests, State):
+        self.Call(Operation)
+        Failed = []
+        for Request in Requests:
+            if Request["WorkspaceId"] in self.ById:
+                self.ById[Request["WorkspaceId"]]["State"] = State
+                if self.SettleAfter is not None:
+                    with self.Lock:
+                        self.Settling[Request["WorkspaceId"]] = (time.time()+self.SettleAfter*self.Random.uniform(0.5, 1.5), self.Settled[State])
+            else:
+                Failed.append({"WorkspaceId":Request["WorkspaceId"], "ErrorCode":"ResourceNotFound.Workspace",
+                               "ErrorMessage":"The WorkSpace "+Request["WorkspaceId"]+" could not be found."})
+        return({"FailedRequests":Failed})
+
+    def start_workspaces(self, StartWorkspaceRequests):
+        return(self.Act("StartWorkspaces", StartWorkspaceRequests, "STARTING"))
+
+    def stop_workspaces(self, StopWorkspaceRequests):
+        return(self.Act("StopWorkspaces", StopWorkspaceRequests, "STOPPING"))
+
+    def reboot_workspaces(self, RebootWorkspaceRequests):
+        return(self.Act("RebootWorkspaces", RebootWorkspaceRequests, "REBOOTING"))
+
+    def rebuild_workspaces(self, RebuildWorkspaceRequests):
+        return(self.Act("RebuildWorkspaces", RebuildWorkspaceRequests, "REBUILDING"))
+
+    def terminate_workspaces(self, TerminateWorkspaceRequests):
+        return(self.Act("TerminateWorkspaces", TerminateWorkspaceRequests, "TERMINATING"))
+
+    def Page(self, Key, Items, NextToken):
+        Start  = int(NextToken or 0)
+        Result = {Key:Items[Start:Start+self.PageSize]}
+        if Start+self.PageSize < len(Items): Result["NextToken"] = str(Start+self.PageSize)
+        return(Result)
+
+    def get_paginator(self, Operation):
+        return(FakePaginator(getattr(self, Operation)))
+
+    def Settle(self):
+        with self.Lock:
+            Now  = time.time()
+            Done = [WorkspaceId for WorkspaceId, (When, State) in self.Settling.items() if When <= Now]
+            for WorkspaceId in Done:
+                State = self.Settling.pop(WorkspaceId)[1]
+                if State is not None:
+                    self.ById[WorkspaceId]["State"] = State
+                    continue
+                Instance = self.ById.pop(WorkspaceId)
+                self.Instances = [Other for Other in self.Instances if Other is not Instance]
+                self.ByDirectory[Instance["DirectoryId"]].remove(Instance)
+
+    def describe_workspaces(self, DirectoryId=None, WorkspaceIds=None, NextToken=None, Limit=None):
+        self.Call("DescribeWorkspaces")
+        if len(self.Settling) > 0: self.Settle()
+        Instances = self.Instances
+        if DirectoryId is not None: Instances = self.ByDirectory.get(DirectoryId, [])
+        if WorkspaceIds is not None:
+            Instances = [self.ById[Id] for Id in WorkspaceIds
+                         if Id in self.ById and (DirectoryId is None or self.ById[Id]["DirectoryId"] == DirectoryId)]
+        return(copy.deepcopy(self.Page("Workspaces", Instances, NextToken)))
+
+    def describe_workspace_directories(self, NextToken=None):
+        self.Call("DescribeWorkspaceDirectories")
+        return(copy.deepcopy(self.Page("Directories", self.Directories, NextToken)))
+
+    def describe_workspaces_connection_status(self, WorkspaceIds=None, NextToken=None):
+        self.Call("DescribeWorkspacesConnectionStatus")
+        if WorkspaceIds is not None and len(WorkspaceIds) > self.PageSize:
+            raise Error("ValidationException", "Too many WorkspaceIds", "DescribeWorkspacesConnectionStatus")
+
+        Ids = WorkspaceIds
+        if Ids is None: Ids = [Instance["WorkspaceId"] for Instance in self.Instances]
+
+        Result   = self.Page("WorkspacesConnectionStatus", Ids, NextToken)
+        Statuses = []
+        for WorkspaceId in Result["WorkspacesConnectionStatus"]:
+            Status = {"WorkspaceId":WorkspaceId, "ConnectionState":"DISCONNECTED"}
+            if WorkspaceId in self.Connected: Status["LastKnownUserConnectionTimestamp"] = self.Connected[WorkspaceId]
+            Statuses.append(Status)
+        Result["WorkspacesConnectionStatus"] = Statuses
+        return(Result)
+
+class FakeDirectory(FakeClient):
+    #
+    # Stand-in for the domain controllers the reaper removes computer
+    # objects from - used in place of workspaces_adcleanup.LDAPTarget. It
+    # holds a set of computer names and hands out connections the way
+    # LDAPTarget does. Every search and delete is a call, an ErrorRate
+    # fraction of removals fail (and close the connection, as a dropped LDAP
+    # session would) and the time of each removal is kept so harnesses can
+    # check the rate.
+    #
+    def __init__(self, ComputerNames, Latency=0.0, ErrorRate=0.0, Seed=1):
+        FakeClient.__init__(self, Latency, Seed=Seed)
+        self.Computers   = set([Name.upper() for Name in ComputerNames])
+        self.ErrorRate   = ErrorRate
+        self.Removals    = []
+        self.Connections = 0
+        self.Open        = 0
+        self.MostOpen    = 0
+
+    def Connect(self):
+        self.Call("Bind", Throttle=False)
+        with self.Lock:
+            self.Connections += 1
+            self.Open        += 1
+            self.MostOpen     = max(self.MostOpen, self.Open)
+        return(FakeDirectoryConnection(self))
+
+class FakeDirectoryConnection:
+    def __init__(self, Directory):
+        self.Directory = Directory
+        self.Closed    = False
+
+    def Remove(self, ComputerName):
+        if self.Closed: raise Exception("Connection closed")
+
+        Directory = self.Directory
+        Directory.Call("Search", Throttle=False)
+        with Directory.Lock:
+            Failed = Directory.ErrorRate > 0 and Directory.Random.random() < Directory.ErrorRate
+        if Failed:
+            self.Close()
+            raise Exception("Server unavailable")
+
+        with Directory.Lock:
+            if ComputerName.upper() not in Directory.Computers: return(False)
+        Directory.Call("Delete", Throttle=False)
+        with Directory.Lock:
+            Directory.Computers.discard(ComputerName.upper())
+            Directory.Removals.append(time.monotonic())
+        return(True)
+
+    def Close(self):
+        if self.Closed: return
+        self.Closed = True
+        with self.Directory.Lock:
+            self.Directory.Open -= 1
+
+class Expression:
+    #
+    # Evaluates the subset of DynamoDB condition expressions the functions
+    # use: comparisons, IN, attribute_exists/attribute_not_exists, AND, OR
+    # and brackets, against an item in typed form
+    #
+    Tokens = re.compile(r"\s*(attribute_not_exists|attribute_exists|AND|OR|IN|<=|>=|<>|[()=<>,]|[#:]?\w+)")
+
+    def __init__(self, Text, Names=None, Values=None):
+        self.Text   = Text
+        self.Names  = Names or {}
+        self.Values = Values or {}
+        self.Parts  = self.Tokens.findall(Text)
+
+    def Matches(self, Item):
+        self.Position = 0
+        self.Item     = Item or {}
+        Result = self.Or()
+        if self.Position != len(self.Parts): raise NotImplementedError("Expression not supported by the stand-in: "+self.Text)
+        return(Result)
+
+    def Next(self):
+        self.Position += 1
+        return(self.Parts[self.Position-1])
+
+    def Peek(self):
+        return(self.Parts[self.Position] if self.Position < len(self.Parts) else None)
+
+    def Or(self):
+        Result = self.And()
+        while self.Peek() == "OR":
+            self.Next()
+            Result = self.And() or Result
+        return(Result)
+
+    def And(self):
+        Result = self.Term()
+        while self.Peek() == "AND":
+            self.Next()
+            Result = self.Term() and Result
+        return(Result)
+
+    def Name(self, Token):
+        return(self.Names.get(Token, Token))
+
+    def Operand(self, Token):
+        if Token.startswith(":"): Value = self.Values[Token]
+        else: Value = self.Item.get(self.Name(Token))
+        if Value is None: return(None)
+
+        (Type, Raw) = list(Value.items())[0]
+        return(float(Raw) if Type == "N" else Raw)
+
+    def Term(self):
+        Token = self.Next()
+        if Token == "(":
+            Result = self.Or()
+            self.Next()
+            return(Result)
+        if Token in ("attribute_exists", "attribute_not_exists"):
+            self.Next()
+            Name = self.Name(self.Next())
+            self.Next()
+            return((Name in self.Item) == (Token == "attribute_exists"))
+
+        Left     = self.Operand(Token)
+        Operator = self.Next()
+        if Operator == "IN":
+            self.Next()
+            Candidates = [self.Operand(self.Next())]
+            while self.Next() == ",": Candidates.append(self.Operand(self.Next()))
+            return(Left is not None and Left in Candidates)
+
+        Right    = self.Operand(self.Next())
+        if Left is None or Right is None: return(False)
+        return({"=":Left == Right, "<>":Left != Right, "<":Left < Right, "<=":Left <= Right,
+                ">":Left > Right, ">=":Left >= Right}[Operator])
+
+class FakeDynamoDB(FakeClient):
+    #
+    # Client style (boto3.client("dynamodb")) table held in memory. Supports
+    # the scan, get and batch calls the functions make, with 1MB scan pages,
+    # ProjectionExpression and "#name IN (:v, ...)" filters. Read and write
+    # units are added up as DynamoDB would charge them. Calls for any other
+    # table (such as the metadata table) go to a stand-in of its own, keyed
+    # on "Name", which is in Others.
+    #
+    ThrottleCode = "ProvisionedThroughputExceededException"
+
+    def __init__(self, TableName="WorkspacesPortal", HashKey="WorkspaceId", Latency=0.0, ThrottleRate=0.0):
+        FakeClient.__init__(self, Latency, ThrottleRate)
+        self.TableName  = TableName
+        self.HashKey    = HashKey
+        self.Items      = {}
+        self.Others     = {}
+        self.ReadUnits  = 0.0
+        self.WriteUnits = 0
+        self.ConditionFailures = 0
+
+    def ResetCounters(self):
+        FakeClient.ResetCounters(self)
+        with self.Lock:
+            self.ReadUnits  = 0.0
+            self.WriteUnits = 0
+            self.ConditionFailures = 0
+            Others = list(self.Others.values())
+        for Other in Others: Other.ResetCounters()
+
+    def Key(self, Key):
+        return(Key[self.HashKey]["S"])
+
+    def Other(self, TableName):
+        with self.Lock:
+            if TableName not in self.Others: self.Others[TableName] = FakeDynamoDB(TableName, "Name", self.Latency)
+            return(self.Others[TableName])
+
+    def Project(self, Item, Projection, Names):
+        if Projection is None: return(copy.deepcopy(Item))
+        Wanted = [(Names or {}).get(Name.strip(), Name.strip()) for Name in Projection.split(",")]
+        return({Name:copy.deepcopy(Item[Name]) for Name in Wanted if Name in Item})
+
+    def Filter(self, Item, Condition, Names, Values):
+        if Condition is None: return(True)
+        return(Expression(Condition, Names, Values).Matches(Item))
+
+    def scan(self, TableName, ProjectionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+             FilterExpression=None, ExclusiveStartKey=None, Segment=None, TotalSegments=None, **Args):
+        if TableName != self.TableName:
+            return(self.Other(TableName).scan(TableName, ProjectionExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                                              FilterExpression, ExclusiveStartKey, Segment, TotalSegments, **Args))
+        self.Call("Scan")
+        with self.Lock:
+            Keys = list(self.Items.keys())
+        if TotalSegments is not None: Keys = [Key for Key in Keys if zlib.crc32(Key.encode())%TotalSegments == Segment]
+
+        Start = 0
+        if ExclusiveStartKey is not None: Start = Keys.index(self.Key(ExclusiveStartKey))+1
+
+        Items = []
+        Bytes = 0
+        Index = Start
+        while Index < len(Keys) and Bytes < PageBytes:
+            Item   = self.Items[Keys[Index]]
+            Bytes += TypedItemSize(Item)
+            Index += 1
+            if self.Filter(Item, FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+                Items.append(self.Project(Item, ProjectionExpression, ExpressionAttributeNames))
+
+        with self.Lock:
+            self.ReadUnits += ReadUnits(Bytes)
+        Result = {"Items":Items, "Count":len(Items), "ScannedCount":Index-Start}
+        if Index < len(Keys): Result["LastEvaluatedKey"] = {self.HashKey:{"S":Keys[Index-1]}}
+        return(Result)
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, ConsistentRead=False, **Args):
+        if TableName != self.TableName:
+            return(self.Other(TableName).get_item(TableName, Key, ProjectionExpression, ExpressionAttributeNames, ConsistentRead, **Args))
+        self.Call("GetItem")
+        Item = self.Items.get(self.Key(Key))
+        if Item is None: return({})
+        with self.Lock:
+            self.ReadUnits += ReadUnits(TypedItemSize(Item))*(2 if ConsistentRead else 1)
+        return({"Item":self.Project(Item, ProjectionExpression, ExpressionAttributeNames)})
+
+    def Check(self, Operation, Key, Condition, Names, Values, ReturnOld):
+        # Called with the lock held
+        if Condition is None: return
+        Current = self.Items.get(Key)
+        if Expression(Condition, Names, Values).Matches(Current): return
+
+        self.ConditionFailures += 1
+        Response = {"Error":{"Code":"ConditionalCheckFailedException", "Message":"The conditional request failed"}}
+        if ReturnOld == "ALL_OLD" and Current is not None: Response["Item"] = copy.deepcopy(Current)
+        raise ClientError(Response, Operation)
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValuesOnConditionCheckFailure=None, **Args):
+        if TableName != self.TableName:
+            return(self.Other(TableName).put_item(TableName, Item, ConditionExpression, ExpressionAttributeNames,
+                                                  ExpressionAttributeValues, ReturnValuesOnConditionCheckFailure, **Args))
+        self.Call("PutItem")
+        with self.Lock:
+            self.Check("PutItem", self.Key(Item), ConditionExpression, ExpressionAttributeNames,
+                       ExpressionAttributeValues, ReturnValuesOnConditionCheckFailure)
+            self.Items[self.Key(Item)] = copy.deepcopy(Item)
+            self.WriteUnits += WriteUnits(TypedItemSize(Item))
+        return({})
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValuesOnConditionCheckFailure=None, **Args):
+        # Only "SET name = :value, ... [REMOVE name, ...]" and "ADD name :number, ..." update expressions are supported
+        if TableName != self.TableName:
+            return(self.Other(TableName).update_item(TableName, Key, UpdateExpression, ConditionExpression, ExpressionAttributeNames,
+                                                     ExpressionAttributeValues, ReturnValuesOnConditionCheckFailure, **Args))
+        Action = UpdateExpression[:4].upper()
+        if Action not in ["SET ", "ADD "]: raise NotImplementedError("Update not supported by the stand-in: "+UpdateExpression)
+
+        self.Call("UpdateItem")
+        Names  = ExpressionAttributeNames or {}
+        Values = ExpressionAttributeValues or {}
+        with self.Lock:
+            self.Check("UpdateItem", self.Key(Key), ConditionExpression, Names, Values, ReturnValuesOnConditionCheckFailure)
+
+            Item = self.Items.setdefault(self.Key(Key), copy.deepcopy(Key))
+            (Assignments, Removes) = (re.split(r"\s+REMOVE\s+", UpdateExpression[4:], flags=re.IGNORECASE)+[""])[:2]
+            for Name in [Part.strip() for Part in Removes.split(",") if Part.strip() != ""]:
+                Item.pop(Names.get(Name, Name), None)
+            for Assignment in Assignments.split(","):
+                if Action == "SET ":
+                    (Name, Value) = [Part.strip() for Part in Assignment.split("=")]
+                    Item[Names.get(Name, Name)] = copy.deepcopy(Values[Value])
+                else:
+                    (Name, Value) = Assignment.split()
+                    Total = Decimal(Item.get(Names.get(Name, Name), {"N":"0"})["N"])+Decimal(Values[Value]["N"])
+                    Item[Names.get(Name, Name)] = {"N":str(Total)}
+            self.WriteUnits += WriteUnits(TypedItemSize(Item))
+        return({})
+
+    def batch_get_item(self, RequestItems):
+        self.Call("BatchGetItem", Throttle=False)
+        (Keys, Unprocessed) = self.Unprocessed(RequestItems[self.TableName]["Keys"])
+        Items = [copy.deepcopy(self.Items[self.Key(Key)]) for Key in Keys if self.Key(Key) in self.Items]
+        with self.Lock:
+            self.ReadUnits += sum([ReadUnits(TypedItemSize(Item)) for Item in Items])
+        if len(Unprocessed) == 0: return({"Responses":{self.TableName:Items}, "UnprocessedKeys":{}})
+        return({"Responses":{self.TableName:Items}, "UnprocessedKeys":{self.TableName:{"Keys":Unprocessed}}})
+
+    def batch_write_item(self, RequestItems):
+        self.Call("BatchWriteItem", Throttle=False)
+        (Requests, Unprocessed) = self.Unprocessed(RequestItems[self.TableName])
+        with self.Lock:
+            for Request in Requests:
+                if "PutRequest" in Request:
+                    Item = copy.deepcopy(Request["PutRequest"]["Item"])
+                    self.Items[self.Key(Item)] = Item
+                    self.WriteUnits += WriteUnits(TypedItemSize(Item))
+                else:
+                    self.Items.pop(self.Key(Request["DeleteRequest"]["Key"]), None)
+                    self.WriteUnits += 1
+        if len(Unprocessed) == 0: return({"UnprocessedItems":{}})
+        return({"UnprocessedItems":{self.TableName:Unprocessed}})
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Replays recorded events through lambda_workspaces_events against an
+# in-memory table and reports throughput, batch latency and whether the
+# table ended up with the newest state for every instance. Events are sent
+# in SQS style batches and can be shuffled to check that late or out of
+# order delivery doesn't leave old state behind.
+#
+# Files hold one EventBridge event per line (see events/sample.jsonl). With
+# --generate a synthetic stream is made instead, and --save writes it out.
+# With --compact the events are written in the compact schema onto items
+# stored in the long form, as they would be part way through a migration.
+#
+# Usage: python benchmarks/replay_events.py [files...] [--generate EVENTS] [--instances N]
+#            [--batch SIZE] [--shuffle] [--latency MS] [--save FILE] [--compact]
+#
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakeaws
+import workspaces_clients
+import workspaces_schema
+
+def TimeText(Seconds):
+    return(datetime.datetime.fromtimestamp(Seconds, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+def Generate(Events, Instances):
+    #
+    # Each instance cycles through stop, start and reboot calls, each
+    # followed by a state change a little later, with logins in between
+    #
+    Calls  = [("StopWorkspaces", "stopWorkspaceRequests", "STOPPED"),
+              ("StartWorkspaces", "startWorkspaceRequests", "AVAILABLE"),
+              ("RebootWorkspaces", "rebootWorkspaceRequests", "AVAILABLE")]
+    Clock  = {"ws-%09d" % Index:1714550400+Index for Index in range(Instances)}
+    Stream = []
+    Random = random.Random(1)
+    while len(Stream) < Events:
+        WorkspaceId = "ws-%09d" % Random.randrange(Instances)
+        (Name, RequestList, Final) = Calls[len(Stream)%len(Calls)]
+        Clock[WorkspaceId] += Random.randint(60, 600)
+        Called = Clock[WorkspaceId]
+        Clock[WorkspaceId] += Random.randint(5, 90)
+
+        Stream.append({"detail-type":"AWS API Call via CloudTrail", "source":"aws.workspaces", "time":TimeText(Called),
+                       "detail":{"eventName":Name, "eventTime":TimeText(Called), "eventSource":"workspaces.amazonaws.com",
+                                 "requestParameters":{RequestList:[{"workspaceId":WorkspaceId}]}, "responseElements":{"failedRequests":[]}}})
+        Stream.append({"detail-type":"WorkSpaces State Change", "source":"workspaces.portal", "time":TimeText(Clock[WorkspaceId]),
+                       "detail":{"workspaceId":WorkspaceId, "state":Final}})
+        if Final == "AVAILABLE":
+            Stream.append({"detail-type":"WorkSpaces Access", "source":"aws.workspaces", "time":TimeText(Clock[WorkspaceId]+30),
+                           "detail":{"actionType":"successfulLogin", "workspaceId":WorkspaceId, "loginTime":TimeText(Clock[WorkspaceId]+30)}})
+
+    return(Stream[:Events])
+
+def Load(Files):
+    Stream = []
+    for Name in Files:
+        with open(Name) as File:
+            Stream += [json.loads(Line) for Line in File if Line.strip() != ""]
+    return(Stream)
+
+def Expected(Events, Stream):
+    # The newest value of every attribute for every instance, whatever order the events arrive in
+    Newest = {}
+    for Event in Stream:
+        for (WorkspaceId, Attributes, Guard, GuardValue) in Events.GetUpdates(Event):
+            for (Name, Value) in Attributes.items():
+                Key = (WorkspaceId, Name)
+                if Key not in Newest or GuardValue > Newest[Key][0]: Newest[Key] = (GuardValue, Value)
+    return(Newest)
+
+def Percentile(Values, Fraction):
+    Values = sorted(Values)
+    return(Values[min(len(Values)-1, int(len(Values)*Fraction))])
+
+def main():
+    Parser = argparse.ArgumentParser()
+    Parser.add_argument("files", nargs="*")
+    Parser.add_argument("--generate", type=int, default=5000)
+    Parser.add_argument("--instances", type=int, default=2000)
+    Parser.add_argument("--batch", type=int, default=10)
+    Parser.add_argument("--shuffle", action="store_true")
+    Parser.add_argument("--latency", type=float, default=5.0)
+    Parser.add_argument("--save")
+    Parser.add_argument("--compact", action="store_true")
+    Options = Parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    Table = fakeaws.FakeDynamoDB(Latency=Options.latency/1000)
+    workspaces_clients.SetClient("dynamodb", Table)
+    import lambda_workspaces_events as Events
+    workspaces_schema.CompactWrites = Options.compact
+
+    Stream = Load(Options.files) if len(Options.files) > 0 else Generate(Options.generate, Options.instances)
+    if Options.save:
+        with open(Options.save, "w") as File:
+            for Event in Stream: File.write(json.dumps(Event)+"\n")
+
+    #
+    # Every instance in the stream starts out AVAILABLE as of an old import,
+    # apart from the ones named "unknown" which are left out of the table
+    #
+    for Event in Stream:
+        for (WorkspaceId, Attributes, Guard, GuardValue) in Events.GetUpdates(Event):
+            if "unknown" in WorkspaceId or WorkspaceId in Table.Items: continue
+            Table.Items[WorkspaceId] = {"WorkspaceId":{"S":WorkspaceId}, "InstanceState":{"S":"AVAILABLE"},
+                                        "RunningMode":{"S":"AUTO_STOP"}, "Version":{"N":"0"}}
+
+    Delivery = list(Stream)
+    if Options.shuffle: random.Random(2).shuffle(Delivery)
+
+    Latencies = []
+    Failures  = 0
+    Start     = time.perf_counter()
+    for Index in range(0, len(Delivery), Options.batch):
+        Records = [{"messageId":str(Index+Offset), "body":json.dumps(Event)} for (Offset, Event) in enumerate(Delivery[Index:Index+Options.batch])]
+        BatchStart = time.perf_counter()
+        Result = Events.lambda_handler({"Records":Records}, None)
+        Latencies.append(time.perf_counter()-BatchStart)
+        Failures += len(Result["batchItemFailures"])
+    Elapsed = time.perf_counter()-Start
+
+    Wrong = 0
+    for ((WorkspaceId, Name), (GuardValue, Value)) in Expected(Events, Stream).items():
+        if WorkspaceId in Table.Items and workspaces_schema.Expand(Table.Items[WorkspaceId]).get(Name) != Value: Wrong += 1
+
+    print("%d events in batches of %d%s%s, %.0f ms per DynamoDB call" %
+          (len(Stream), Options.batch, " (shuffled)" if Options.shuffle else "", " (compact)" if Options.compact else "", Options.latency))
+    print("%8.2f s %8.0f events/s   batch latency p50 %.1f ms p95 %.1f ms p99 %.1f ms" %
+          (Elapsed, len(Stream)/Elapsed, Percentile(Latencies, 0.5)*1000, Percentile(Latencies, 0.95)*1000, Percentile(Latencies, 0.99)*1000))
+    print("%8d updates  %6d rejected (stale or unknown)  %4d failed records  %4d attributes not at their newest value" %
+          (Table.Calls.get("UpdateItem", 0), Table.ConditionFailures, Failures, Wrong))
+
+if __name__ == "__main__":
+    main()
@@ -17,35 +17,351 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
-import boto3
+import time
+InitStart = time.perf_counter() # Taken first so the init report covers every import below
+
 import logging
 import base64
 import json
 import os
+import threading
+import uuid
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from workspaces_auth import AuthError, Authorise
+from workspaces_clients import GetClient, Prewarm
+from workspaces_dynamodb import BatchGet, BatchGetSize, BoundedExecutor
+from workspaces_metadata import BumpGeneration, GetJob, PutJob
+from workspaces_metrics import Metrics
+import workspaces_schema as Schema
+from workspaces_startup import InitTimer
+import workspaces_states as StateMachine
+from workspaces_updates import ApplyUpdate, MakeVersion
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 DDBTableName = os.environ.get("DynamoDBTableName", "WorkspacesPortal")
 
-ValidActions = ["Start", "Stop", "Reboot", "Rebuild", "Decommission"]
+BulkMaxInstances = int(os.environ.get("BULKMAXINSTANCES", "5000"))
+ActionWorkers    = int(os.environ.get("ACTIONWORKERS", "8"))
 
-def ParseJWT(Token):
-    Auth = Token.split(".")[1]
-    
-    MissingPadding = len(Auth)%4
-    if MissingPadding != 0: Auth += "="*(4-MissingPadding)
-        
+#
+# A request with Async=true also starts a watcher: an asynchronous
+# invocation of this function that polls describe_workspaces for the
+# instances acted on and writes their real states to the table as they
+# change. It polls every WATCHINTERVAL seconds while states are changing,
+# backing off to WATCHMAXINTERVAL while they aren't, for up to WATCHSECONDS
+# (or until the function is about to time out). Anything still changing
+# after that is left for the import. The front end follows progress with
+# JobId requests.
+#
+WatchSeconds     = int(os.environ.get("WATCHSECONDS", "240"))
+WatchInterval    = float(os.environ.get("WATCHINTERVAL", "2"))
+WatchMaxInterval = float(os.environ.get("WATCHMAXINTERVAL", "15"))
+Launcher         = None # Set by local harnesses - otherwise watchers are started with an asynchronous invocation
+
+#
+# Build the clients (and load the Workspaces service model) while the function
+# initialises rather than in the first request. The Workspaces client for our
+# own region is reused for instances there; other regions reuse the model.
+#
+Init = InitTimer(__name__, InitStart)
+Init.Phase("Imports")
+Prewarm("dynamodb")
+Prewarm("workspaces", os.environ.get("AWS_REGION"))
+Init.Phase("Prewarm")
+Init.Done()
+
+def GetBulkRequest(event):
+    #
+    # A bulk request carries a list of InstanceIds - either as JSON in a POST
+    # body ({"Action":"Start","InstanceIds":["ws-...",...]}) or as a comma
+    # separated InstanceIds query string parameter. Returns (Action, list of
+    # ids) or None for a single instance request.
+    #
+    Parameters  = event.get("queryStringParameters") or {}
+    Action      = Parameters.get("Action")
+    InstanceIds = Parameters.get("InstanceIds")
+
+    if event.get("body"):
+        Body = event["body"]
+        if event.get("isBase64Encoded"): Body = base64.b64decode(Body)
+        Body = json.loads(Body)
+        Action      = Body.get("Action", Action)
+        InstanceIds = Body.get("InstanceIds", InstanceIds)
+
+    if InstanceIds is None: return(None)
+    if isinstance(InstanceIds, str): InstanceIds = InstanceIds.split(",")
+
+    # BatchGetItem rejects duplicate keys so drop them (keeping the order)
+    return((Action, list(dict.fromkeys([Id.strip() for Id in InstanceIds if Id.strip() != ""]))))
+
+def CallAction(Region, Action, Ids):
+    # Starts Action on Ids (all in Region, at most the action's MaxBatch) with the call the state machine names
+    Rule = StateMachine.Actions[Action]
+    return(getattr(GetClient("workspaces", Region), Rule["Method"])(**{Rule["RequestKey"]:[{"WorkspaceId":Id} for Id in Ids]}))
+
+def SetState(DynamoDB, InstanceId, State):
+    #
+    # Records the state an action has moved an instance to. Only
+    # InstanceState is written so anything else changed since the instance
+    # was read (by events, the watcher or logins) is kept, and an instance
+    # the reaper has removed in the meantime isn't written back. Returns
+    # False if the instance has gone.
+    #
     try:
-        AuthDict = json.loads(base64.urlsafe_b64decode(Auth))
+        DynamoDB.update_item(TableName=DDBTableName,
+                             Key={"WorkspaceId":{"S":InstanceId}},
+                             UpdateExpression="set #s = :s remove #o",
+                             ConditionExpression="attribute_exists(#k)",
+                             ExpressionAttributeNames={"#s":Schema.Name("InstanceState"), "#o":Schema.OtherName("InstanceState"),
+                                                       "#k":"WorkspaceId"},
+                             ExpressionAttributeValues={":s":Schema.StoredValue("InstanceState", {"S":State})})
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException": raise
+        logger.info("Instance "+InstanceId+" left the table before its state could be recorded")
+        return(False)
+    return(True)
+
+def RunBatch(Region, Action, Items):
+    #
+    # Makes one Workspaces API call for a batch of instances in one region and
+    # returns a dictionary of WorkspaceId -> error message for any that failed
+    #
+    Ids = [Item["WorkspaceId"]["S"] for Item in Items]
+    try:
+        with Metrics.Timer("Action", Region):
+            ActionResponse = CallAction(Region, Action, Ids)
     except Exception as e:
-        logger.error("Could not parse JWT: "+str(e)+" "+Token)
-        AuthDict = {}
+        logger.error("Workspaces API error on bulk "+Action.lower()+" in "+Region+": "+str(e))
+        return({Id:"Workspaces API query error for "+Action.lower()+"." for Id in Ids})
+
+    return({Failed["WorkspaceId"]:Failed.get("ErrorMessage", "Unknown error") for Failed in ActionResponse["FailedRequests"]})
+
+def BulkAction(Action, InstanceIds, Username, IsAdmin, Watched=None):
+    #
+    # Watched, if given, is filled in with Region -> {WorkspaceId: state
+    # before the action} for every instance the action was started on
+    #
+    Results = {Id:None for Id in InstanceIds}
+    Summary = {"Succeeded":0, "Warnings":0, "Failed":0}
+
+    def Record(InstanceId, Kind, Message):
+        Results[InstanceId] = {"InstanceId":InstanceId, Kind:Message}
+        Summary[{"Success":"Succeeded", "Warning":"Warnings", "Error":"Failed"}[Kind]] += 1
+
+    #
+    # Load every instance with BatchGetItem (100 keys per call) in parallel
+    #
+    DynamoDB = GetClient("dynamodb")
+    Keys     = [{"WorkspaceId":{"S":Id}} for Id in InstanceIds]
+    Chunks   = [Keys[Index:Index+BatchGetSize] for Index in range(0, len(Keys), BatchGetSize)]
+    with Metrics.Timer("Load"), ThreadPoolExecutor(max_workers=ActionWorkers) as Executor:
+        Loaded = Executor.map(lambda Chunk: BatchGet(DynamoDB, DDBTableName, Chunk), Chunks)
+        Items  = {Item["WorkspaceId"]["S"]:Schema.Expand(Item) for Chunk in Loaded for Item in Chunk}
+
+    #
+    # Check each instance and group the ones we can act on by region
+    #
+    ByRegion = {}
+    for InstanceId in InstanceIds:
+        if InstanceId not in Items:
+            Record(InstanceId, "Error", "Instance not found in database.")
+            continue
+
+        Item = Items[InstanceId]
+        if not IsAdmin and Item.get("UserName", {}).get("S", "").lower() != Username.lower():
+            Record(InstanceId, "Error", "You are not authorised to modify other users instances.")
+            continue
+
+        Problem = StateMachine.Check(Action, Item["InstanceState"]["S"], Item.get("RunningMode", {}).get("S"))
+        if Problem is not None:
+            Record(InstanceId, "Warning", Problem[1])
+            continue
+
+        ByRegion.setdefault(Item["Region"]["S"], []).append(Item)
+
+    #
+    # One API call per batch of instances in a region, run in parallel
+    #
+    MaxBatch = StateMachine.Actions[Action]["MaxBatch"]
+    Batches  = [(Region, RegionItems[Index:Index+MaxBatch])
+                for Region, RegionItems in ByRegion.items()
+                for Index in range(0, len(RegionItems), MaxBatch)]
+    NextState = StateMachine.Actions[Action]["To"]
+    Updates   = {"Written":0, "Gone":0, "Failed":0}
+    Lock      = threading.Lock()
+
+    def Updated(InstanceId, Future):
+        try:
+            Outcome = "Written" if Future.result() else "Gone"
+        except Exception as e:
+            logger.error("Could not update DynamoDB for instance "+InstanceId+": "+str(e))
+            Outcome = "Failed"
+        with Lock:
+            Updates[Outcome] += 1
+
+    #
+    # New states are recorded with an update_item per instance (not a
+    # BatchWriteItem of the items as read, which would undo anything that
+    # changed them since) on a bounded pool of threads
+    #
+    Updater = BoundedExecutor(ActionWorkers)
+    with ThreadPoolExecutor(max_workers=ActionWorkers) as Executor:
+        for ((Region, Batch), Failures) in zip(Batches, Executor.map(lambda Work: RunBatch(Work[0], Action, Work[1]), Batches)):
+            for Item in Batch:
+                InstanceId = Item["WorkspaceId"]["S"]
+                if InstanceId in Failures:
+                    Record(InstanceId, "Error", "Action failed: "+Failures[InstanceId])
+                    continue
+
+                Record(InstanceId, "Success", "Workspaces "+Action+" in progress for "+InstanceId+".")
+                if Watched is not None: Watched.setdefault(Region, {})[InstanceId] = Item["InstanceState"]["S"]
+                Updater.Submit(SetState, DynamoDB, InstanceId, NextState,
+                               Done=lambda Future, InstanceId=InstanceId: Updated(InstanceId, Future))
+    with Metrics.Timer("Update"):
+        Updater.Close()
+    if Updates["Failed"] > 0:
+        logger.error("Could not update DynamoDB for "+str(Updates["Failed"])+" instances")
+    if Updates["Written"] > 0: BumpGeneration(DynamoDB)
+
+    logger.info("Bulk "+Action+" of "+str(len(InstanceIds))+" instances: "+json.dumps(Summary))
+    for Counter in Summary: Metrics.Count(Counter, Summary[Counter])
+    return({"Results":list(Results.values()), "Summary":Summary})
+
+def IsAsync(event):
+    Parameters = event.get("queryStringParameters") or {}
+    if str(Parameters.get("Async", "")).lower() == "true": return(True)
+
+    if event.get("body"):
+        Body = event["body"]
+        if event.get("isBase64Encoded"): Body = base64.b64decode(Body)
+        return(json.loads(Body).get("Async") in [True, "true", "True"])
+    return(False)
+
+def StartWatch(Action, Owner, Watched, context):
+    #
+    # Records the job and starts its watcher. Returns the JobId, or None if
+    # either fails - the action itself has still been done.
+    #
+    JobId  = uuid.uuid4().hex
+    States = {WorkspaceId:StateMachine.Actions[Action]["To"] for Instances in Watched.values() for WorkspaceId in Instances}
+    Event  = {"Watch":{"JobId":JobId, "Action":Action, "Owner":Owner, "Instances":Watched}}
+    try:
+        PutJob(GetClient("dynamodb"), JobId, {"Owner":Owner, "Action":Action, "Status":"Running", "States":States})
+        if Launcher is not None:
+            Launcher(Event)
+        else:
+            from workspaces_dispatch import InvokeAsync # Only needed for asynchronous requests so loaded on first use
+            InvokeAsync(context.invoked_function_arn, Event)
+    except Exception as e:
+        logger.error("Could not start watching "+Action+" of "+str(len(States))+" instances: "+str(e))
+        return(None)
+
+    logger.info("Watching "+Action+" of "+str(len(States))+" instances as job "+JobId)
+    return(JobId)
+
+def PollStates(Region, WorkspaceIds):
+    #
+    # Current state of up to 25 instances in one region - None for those
+    # that no longer exist. Returns an empty dictionary if the call fails so
+    # they are polled again next time.
+    #
+    try:
+        with Metrics.Timer("Poll", Region):
+            Response = GetClient("workspaces", Region).describe_workspaces(WorkspaceIds=WorkspaceIds)
+    except Exception as e:
+        logger.warning("Could not poll instances in "+Region+": "+str(e))
+        return({})
+
+    States = {WorkspaceId:None for WorkspaceId in WorkspaceIds}
+    for Instance in Response["Workspaces"]: States[Instance["WorkspaceId"]] = Instance["State"]
+    return(States)
+
+def Watch(Job, context):
+    #
+    # Runs in its own (asynchronous) invocation. An instance is settled once
+    # it has moved away from the state it was in before the action and is no
+    # longer in a transitional state - so a reboot has to be seen REBOOTING
+    # (or otherwise not AVAILABLE) before AVAILABLE counts.
+    #
+    JobId    = Job["JobId"]
+    Original = {}
+    Regions  = {}
+    for (Region, Instances) in Job["Instances"].items():
+        for (WorkspaceId, State) in Instances.items():
+            Original[WorkspaceId] = State
+            Regions[WorkspaceId]  = Region
+
+    States   = {WorkspaceId:StateMachine.Actions[Job["Action"]]["To"] for WorkspaceId in Original}
+    Pending  = set(Original)
+    Left     = set()
+    DynamoDB = GetClient("dynamodb")
+
+    Deadline = time.time()+WatchSeconds
+    if context is not None: Deadline = min(Deadline, time.time()+context.get_remaining_time_in_millis()/1000-10)
+    Delay    = WatchInterval
+    Polls    = 0
+    while len(Pending) > 0 and time.time()+Delay < Deadline:
+        time.sleep(Delay)
+        Polls += 1
+
+        ByRegion = {}
+        for WorkspaceId in sorted(Pending): ByRegion.setdefault(Regions[WorkspaceId], []).append(WorkspaceId)
+        Batches  = [(Region, Ids[Index:Index+25]) for (Region, Ids) in ByRegion.items() for Index in range(0, len(Ids), 25)]
+        Seen     = time.time()
+        with ThreadPoolExecutor(max_workers=ActionWorkers) as Executor:
+            Observed = {}
+            for Result in Executor.map(lambda Batch: PollStates(*Batch), Batches): Observed.update(Result)
+
+        Changed = {}
+        for (WorkspaceId, State) in Observed.items():
+            if State is None: State = "TERMINATED" # Gone - the reaper will remove it from the table
+            if State != Original[WorkspaceId]: Left.add(WorkspaceId)
+            if State != States[WorkspaceId]: Changed[WorkspaceId] = State
+            if WorkspaceId in Left and State not in StateMachine.TransitionalStates: Pending.discard(WorkspaceId)
+
+        if len(Changed) == 0:
+            Delay = min(Delay*2, WatchMaxInterval)
+            continue
+
+        #
+        # The observation time is the Version so that an older event arriving
+        # later can't put back a state we have already seen the instance leave
+        #
+        Version = MakeVersion(Seen)
+        with Metrics.Timer("Update"), ThreadPoolExecutor(max_workers=ActionWorkers) as Executor:
+            list(Executor.map(lambda Change: ApplyUpdate(DynamoDB, DDBTableName, (Change[0], {"InstanceState":{"S":Change[1]}}, "Version", Version)),
+                              Changed.items()))
+        BumpGeneration(DynamoDB)
+
+        States.update(Changed)
+        Metrics.Count("StateChanges", len(Changed))
+        PutJob(DynamoDB, JobId, {"Owner":Job["Owner"], "Action":Job["Action"], "Status":"Running", "States":States})
+        Delay = WatchInterval
+
+    Status = "Done" if len(Pending) == 0 else "Unsettled"
+    PutJob(DynamoDB, JobId, {"Owner":Job["Owner"], "Action":Job["Action"], "Status":Status, "States":States})
+    Metrics.Count("Settled", len(Original)-len(Pending))
+    Metrics.Count("Unsettled", len(Pending))
+
+    Summary = {"JobId":JobId, "Status":Status, "Instances":len(Original), "Unsettled":len(Pending), "Polls":Polls}
+    logger.info("Watch summary: "+json.dumps(Summary))
+    return(Summary)
+
+def JobStatus(JobId, Username, IsAdmin):
+    Job = GetJob(GetClient("dynamodb"), JobId)
+    if Job is None: return({"Error":"Job not found."})
 
-    return(AuthDict)
+    if not IsAdmin and Job["Owner"].lower() != Username.lower():
+        return({"Error":"You are not authorised to view other users jobs."})
 
+    return({"JobId":JobId, "Action":Job["Action"], "Status":Job["Status"], "States":Job["States"], "Updated":Job["Updated"]})
+
+@Metrics.Handler("Actions")
 def lambda_handler(event, context):
-    global ValidActions
+    if "Watch" in event: return(Watch(event["Watch"], context))
     
     Response               = {}
     Response["statusCode"] = 200
@@ -62,14 +378,71 @@ def lambda_handler(event, context):
         Response["body"] = '{"Error":"No authorization header supplied."}'
         return(Response)
         
-    AuthInfo = ParseJWT(event["headers"]["Authorization"])
-    if "identities" not in AuthInfo:
-        logger.error("No identity information in JWT")
-        Response["body"] = '{"Error":"No identity information in authorization."}'
+    try:
+        with Metrics.Timer("Auth"):
+            User = Authorise(event["headers"]["Authorization"])
+    except AuthError as e:
+        Response["body"] = json.dumps({"Error":str(e)})
+        return(Response)
+
+    Username = User.Username
+
+    #
+    # The front end polls the progress of an asynchronous action with JobId
+    #
+    Parameters = event.get("queryStringParameters") or {}
+    JobId      = Parameters.get("JobId")
+    if JobId:
+        try:
+            Response["body"] = json.dumps(JobStatus(JobId, Username, User.IsAdmin))
+        except Exception as e:
+            logger.error("Could not read job "+JobId+": "+str(e))
+            Response["body"] = '{"Error":"Database query error."}'
+        return(Response)
+
+    #
+    # The front end fetches the state machine once to work out which actions
+    # to offer for each instance. It only changes when this function does.
+    #
+    if str(Parameters.get("Transitions", "")).lower() == "true":
+        Response["headers"]["Cache-Control"] = "private, max-age=3600"
+        Response["body"] = json.dumps(StateMachine.Describe())
+        return(Response)
+
+    try:
+        BulkRequest = GetBulkRequest(event)
+        Async       = IsAsync(event)
+    except Exception as e:
+        logger.error("Could not parse bulk request: "+str(e))
+        Response["body"] = '{"Error":"Invalid bulk request."}'
+        return(Response)
+
+    if BulkRequest is not None:
+        (Action, InstanceIds) = BulkRequest
+        if not isinstance(Action, str) or Action not in StateMachine.Actions:
+            logger.error("Invalid specified: "+str(Action))
+            Response["body"] = '{"Error":"Invalid action specified in request."}'
+            return(Response)
+
+        if StateMachine.Actions[Action]["AdminOnly"] and not User.IsAdmin:
+            logger.error("User not authorised to "+Action.lower()+" Workspaces instance")
+            Response["body"] = '{"Error":"You are not authorised to '+Action.lower()+' instances."}'
+            return(Response)
+
+        if len(InstanceIds) == 0 or len(InstanceIds) > BulkMaxInstances:
+            logger.error("Bulk request for "+str(len(InstanceIds))+" instances")
+            Response["body"] = '{"Error":"A bulk request must list between 1 and '+str(BulkMaxInstances)+' instances."}'
+            return(Response)
+
+        try:
+            Watched = {} if Async else None
+            Result  = BulkAction(Action, InstanceIds, Username, User.IsAdmin, Watched)
+            if Async and len(Watched) > 0: Result["JobId"] = StartWatch(Action, Username, Watched, context)
+            Response["body"] = json.dumps(Result)
+        except Exception as e:
+            logger.error("Bulk action error: "+str(e))
+            Response["body"] = '{"Error":"Database query error."}'
         return(Response)
-        
-    Username = AuthInfo["identities"][0]["userId"].split("\\")[1] # Username is expected to be "DOMAIN\\username"
-    ADGroups = AuthInfo["custom:ADGroups"]
 
     if "queryStringParameters" not in event:
         logger.error("Did not find queryStringParameters")
@@ -89,20 +462,22 @@ def lambda_handler(event, context):
     InstanceId = event["queryStringParameters"]["InstanceId"]
     Action     = event["queryStringParameters"]["Action"]
     
-    if Action not in ValidActions:
+    if Action not in StateMachine.Actions:
         logger.error("Invalid specified: "+Action)
         Response["body"] = '{"Error":"Invalid action specified in request."}'
         return(Response)
 
-    if Action == "Decommission" and ADGroups.find("AdminGroupMember") == -1:
-        logger.error("User not authorised to decommission Workspaces instance")
-        Response["body"] = '{"Error":"You are not authorised to decommission instances."}'
+    if StateMachine.Actions[Action]["AdminOnly"] and not User.IsAdmin:
+        logger.error("User not authorised to "+Action.lower()+" Workspaces instance")
+        Response["body"] = '{"Error":"You are not authorised to '+Action.lower()+' instances."}'
         return(Response)
 
-    DynamoDB = boto3.client("dynamodb")
+    DynamoDB = GetClient("dynamodb")
     try:
-        WorkspaceInfo = DynamoDB.get_item(TableName=DDBTableName,
-                                          Key={"WorkspaceId":{"S":InstanceId}})
+        with Metrics.Timer("Load"):
+            WorkspaceInfo = DynamoDB.get_item(TableName=DDBTableName,
+                                              Key={"WorkspaceId":{"S":InstanceId}})
+        if "Item" in WorkspaceInfo: WorkspaceInfo["Item"] = Schema.Expand(WorkspaceInfo["Item"])
     except Exception as e:
         logger.error("DynamoDB error: "+str(e))
         Response["body"] = '{"Error":"Database query error."}'
@@ -120,99 +495,48 @@ def lambda_handler(event, context):
         Response["body"] = '{"Error":"Instance owner not found."}'
         return(Response)
     
-    if ADGroups.find("AdminGroupMember") == -1 and OwnedBy.lower() != Username.lower():
+    if not User.IsAdmin and OwnedBy.lower() != Username.lower():
         logger.error("User not authorised to action other Workspaces instance")
         Response["body"] = '{"Error":"You are not authorised to modify other users instances."}'
         return(Response)
 
     State = WorkspaceInfo["Item"]["InstanceState"]["S"]
-    Mode  = WorkspaceInfo["Item"]["RunningMode"]["S"]
+    Mode  = WorkspaceInfo["Item"].get("RunningMode", {}).get("S")
 
-    if Action == "Rebuild" and State not in {"AVAILABLE", "ERROR"}:
-        logger.error("Cannot rebuild - state is not AVAILABLE or ERROR: "+State)
-        Response["body"] = '{"Warning":"You cannot rebuild a Workspace unless it is in an AVAILABLE or ERROR state."}'
+    Problem = StateMachine.Check(Action, State, Mode)
+    if Problem is not None:
+        logger.error(Problem[0])
+        Response["body"] = json.dumps({"Warning":Problem[1]})
         return(Response)
 
-    if Action == "Reboot" and State not in {"AVAILABLE", "IMPAIRED", "INOPERABLE"}:
-        logger.error("Cannot reboot - state is not AVAILABLE, IMPAIRED or INOPERABLE: "+State)
-        Response["body"] = '{"Warning":"You cannot reboot a Workspace unless it is in an AVAILABLE, IMPAIRED or INOPERABLE state."}'
-        return(Response)
-
-    if Action == "Decommission" and State == "SUSPENDED":
-        logger.error("Cannot decommission - state is SUSPENDED: "+State)
-        Response["body"] = '{"Warning":"You cannot decommission a Workspace when it is in a SUSPENDED state."}'
-        return(Response)
-
-    if Action == "Start" and State != "STOPPED":
-        logger.error("Cannot start - state is not STOPPED: "+State)
-        Response["body"] = '{"Warning":"You cannot start a Workspace that is not in a STOPPED state."}'
-        return(Response)
-        
-    if Action == "Stop" and State not in {"AVAILABLE", "IMPAIRED", "UNHEALTHY", "ERROR"}:
-        logger.error("Cannot stop - state is not AVAILABLE, IMPAIRED, UNHEALTHY or ERROR: "+State)
-        Response["body"] = '{"Warning":"You cannot stop a Workspace that is not in an AVAILABLE, IMPAIRED, UNHEALTHY or ERROR state."}'
+    Region      = WorkspaceInfo["Item"]["Region"]["S"]
+    NextState   = StateMachine.Actions[Action]["To"]
+    ActionStart = time.perf_counter()
+    try:
+        ActionResponse = CallAction(Region, Action, [InstanceId])
+    except Exception as e:
+        logger.error("Workspaces API error on "+Action.lower()+": "+str(e))
+        Response["body"] = '{"Error":"Workspaces API query error for '+Action.lower()+'."}'
         return(Response)
 
-    Workspaces = boto3.client("workspaces", region_name=WorkspaceInfo["Item"]["Region"]["S"])
-    NextState  = ""
-    
-    if Action == "Start":
-        try:
-            ActionResponse = Workspaces.start_workspaces(StartWorkspaceRequests=[{"WorkspaceId":InstanceId}])
-            NextState = "STARTING"
-        except Exception as e:
-            logger.error("Workspaces API error on start: "+str(e))
-            Response["body"] = '{"Error":"Workspaces API query error for start."}'
-            return(Response)
-
-    if Action == "Stop":
-        try:
-            ActionResponse = Workspaces.stop_workspaces(StopWorkspaceRequests=[{"WorkspaceId":InstanceId}])
-            NextState = "STOPPING"
-        except Exception as e:
-            logger.error("Workspaces API error on stop: "+str(e))
-            Response["body"] = '{"Error":"Workspaces API query error for stop."}'
-            return(Response)
-
-    if Action == "Reboot":
-        try:
-            ActionResponse = Workspaces.reboot_workspaces(RebootWorkspaceRequests=[{"WorkspaceId":InstanceId}])
-            NextState = "REBOOTING"
-        except Exception as e:
-            logger.error("Workspaces API error on reboot: "+str(e))
-            Response["body"] = '{"Error":"Workspaces API query error for reboot."}'
-            return(Response)
-
-    if Action == "Rebuild":
-        try:
-            ActionResponse = Workspaces.rebuild_workspaces(RebuildWorkspaceRequests=[{"WorkspaceId":InstanceId}])
-            NextState = "REBUILDING"
-        except Exception as e:
-            logger.error("Workspaces API error on rebuild: "+str(e))
-            Response["body"] = '{"Error":"Workspaces API query error for rebuild."}'
-            return(Response)
-
-    if Action == "Decommission":
-        try:
-            ActionResponse = Workspaces.terminate_workspaces(TerminateWorkspaceRequests=[{"WorkspaceId":InstanceId}])
-            NextState = "STOPPING"
-        except Exception as e:
-            logger.error("Workspaces API error on decommission: "+str(e))
-            Response["body"] = '{"Error":"Workspaces API query error for decommission."}'
-            return(Response)
+    Metrics.AddTime("Action", (time.perf_counter()-ActionStart)*1000, Region)
 
     if len(ActionResponse["FailedRequests"]) > 0:
+        Metrics.Count("Failed")
         logger.error("Workspaces API request failed:: "+ActionResponse["FailedRequests"][0]["ErrorMessage"])
         Response["body"] = '{"Error":"Action failed: '+ActionResponse["FailedRequests"][0]["ErrorMessage"]+'"}'
     else:
         Response["body"] = '{"Success":"Workspaces '+Action+' in progress for '+InstanceId+'."}'
 
+        Metrics.Count("Succeeded")
         try:
-            DynamoDB.update_item(TableName=DDBTableName,
-                                 Key={"WorkspaceId":{"S":InstanceId}},
-                                 UpdateExpression="set InstanceState = :s",
-                                 ExpressionAttributeValues={":s":{"S":NextState}})
+            with Metrics.Timer("Update"):
+                if SetState(DynamoDB, InstanceId, NextState): BumpGeneration(DynamoDB)
         except Exception as e:
             logger.error("Could not update DynamoDB for instance "+InstanceId+": "+str(e))
 
+        if Async:
+            Response["body"] = json.dumps({"Success":"Workspaces "+Action+" in progress for "+InstanceId+".",
+                                           "JobId":StartWatch(Action, Username, {Region:{InstanceId:State}}, context)})
+
     return(Response)
\ No newline at end of file
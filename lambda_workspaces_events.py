@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+import time
+InitStart = time.perf_counter() # Taken first so the init report covers every import below
+
+import calendar
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from workspaces_clients import GetClient, Prewarm
+from workspaces_metadata import BumpGeneration
+from workspaces_metrics import Metrics
+from workspaces_startup import InitTimer
+from workspaces_updates import ApplyUpdate, MakeVersion
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+DDBTableName = os.environ.get("DynamoDBTableName", "WorkspacesPortal")
+EventWorkers = int(os.environ.get("EVENTWORKERS", "8"))
+
+#
+# CloudTrail event name -> (list of instances in requestParameters, state they move to)
+#
+ApiCalls = {"StartWorkspaces":    ("startWorkspaceRequests",     "STARTING"),
+            "StopWorkspaces":     ("stopWorkspaceRequests",      "STOPPING"),
+            "RebootWorkspaces":   ("rebootWorkspaceRequests",    "REBOOTING"),
+            "RebuildWorkspaces":  ("rebuildWorkspaceRequests",   "REBUILDING"),
+            "TerminateWorkspaces":("terminateWorkspaceRequests", "TERMINATING")}
+
+Init = InitTimer(__name__, InitStart)
+Init.Phase("Imports")
+Prewarm("dynamodb")
+Init.Phase("Prewarm")
+Init.Done()
+
+def ParseTime(Text):
+    # "2024-05-01T10:15:30Z", optionally with fractions of a second, to seconds since the epoch
+    Text     = Text.rstrip("Z")
+    Fraction = 0.0
+    if "." in Text:
+        (Text, Digits) = Text.split(".", 1)
+        Fraction = float("0."+Digits)
+    return(calendar.timegm(time.strptime(Text, "%Y-%m-%dT%H:%M:%S"))+Fraction)
+
+def GetUpdates(Event):
+    #
+    # Turns one event into a list of (WorkspaceId, attributes to set, guard
+    # attribute, guard value). An update is applied only if the guard value
+    # is greater than the one already stored.
+    #
+    DetailType = Event.get("detail-type")
+    Detail     = Event.get("detail") or {}
+
+    if DetailType == "AWS API Call via CloudTrail":
+        if Detail.get("errorCode"): return([]) # The call failed so nothing changed
+
+        Version  = MakeVersion(ParseTime(Detail["eventTime"]))
+        Name     = Detail.get("eventName")
+        Request  = Detail.get("requestParameters") or {}
+        Response = Detail.get("responseElements") or {}
+
+        if Name in ApiCalls:
+            (RequestList, State) = ApiCalls[Name]
+            Failed = {Failure.get("workspaceId") for Failure in Response.get("failedRequests", [])}
+            return([(Instance["workspaceId"], {"InstanceState":{"S":State}}, "Version", Version)
+                    for Instance in Request.get(RequestList, []) if Instance["workspaceId"] not in Failed])
+
+        if Name == "ModifyWorkspaceProperties" and "runningMode" in (Request.get("workspaceProperties") or {}):
+            return([(Request["workspaceId"], {"RunningMode":{"S":Request["workspaceProperties"]["runningMode"]}}, "Version", Version)])
+
+        return([])
+
+    #
+    # Shape used for state changes that don't come from an API call (for
+    # example a Workspace finishing starting): {"workspaceId", "state"}
+    #
+    if DetailType == "WorkSpaces State Change":
+        Version = MakeVersion(ParseTime(Detail.get("time", Event["time"])))
+        return([(Detail["workspaceId"], {"InstanceState":{"S":Detail["state"]}}, "Version", Version)])
+
+    #
+    # Sent by Workspaces when a user logs in. LastConnected only ever moves
+    # forward so it is its own guard.
+    #
+    if DetailType == "WorkSpaces Access" and Detail.get("actionType") == "successfulLogin":
+        LoginTime = str(int(ParseTime(Detail.get("loginTime", Event["time"]))))
+        return([(Detail["workspaceId"], {"LastConnected":{"N":LoginTime}}, "LastConnected", int(LoginTime))])
+
+    return([])
+
+def ProcessEvent(Event):
+    Counts  = {"Applied":0, "Stale":0, "Unknown":0, "Ignored":0}
+    Updates = GetUpdates(Event)
+    if len(Updates) == 0:
+        logger.info("No updates in event: "+str(Event.get("detail-type"))+" "+str((Event.get("detail") or {}).get("eventName", "")))
+        Counts["Ignored"] += 1
+
+    DynamoDB = GetClient("dynamodb")
+    for Update in Updates:
+        with Metrics.Timer("Apply"):
+            Counts[ApplyUpdate(DynamoDB, DDBTableName, Update)] += 1
+
+    for Counter in Counts: Metrics.Count(Counter, Counts[Counter])
+    return(Counts)
+
+@Metrics.Handler("Events")
+def lambda_handler(event, context):
+    #
+    # Events come straight from EventBridge one at a time, or in batches from
+    # an SQS queue (which is what the replay harness uses). Batch records are
+    # processed in parallel - the Version check makes the order they are
+    # applied in unimportant. Records that fail are reported back so that
+    # only they are retried.
+    #
+    if "Records" not in event:
+        Counts = ProcessEvent(event)
+        logger.info("Event summary: "+json.dumps(Counts))
+        if Counts["Applied"] > 0: BumpGeneration(GetClient("dynamodb"))
+        return(Counts)
+
+    def ProcessRecord(Record):
+        try:
+            return(ProcessEvent(json.loads(Record["body"])))
+        except Exception as e:
+            logger.error("Could not process record "+Record.get("messageId", "")+": "+str(e))
+            return(None)
+
+    Totals   = {"Applied":0, "Stale":0, "Unknown":0, "Ignored":0}
+    Failures = []
+    with ThreadPoolExecutor(max_workers=max(1, min(EventWorkers, len(event["Records"])))) as Executor:
+        for (Record, Counts) in zip(event["Records"], Executor.map(ProcessRecord, event["Records"])):
+            if Counts is None:
+                Failures.append({"itemIdentifier":Record.get("messageId", "")})
+                continue
+            for Counter in Totals: Totals[Counter] += Counts[Counter]
+
+    logger.info("Batch summary: "+json.dumps(Totals)+" with "+str(len(Failures))+" failures")
+    Metrics.Count("RecordsFailed", len(Failures))
+    if Totals["Applied"] > 0: BumpGeneration(GetClient("dynamodb")) # Once for the whole batch
+    return({"batchItemFailures":Failures})
@@ -17,129 +17,684 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
-import boto3
+import time
+InitStart = time.perf_counter() # Taken first so the init report covers every import below
+
 import os
 import logging
-import time
 import json
+import hashlib
+import threading
 from botocore.exceptions import ClientError,EndpointConnectionError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from workspaces_clients import GetClient, Prewarm
+from workspaces_startup import InitTimer
+from workspaces_dynamodb import BatchWriter, BoundedExecutor
+from workspaces_dispatch import LambdaDispatcher
+from workspaces_cache import TTLCache
+from workspaces_metadata import BumpGeneration, GetSummary, PutSummary
+from workspaces_metrics import Metrics
+import workspaces_schema as Schema
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 DDBTableName = os.environ.get("DynamoDBTableName", "WorkspacesPortal")
+RegionWorkers = int(os.environ.get("REGIONWORKERS", "8"))
+BatchWriters  = int(os.environ.get("BATCHWRITERS", "4"))
+
+#
+# With IMPORTSHARDS above 1 this function coordinates the import instead of
+# doing it. The directories in every region are split into that many shards
+# of about the same number of instances and each shard is imported by a
+# separate (worker) invocation of this function.
+#
+ShardCount = int(os.environ.get("IMPORTSHARDS", "1"))
+Dispatcher = None # Set by local harnesses - otherwise workers are run with LambdaDispatcher
+
+#
+# An import stops reading instances StopMargin seconds before the function
+# would time out, leaving time to finish writing and to save the summary.
+# Regions it didn't get through are reported as TimedOut and are picked up
+# again by the next run. A coordinator gives its workers a deadline another
+# StopMargin seconds earlier than its own, so it still has time to save
+# their results once they have all returned.
+#
+StopMargin = 30
+
+#
+# Directory details (registration codes) for each region are kept for
+# DIRECTORYCACHETTL seconds so a warm container doesn't list the directories
+# on every run. At most DIRECTORYCACHESIZE regions are kept.
+#
+DirectoryCache = TTLCache(MaxSize=int(os.environ.get("DIRECTORYCACHESIZE", "64")),
+                          TTL=int(os.environ.get("DIRECTORYCACHETTL", "3600")))
+FetchedRegions = {} # Region -> directories for regions listed during this run
+
+#
+# In diff mode only new or changed instances are written. Nothing reads
+# LastTouched, so unchanged instances are left alone unless HEARTBEATINTERVAL
+# is set, when they are rewritten (to refresh LastTouched) about once per
+# that many seconds. Runs don't start exactly on schedule, so an instance is
+# due once it is within a tenth of the interval of it - otherwise an
+# interval equal to the schedule would only be met every other run. Make it
+# a multiple of the schedule (86400 for a day, say) to spread the rewrites.
+#
+DiffMode          = os.environ.get("IMPORTDIFF", "true").lower() == "true"
+HeartbeatInterval = int(os.environ.get("HEARTBEATINTERVAL", "0"))
+HeartbeatDue      = HeartbeatInterval*0.9
 
-RegistrationCodes = {}
+# Everything the import writes apart from WorkspaceId, LastTouched and Version
+FingerprintAttributes = ["UserName", "Region", "DirectoryId", "InstanceState", "RunningMode",
+                         "RegCode", "ComputerName", "IPAddress", "LastConnected"]
 
-def GetRegCode(Client, DirectoryId):
-    if DirectoryId in RegistrationCodes: return(RegistrationCodes[DirectoryId])
-    
+#
+# Each run counts the instances in every region by state, running mode and
+# directory, and by how long ago they were last connected to, as they go
+# past. The counts are saved in the metadata table (see PutSummary) for the
+# list function to serve with Summary=True. Connections fall into the first
+# of these buckets (most days ago, name) they fit, or Over90Days.
+#
+IdleBuckets = [(1, "Within1Day"), (7, "Within7Days"), (30, "Within30Days"), (90, "Within90Days")]
+
+Init = InitTimer(__name__, InitStart)
+Init.Phase("Imports")
+Prewarm("dynamodb")
+Init.Phase("Prewarm")
+Init.Done()
+
+def GetDirectories(Client, TargetRegion):
+    #
+    # Directory details for a region, from the cache or else from a full
+    # (paginated) describe_workspace_directories. A region is listed at most
+    # once a run, however short the TTL. Raises if the directories can't be
+    # listed.
+    #
+    Directories = DirectoryCache.Get(TargetRegion)
+    if Directories is not None: return(Directories)
+    if TargetRegion in FetchedRegions: return(FetchedRegions[TargetRegion])
+
+    Directories = {}
+    for Page in Client.get_paginator("describe_workspace_directories").paginate():
+        for Dir in Page["Directories"]:
+            Directories[Dir["DirectoryId"]] = {"RegCode":Dir.get("RegistrationCode", ""),
+                                               "Name":   Dir.get("DirectoryName", ""),
+                                               "State":  Dir.get("State", "")}
+
+    DirectoryCache.Put(TargetRegion, Directories)
+    FetchedRegions[TargetRegion] = Directories
+    logger.info("Loaded "+str(len(Directories))+" directories in "+TargetRegion)
+    return(Directories)
+
+def GetRegCode(Client, TargetRegion, DirectoryId):
     try:
-        DirectoryList = Client.describe_workspace_directories()
+        with Metrics.Timer("RegCodes", TargetRegion):
+            Directories = GetDirectories(Client, TargetRegion)
+
+            #
+            # A directory we don't know about may have been added since the
+            # region was cached - fetch the region again, but only once a run
+            #
+            if DirectoryId not in Directories and TargetRegion not in FetchedRegions:
+                DirectoryCache.Delete(TargetRegion)
+                Directories = GetDirectories(Client, TargetRegion)
     except Exception as e:
         logger.error("Did not get list of directories: "+str(e))
         return("")
-        
-    for Dir in DirectoryList["Directories"]:
-        RegistrationCodes[Dir["DirectoryId"]] = Dir["RegistrationCode"]
 
-    if DirectoryId in RegistrationCodes: return(RegistrationCodes[DirectoryId])
+    if DirectoryId in Directories: return(Directories[DirectoryId]["RegCode"])
 
     return("")
-        
-def lambda_handler(event, context):
+
+def Fingerprint(Item):
+    #
+    # A short hash of the attributes we care about so that we only have to
+    # hold 8 bytes per instance in memory rather than the whole table
+    #
+    Digest = hashlib.blake2b(digest_size=8)
+    for Name in FingerprintAttributes:
+        if Name not in Item: continue
+        for Type in Item[Name]:
+            Digest.update((Name+"="+Type+":"+str(Item[Name][Type])+"\0").encode())
+    return(Digest.digest())
+
+def LoadFingerprints(Client, Regions=None):
+    #
+    # Returns WorkspaceId -> (fingerprint, LastTouched, has Version) for everything already
+    # in the table, or None if the table could not be read (in which case
+    # every instance is written as if diff mode was turned off). Workers pass
+    # the regions in their shard so that only those items are returned.
+    #
+    (Projection, Names) = Schema.Projection(["WorkspaceId", "LastTouched", "Version"]+FingerprintAttributes)
+    Args = {"TableName":DDBTableName, "ProjectionExpression":Projection, "ExpressionAttributeNames":Names}
+
+    if Regions is not None:
+        # Items not yet converted to the compact schema still have a Region attribute
+        RegionNames = [Key for Key, Name in Names.items() if Name in Schema.Names(["Region"])]
+        InList      = ",".join([":r"+str(Index) for Index in range(len(Regions))])
+        Args["ExpressionAttributeValues"] = {":r"+str(Index):{"S":Region} for Index, Region in enumerate(Regions)}
+        Args["FilterExpression"]          = " OR ".join([Name+" IN ("+InList+")" for Name in RegionNames])
+
+    Known    = {}
+    StartKey = {}
+    while True: # Loop until no more items from the DDB scan
+        try:
+            if len(StartKey) == 0:
+                Result = Client.scan(**Args)
+            else:
+                Result = Client.scan(ExclusiveStartKey=StartKey, **Args)
+        except ClientError as e:
+            logger.error("DynamoDB error loading current items: "+e.response["Error"]["Message"])
+            return(None)
+
+        for Item in map(Schema.Expand, Result["Items"]):
+            LastTouched = float(Item["LastTouched"]["N"]) if "LastTouched" in Item else 0.0
+            Known[Item["WorkspaceId"]["S"]] = (Fingerprint(Item), LastTouched, "Version" in Item)
+
+        if "LastEvaluatedKey" in Result:
+            StartKey = Result["LastEvaluatedKey"]
+        else:
+            break
+
+    logger.info("Loaded "+str(len(Known))+" current items for diff")
+    return(Known)
+
+def GetRegions():
+    with Metrics.Timer("RegionListing"):
+        return(ListRegions())
+
+def ListRegions():
     Regions = []
     if os.environ.get("REGIONLIST") is not None:
         Regions = os.environ.get("REGIONLIST").split(",")
         logger.info("Regions: "+",".join(Regions))
     else:
         try:
-            EC2 = boto3.client("ec2")
+            EC2 = GetClient("ec2")
             Response = EC2.describe_regions()
             for Region in Response["Regions"]:
                 Regions.append(Region["RegionName"])
         except Exception as e:
             logger.error("Unable to get a list of regions: "+str(e))
             Regions.append("us-east-1")
-        logger.info("All regions: "+"".join(Regions))
+        logger.info("All regions: "+",".join(Regions))
+
+    return(Regions)
+
+def GetDeadline(context, Deadline=None):
+    #
+    # The time (seconds since the epoch, so it can be passed to workers) to
+    # stop reading instances: StopMargin before this invocation times out,
+    # or Deadline if that is sooner. None if there's no context to ask.
+    #
+    if context is None: return(Deadline)
+    Own = time.time()+context.get_remaining_time_in_millis()/1000-StopMargin
+    if Deadline is None: return(Own)
+    return(min(Deadline, Own))
+
+def PutIfNewer(Item):
+    # The Version may be stored under either name until the table has been converted
+    try:
+        GetClient("dynamodb").put_item(TableName=DDBTableName, Item=Schema.ForWrite(Item),
+                                       ConditionExpression="(attribute_not_exists(#v) OR #v <= :v) AND (attribute_not_exists(#sv) OR #sv <= :v)",
+                                       ExpressionAttributeNames={"#v":"Version", "#sv":Schema.ShortNames["Version"]},
+                                       ExpressionAttributeValues={":v":Item["Version"]})
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException": raise
+        Metrics.SampledInfo("superseded", "  Not updating "+Item["WorkspaceId"]["S"]+" - it has changed since we read it")
+        return("Superseded")
+    return("Updated")
 
-    for TargetRegion in Regions:
-        logger.info("Checking: "+TargetRegion)
-        WorkspacesClient = boto3.client("workspaces", region_name=TargetRegion)
-        paginator = WorkspacesClient.get_paginator("describe_workspaces")
-     
+def ListPages(Client, TargetRegion, Filters):
+    #
+    # Generator of pages of (up to 25) instances, read as they are needed
+    # rather than all at once
+    #
+    Paginator = Client.get_paginator("describe_workspaces")
+    for Filter in Filters:
+        Pages = iter(Paginator.paginate(PaginationConfig={"PageSize": 25}, **Filter))
+        while True:
+            with Metrics.Timer("Pagination", TargetRegion):
+                Page = next(Pages, None)
+            if Page is None: break
+            yield(Page["Workspaces"])
+
+def GetConnectionTimes(Client, TargetRegion, Instances):
+    #
+    # WorkspaceId -> time of the last user connection for a page of
+    # instances, in one call (the API accepts up to 25 WorkspaceIds)
+    #
+    LastConnectedTime = {}
+    if len(Instances) == 0: return(LastConnectedTime)
+
+    with Metrics.Timer("ConnectionStatus", TargetRegion):
+        Results = Client.describe_workspaces_connection_status(WorkspaceIds=[Instance["WorkspaceId"] for Instance in Instances])
+    for Connection in Results["WorkspacesConnectionStatus"]:
         try:
-            ListResponse = {}
-            for page in paginator.paginate(PaginationConfig={"PageSize": 25}):
-                if ListResponse:
-                    ListResponse["Workspaces"] = (
-                        ListResponse["Workspaces"] + page["Workspaces"]
-                    )
-                else:
-                    ListResponse = {**ListResponse, **page}
-            logger.debug(
-                "ListResponse  %s, size %s",
-                ListResponse["Workspaces"],
-                len(ListResponse["Workspaces"]),
-            )
-            logger.info("Found %s workspaces", len(ListResponse["Workspaces"]))
-        except EndpointConnectionError as e:
-            logger.warning("Could not connect to endpoint in region "+TargetRegion)
-            continue
-        except Exception as e:
-            logger.error("Failed to get Workspaces list for region "+TargetRegion+" - "+str(e))
-            continue
-            
-        if len(ListResponse["Workspaces"]) == 0:
-            logger.info("  No Workspaces instances found in region "+TargetRegion)
-            continue
+            LastConnectedTime[Connection["WorkspaceId"]] = Connection["LastKnownUserConnectionTimestamp"].strftime("%s")
+        except:
+            pass
+    return(LastConnectedTime)
 
-        #
-        # Here we get the connection details for all the Workspaces instances at once
-        # It is more efficient this way even though we could call this API
-        # individually for each instance we have in ListResponse
-        #
-        Results = WorkspacesClient.describe_workspaces_connection_status()
-        ConnectionResponse = Results
-        while Results.get("NextToken"):
-            Results = WorkspacesClient.describe_workspaces_connection_status(
-                NextToken=Results["NextToken"]
-            )
-            ConnectionResponse["WorkspacesConnectionStatus"] = (
-                ConnectionResponse["WorkspacesConnectionStatus"]
-                + Results["WorkspacesConnectionStatus"]
-            )
-        logger.info(
-            "Found %s workspaces_connection_status",
-            len(ConnectionResponse["WorkspacesConnectionStatus"]),
-        )
-        LastConnectedTime = {}
-        for Connection in ConnectionResponse["WorkspacesConnectionStatus"]:
-            try:
-                LastConnectedTime[Connection["WorkspaceId"]] = Connection["LastKnownUserConnectionTimestamp"].strftime("%s")
-            except:
-                pass
+def ConnectedPages(Client, TargetRegion, Pages):
+    #
+    # Generator of (page, connection times). The connection times for a page
+    # are looked up in the background while the next page is read, so only
+    # one page is ever held back.
+    #
+    with ThreadPoolExecutor(max_workers=1) as Lookups:
+        Pending = None
+        for Instances in Pages:
+            Lookup = Lookups.submit(GetConnectionTimes, Client, TargetRegion, Instances)
+            if Pending is not None: yield(Pending[0], Pending[1].result())
+            Pending = (Instances, Lookup)
+        if Pending is not None: yield(Pending[0], Pending[1].result())
 
-        DynamoDBClient = boto3.client("dynamodb")
-        for Instance in ListResponse["Workspaces"]:
-            logger.info("  WorkspaceId: "+Instance["WorkspaceId"])
+def MakeItems(Client, TargetRegion, Pages, RegCodes, Now, Version):
+    #
+    # Generator of table items (in the long form) for pages of instances
+    # and their connection times
+    #
+    for (Instances, LastConnectedTime) in Pages:
+        for Instance in Instances:
+            Metrics.SampledInfo("instance", "  "+TargetRegion+" WorkspaceId: "+Instance["WorkspaceId"])
 
             Item = {"WorkspaceId":  {"S":Instance["WorkspaceId"]},
                     "UserName":     {"S":Instance["UserName"]},
                     "Region":       {"S":TargetRegion},
+                    "DirectoryId":  {"S":Instance["DirectoryId"]},
                     "InstanceState":{"S":Instance["State"]},
-                    "LastTouched":  {"N":str(time.time())},
+                    "LastTouched":  {"N":str(Now)},
+                    "Version":      {"N":str(Version)},
                     "RunningMode":  {"S":Instance["WorkspaceProperties"]["RunningMode"]},
-                    "RegCode":      {"S":GetRegCode(WorkspacesClient, Instance["DirectoryId"])}
+                    "RegCode":      {"S":RegCodes[Instance["DirectoryId"]] if Instance["DirectoryId"] in RegCodes
+                                          else GetRegCode(Client, TargetRegion, Instance["DirectoryId"])}
             }
 
             if "ComputerName"          in Instance:          Item["ComputerName"]  = {"S":Instance["ComputerName"]}
             if "IpAddress"             in Instance:          Item["IPAddress"]     = {"S":Instance["IpAddress"]}
             if Instance["WorkspaceId"] in LastConnectedTime: Item["LastConnected"] = {"N":LastConnectedTime[Instance["WorkspaceId"]]}
-            logger.debug(
-                "  WorkspaceId: " + Instance["WorkspaceId"] + " " + json.dumps(Item)
-            )
+            if logger.isEnabledFor(logging.DEBUG): # Don't serialise every item just to throw it away
+                logger.debug(
+                    "  WorkspaceId: " + Instance["WorkspaceId"] + " " + json.dumps(Item)
+                )
+
+            yield(Item)
+
+def NewAggregate():
+    return({"Workspaces":0, "InstanceState":{}, "RunningMode":{}, "Directories":{}, "LastConnected":{}})
+
+def Tally(Aggregate, Item, Now):
+    Aggregate["Workspaces"] += 1
+    for (Name, Attribute) in [("InstanceState", "InstanceState"), ("RunningMode", "RunningMode"), ("Directories", "DirectoryId")]:
+        Value = Item[Attribute]["S"]
+        Aggregate[Name][Value] = Aggregate[Name].get(Value, 0)+1
+
+    Bucket = "Never"
+    if "LastConnected" in Item:
+        Days   = (Now-float(Item["LastConnected"]["N"]))/86400
+        Bucket = next((Name for (Most, Name) in IdleBuckets if Days <= Most), "Over90Days")
+    Aggregate["LastConnected"][Bucket] = Aggregate["LastConnected"].get(Bucket, 0)+1
+
+def AddAggregates(Into, Other):
+    # Adds the counts in Other (nested dictionaries of counts) to Into
+    for (Name, Value) in Other.items():
+        if isinstance(Value, dict):
+            AddAggregates(Into.setdefault(Name, {}), Value)
+        else:
+            Into[Name] = Into.get(Name, 0)+Value
+    return(Into)
+
+def SaveSummary(Client, Aggregates, Summaries):
+    #
+    # Writes the fleet summary for every region in Summaries. A region that
+    # failed (in any shard) keeps its counts from the last import that read
+    # all of it, marked Stale, rather than show a partial count. Timing out
+    # counts as failing.
+    #
+    Now    = int(time.time())
+    Failed = set([Summary["Region"] for Summary in Summaries if Summary["Status"] != "OK"])
+
+    Previous = {}
+    if len(Failed) > 0:
+        try:
+            Previous = json.loads(GetSummary(Client) or "{}").get("Regions", {})
+        except Exception as e:
+            logger.warning("Could not read the last fleet summary, failed regions will be left out: "+str(e))
+
+    Regions = {}
+    for Region in sorted(set([Summary["Region"] for Summary in Summaries])):
+        if Region not in Failed:
+            Regions[Region] = dict(Aggregates.get(Region, NewAggregate()), Updated=Now)
+        elif Region in Previous:
+            Regions[Region] = dict(Previous[Region], Stale=True)
+
+    Total = NewAggregate()
+    for Counts in Regions.values(): AddAggregates(Total, {Name:Counts[Name] for Name in Total})
+
+    try:
+        with Metrics.Timer("Summary"):
+            PutSummary(Client, {"Updated":Now, "Regions":Regions, "Total":Total})
+    except Exception as e:
+        logger.error("Could not save the fleet summary: "+str(e))
+
+def ImportRegion(TargetRegion, Writer, Known=None, Directories=None, Deadline=None):
+    #
+    # Imports every instance in TargetRegion, or only those in Directories
+    # (DirectoryId -> registration code) when importing a shard.
+    #
+    # Instances stream through a pipeline a page at a time: each page of 25
+    # from describe_workspaces has its connection times looked up (one call
+    # per page, overlapped with reading the next page), is turned into
+    # items, and any that need writing go to the batch writer - which starts
+    # writing as soon as it has 25 and holds back the pipeline if DynamoDB
+    # falls behind. So memory use doesn't grow with the size of the region.
+    # Changed instances that have a Version can't be batched (see below) and
+    # are written with conditional puts on a pool of BATCHWRITERS threads
+    # instead, which holds back the pipeline in the same way. Reading stops
+    # at Deadline, if set, and the region is left TimedOut.
+    #
+    Summary = {"Region":TargetRegion, "Status":"OK", "Workspaces":0,
+               "Inserted":0, "Updated":0, "Superseded":0, "Heartbeat":0, "Unchanged":0, "Unchecked":0}
+    if Directories is not None: Summary["Directories"] = sorted(Directories.keys())
+    Aggregate = NewAggregate()
+    StartTime = time.time()
+    Version   = int(StartTime*1000000) # Same scale as event versions - nothing we read is older than this
+
+    Putter = BoundedExecutor(BatchWriters) # Threads are only started if there is something to put
+    Puts   = {"Updated":0, "Superseded":0, "Errors":[]}
+    Lock   = threading.Lock()
+
+    def Put(Future):
+        try:
+            Outcome = Future.result()
+        except Exception as e:
+            with Lock:
+                Puts["Errors"].append(str(e))
+            return
+        with Lock:
+            Puts[Outcome] += 1
+
+    logger.info("Checking: "+TargetRegion)
+    WorkspacesClient = GetClient("workspaces", TargetRegion)
+
+    Filters = [{}]
+    if Directories is not None: Filters = [{"DirectoryId":DirectoryId} for DirectoryId in Directories]
+
+    Pages = ConnectedPages(WorkspacesClient, TargetRegion, ListPages(WorkspacesClient, TargetRegion, Filters))
+    Items = MakeItems(WorkspacesClient, TargetRegion, Pages, Directories or {}, StartTime, Version)
+    try:
+        for Item in Items:
+            if Deadline is not None and time.time() > Deadline:
+                logger.warning("Out of time importing "+TargetRegion+" after "+str(Summary["Workspaces"])+" instances")
+                Summary["Status"] = "TimedOut"
+                break
+
+            Summary["Workspaces"] += 1
+            Tally(Aggregate, Item, StartTime)
+            WorkspaceId = Item["WorkspaceId"]["S"]
+
+            if Known is None:
+                Summary["Unchecked"] += 1
+            elif WorkspaceId not in Known:
+                Summary["Inserted"] += 1
+            else:
+                (CurrentFingerprint, LastTouched, HasVersion) = Known[WorkspaceId]
+                if CurrentFingerprint != Fingerprint(Item):
+                    #
+                    # The change may have come from an event (see
+                    # lambda_workspaces_events.py) newer than what we read from
+                    # Workspaces, so only overwrite it if it is older
+                    #
+                    if HasVersion:
+                        with Metrics.Timer("Writes", TargetRegion): # Includes waiting for a free thread
+                            Putter.Submit(PutIfNewer, Item, Done=Put)
+                        continue
+                    Summary["Updated"] += 1
+                elif HeartbeatInterval > 0 and StartTime-LastTouched >= HeartbeatDue:
+                    Summary["Heartbeat"] += 1
+                else:
+                    Summary["Unchanged"] += 1
+                    continue
+
+            with Metrics.Timer("Writes", TargetRegion): # Includes waiting for the writers to catch up
+                Writer.Put(Schema.ForWrite(Item))
+    except EndpointConnectionError:
+        logger.warning("Could not connect to endpoint in region "+TargetRegion)
+        Summary["Status"] = "Unreachable"
+    except Exception as e:
+        logger.error("Failed to import Workspaces for region "+TargetRegion+" - "+str(e))
+        Summary["Status"] = "Failed"
+        Summary["Error"] = str(e)
+    finally:
+        # Stops the pipeline (and waits for any connection lookup) if the region failed part way
+        Items.close()
+        Pages.close()
+        Putter.Close()
+
+    Summary["Updated"]    += Puts["Updated"]
+    Summary["Superseded"] += Puts["Superseded"]
+    if len(Puts["Errors"]) > 0:
+        logger.error("Failed to update "+str(len(Puts["Errors"]))+" Workspaces in region "+TargetRegion+" - "+Puts["Errors"][0])
+        if Summary["Status"] == "OK":
+            Summary["Status"] = "Failed"
+            Summary["Error"]  = Puts["Errors"][0]
+
+    if Summary["Status"] == "OK" and Summary["Workspaces"] == 0:
+        logger.info("  No Workspaces instances found in region "+TargetRegion)
+    else:
+        logger.info("Found %s workspaces in %s", Summary["Workspaces"], TargetRegion)
+
+    Summary["Seconds"]   = round(time.time()-StartTime, 3)
+    Summary["Aggregate"] = Aggregate # Taken off again before the summary is logged
+    return(Summary)
+
+def ListDirectories(TargetRegion):
+    with Metrics.Timer("RegCodes", TargetRegion):
+        Directories = GetDirectories(GetClient("workspaces", TargetRegion), TargetRegion)
+    return([{"Region":TargetRegion, "DirectoryId":DirectoryId, "RegCode":Dir["RegCode"]} for DirectoryId, Dir in Directories.items()])
+
+def CountInstances(Client):
+    #
+    # Number of instances per directory as of the last import, used to size
+    # the shards. Only DirectoryId is fetched but the scan still reads (and
+    # is charged for) whole items.
+    #
+    (Projection, Names) = Schema.Projection(["DirectoryId"])
+    Counts   = {}
+    StartKey = {}
+    while True: # Loop until no more items from the DDB scan
+        if len(StartKey) == 0:
+            Result = Client.scan(TableName=DDBTableName, ProjectionExpression=Projection, ExpressionAttributeNames=Names)
+        else:
+            Result = Client.scan(TableName=DDBTableName, ProjectionExpression=Projection, ExpressionAttributeNames=Names, ExclusiveStartKey=StartKey)
+
+        for Item in map(Schema.Expand, Result["Items"]):
+            if "DirectoryId" in Item: Counts[Item["DirectoryId"]["S"]] = Counts.get(Item["DirectoryId"]["S"], 0)+1
+
+        if "LastEvaluatedKey" in Result:
+            StartKey = Result["LastEvaluatedKey"]
+        else:
+            return(Counts)
+
+def MakeShards(Directories, Counts, Shards):
+    #
+    # Largest directories first, each to whichever shard has the fewest
+    # instances so far. Directories we haven't seen before are assumed to be
+    # of average size. A directory is never split so one very large
+    # directory can still make its shard the slowest.
+    #
+    Default = 1
+    if len(Counts) > 0: Default = max(1, sum(Counts.values())//len(Counts))
+
+    Result = [{"Id":Index, "Weight":0, "Directories":[]} for Index in range(Shards)]
+    for Dir in sorted(Directories, key=lambda Dir: Counts.get(Dir["DirectoryId"], Default), reverse=True):
+        Shard = min(Result, key=lambda Shard: Shard["Weight"])
+        Shard["Weight"] += Counts.get(Dir["DirectoryId"], Default)
+        Shard["Directories"].append(Dir)
+
+    return([Shard for Shard in Result if len(Shard["Directories"]) > 0])
+
+def CountRegion(Summary):
+    for Counter in ["Workspaces", "Inserted", "Updated", "Superseded", "Heartbeat", "Unchanged", "Unchecked"]:
+        if Counter in Summary: Metrics.Count(Counter, Summary[Counter], Summary["Region"])
+    if Summary["Status"] != "OK": Metrics.Count({"Failed":"RegionsFailed", "TimedOut":"RegionsTimedOut"}.get(Summary["Status"], "RegionsUnreachable"))
+
+def AddChanges(Summaries):
+    Changes = {}
+    for Counter in ["Inserted", "Updated", "Superseded", "Heartbeat", "Unchanged", "Unchecked"]:
+        Changes[Counter] = sum([Summary.get(Counter, 0) for Summary in Summaries])
+    return(Changes)
+
+def RunImport(Work, ShardRegions=None, Deadline=None):
+    #
+    # Work is a list of (region, directories) - directories is None to
+    # import the whole region. A shard worker (ShardRegions set) hands its
+    # region counts back to the coordinator to save rather than saving them.
+    # Regions still being read at Deadline are cut short (see ImportRegion).
+    #
+    # Regions are independent of each other so they are swept in parallel,
+    # and a failure in one doesn't stop the others. All of them feed the same
+    # batch writer, so items are written in groups of 25 by several writer
+    # threads rather than one put_item each.
+    #
+    DynamoDBClient = GetClient("dynamodb")
+    Writer = BatchWriter(DynamoDBClient, DDBTableName, Writers=BatchWriters)
+
+    Known = None
+    if DiffMode:
+        with Metrics.Timer("DiffLoad"):
+            Known = LoadFingerprints(DynamoDBClient, ShardRegions)
+
+    Summaries = []
+    with ThreadPoolExecutor(max_workers=max(1, min(RegionWorkers, len(Work)))) as Executor:
+        Futures = {Executor.submit(ImportRegion, TargetRegion, Writer, Known, Directories, Deadline):TargetRegion for (TargetRegion, Directories) in Work}
+        for Future in as_completed(Futures):
             try:
-                DynamoDBClient.put_item(TableName=DDBTableName, Item=Item)
-            except ClientError as e:
-                logger.error("DynamoDB error: "+e.response["Error"]["Message"])
\ No newline at end of file
+                Summaries.append(Future.result())
+            except Exception as e:
+                logger.error("Import failed for region "+Futures[Future]+" - "+str(e))
+                Summaries.append({"Region":Futures[Future], "Status":"Failed", "Error":str(e)})
+
+    Summaries.sort(key=lambda Summary: Summary["Region"])
+    Aggregates = {}
+    for Summary in Summaries:
+        if "Aggregate" in Summary: AddAggregates(Aggregates.setdefault(Summary["Region"], {}), Summary.pop("Aggregate"))
+        logger.info("Region summary: "+json.dumps(Summary))
+        CountRegion(Summary)
+
+    Changes = AddChanges(Summaries)
+    logger.info("Change summary: "+json.dumps(Changes))
+
+    with Metrics.Timer("Writes"):
+        WriteSummary = Writer.Close()
+    logger.info("Write summary: "+json.dumps(WriteSummary))
+    for Counter in WriteSummary: Metrics.Count(Counter, WriteSummary[Counter])
+
+    # Conditional puts of newer versions don't go through the writer so count them too
+    if WriteSummary["Written"] > 0 or Changes.get("Updated", 0) > 0: BumpGeneration(DynamoDBClient)
+
+    CacheSummary = DirectoryCache.Stats()
+    logger.info("Directory cache: "+json.dumps(CacheSummary))
+
+    Result = {"Regions":Summaries, "Changes":Changes, "Writes":WriteSummary, "DirectoryCache":CacheSummary}
+    if ShardRegions is None:
+        SaveSummary(DynamoDBClient, Aggregates, Summaries)
+    else:
+        Result["Aggregates"] = Aggregates
+    return(Result)
+
+def ImportShard(Shard, Deadline=None):
+    #
+    # Worker - the coordinator has already looked up the registration codes
+    #
+    Work = {}
+    for Dir in Shard["Directories"]:
+        Work.setdefault(Dir["Region"], {})[Dir["DirectoryId"]] = Dir["RegCode"]
+
+    logger.info("Importing shard "+str(Shard["Id"])+": "+str(len(Shard["Directories"]))+" directories in "+",".join(sorted(Work.keys())))
+    Result = RunImport(list(Work.items()), sorted(Work.keys()), Deadline)
+    Result["Shard"] = Shard["Id"]
+    return(Result)
+
+def Coordinate(context):
+    Deadline = GetDeadline(context) # For the workers to have returned by
+    Regions  = GetRegions()
+
+    Directories = []
+    Summaries   = []
+    with ThreadPoolExecutor(max_workers=max(1, min(RegionWorkers, len(Regions)))) as Executor:
+        Futures = {Executor.submit(ListDirectories, TargetRegion):TargetRegion for TargetRegion in Regions}
+        for Future in as_completed(Futures):
+            try:
+                Directories += Future.result()
+            except EndpointConnectionError:
+                logger.warning("Could not connect to endpoint in region "+Futures[Future])
+                Summaries.append({"Region":Futures[Future], "Status":"Unreachable"})
+                Metrics.Count("RegionsUnreachable")
+            except Exception as e:
+                logger.error("Failed to get directory list for region "+Futures[Future]+" - "+str(e))
+                Summaries.append({"Region":Futures[Future], "Status":"Failed", "Error":str(e)})
+                Metrics.Count("RegionsFailed")
+
+    try:
+        with Metrics.Timer("Sharding"):
+            Counts = CountInstances(GetClient("dynamodb"))
+    except Exception as e:
+        logger.error("Could not count current instances, shards may be uneven: "+str(e))
+        Counts = {}
+
+    logger.info("Directory cache: "+json.dumps(DirectoryCache.Stats()))
+
+    Shards = MakeShards(Directories, Counts, ShardCount)
+    for Shard in Shards:
+        logger.info("Shard "+str(Shard["Id"])+": "+str(len(Shard["Directories"]))+" directories, about "+str(Shard["Weight"])+" instances")
+
+    Workers = Dispatcher
+    if Workers is None: Workers = LambdaDispatcher(context.invoked_function_arn, Workers=len(Shards))
+
+    #
+    # Workers stop reading StopMargin before Deadline so they have time to
+    # finish writing and return. Any that still haven't returned by then are
+    # counted as failed - and their regions as stale - so that the summary
+    # below is always saved.
+    #
+    Events = [{"Shard":Shard} for Shard in Shards]
+    if Deadline is not None:
+        for Event in Events: Event["Deadline"] = Deadline-StopMargin
+
+    with Metrics.Timer("Workers"):
+        Results = Workers.Dispatch(Events, Deadline)
+    # Each worker reports its own region and write counts so they aren't counted again here
+
+    Writes     = {"Written":0, "Retried":0, "Failed":0}
+    Aggregates = {}
+    for (Shard, Result) in zip(Shards, Results):
+        if "Regions" not in Result:
+            logger.error("Shard "+str(Shard["Id"])+" failed - "+str(Result.get("Error")))
+            Metrics.Count("ShardsFailed")
+            Summaries += [{"Region":Dir["Region"], "Directories":[Dir["DirectoryId"]], "Status":"Failed", "Error":Result.get("Error")} for Dir in Shard["Directories"]]
+            continue
+
+        Summaries += Result["Regions"]
+        for Counter in Writes: Writes[Counter] += Result["Writes"][Counter]
+        AddAggregates(Aggregates, Result.get("Aggregates", {})) # A region can be split over several shards
+
+    Summaries.sort(key=lambda Summary: Summary["Region"])
+    Changes = AddChanges(Summaries)
+    logger.info("Change summary: "+json.dumps(Changes))
+    logger.info("Write summary: "+json.dumps(Writes))
+    SaveSummary(GetClient("dynamodb"), Aggregates, Summaries)
+
+    return({"Shards":[{"Shard":Shard["Id"], "Directories":len(Shard["Directories"]), "Weight":Shard["Weight"]} for Shard in Shards],
+            "Regions":Summaries, "Changes":Changes, "Writes":Writes, "DirectoryCache":DirectoryCache.Stats()})
+
+@Metrics.Handler("Import")
+def lambda_handler(event, context):
+    FetchedRegions.clear()
+
+    if "Shard" in event: return(ImportShard(event["Shard"], GetDeadline(context, event.get("Deadline"))))
+
+    if ShardCount > 1: return(Coordinate(context))
+
+    return(RunImport([(TargetRegion, None) for TargetRegion in GetRegions()], Deadline=GetDeadline(context)))
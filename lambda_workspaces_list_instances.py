@@ -17,32 +17,180 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
-import boto3
-from boto3.dynamodb.conditions import Attr
+import time
+InitStart = time.perf_counter() # Taken first so the init report covers every import below
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
 import os
 import logging
 import json
 import base64
+import hashlib
+from decimal import Decimal
+from workspaces_auth import AuthError, Authorise
+from workspaces_cache import TTLCache
+from workspaces_clients import GetClient, GetResource, Prewarm
+from workspaces_metadata import GetGeneration, GetSummary
+from workspaces_metrics import Metrics
+import workspaces_schema as Schema
+from workspaces_startup import InitTimer
 
 logger = logging.getLogger()
-logger.setLevel(logger.INFO)
+logger.setLevel(logging.INFO)
 
-DDBTableName = os.environ.get("DynamoDBTableName", "WorkspacesPortal")
+DDBTableName  = os.environ.get("DynamoDBTableName", "WorkspacesPortal")
+UserNameIndex = os.environ.get("USERNAMEINDEX", "UserName-index") # Set to "" to always scan
+ScanSegments  = int(os.environ.get("SCANSEGMENTS", "4"))
+MaxPageSize   = int(os.environ.get("MAXPAGESIZE", "1000"))
+#
+# Callers can ask for only the attributes a view of the front end shows with
+# View=user or View=admin. Without a View every attribute is returned.
+#
+Views = {"user": ["WorkspaceId", "ComputerName", "Region", "InstanceState", "RunningMode", "IPAddress", "RegCode"],
+         "admin":["WorkspaceId", "UserName", "ComputerName", "Region", "InstanceState", "RunningMode", "IPAddress",
+                  "LastConnected", "RegCode"]}
 
-def ParseJWT(Token):
-    Auth = Token.split(".")[1]
-    
-    MissingPadding = len(Auth)%4
-    if MissingPadding != 0: Auth += "="*(4-MissingPadding)
-        
-    try:
-        AuthDict = json.loads(base64.urlsafe_b64decode(Auth))
-    except Exception as e:
-        logger.error("Could not parse JWT: "+str(e)+" "+Token)
-        AuthDict = {}
+ListCacheSize = int(os.environ.get("LISTCACHESIZE", "256"))
+ListCacheTTL  = int(os.environ.get("LISTCACHETTL", "60")) # Set to 0 to turn the cache off
+
+#
+# Serialised response bodies keyed by view (user or admin) and page. Each entry
+# remembers the table generation it was built from and is only served while
+# the generation is the same - so a warm container answers repeat page loads
+# (and refreshes) with one small read instead of a query or scan.
+#
+ListCache = TTLCache(MaxSize=ListCacheSize, TTL=ListCacheTTL)
+
+#
+# Build the DynamoDB resource (which also loads boto3.dynamodb.conditions)
+# while the function initialises rather than in the first request
+#
+Init = InitTimer(__name__, InitStart)
+Init.Phase("Imports")
+Prewarm("dynamodb", Resource=True)
+Prewarm("dynamodb") # For reading the table generation
+Init.Phase("Prewarm")
+Init.Done()
+
+def EncodeDecimal(Value):
+    #
+    # DynamoDB numbers come back as Decimal() which json can't serialise, so
+    # convert them on the way out rather than rewriting every item first
+    #
+    if isinstance(Value, Decimal):
+        if Value == Value.to_integral_value(): return(int(Value))
+        return(float(Value))
+    raise TypeError("Object of type "+type(Value).__name__+" is not JSON serializable")
+
+def EncodeToken(StartKey):
+    return(base64.urlsafe_b64encode(json.dumps(StartKey, default=EncodeDecimal).encode()).decode())
+
+def DecodeToken(Token):
+    StartKey = json.loads(base64.urlsafe_b64decode(Token.encode()))
+    if not isinstance(StartKey, dict) or "WorkspaceId" not in StartKey: raise ValueError("Token has no WorkspaceId")
+    return(StartKey)
+
+def ProjectionArgs(Attributes):
+    if Attributes is None: return({})
+    (Projection, Names) = Schema.Projection(Attributes)
+    return({"ProjectionExpression":Projection, "ExpressionAttributeNames":Names})
+
+def QueryUserWorkspaces(Table, Username, Limit=None, StartKey=None, Attributes=None):
+    #
+    # Reads only the items belonging to this user from the UserName index so the
+    # cost of a page load depends on how many instances the user has rather than
+    # on the size of the table. With a Limit only one page is read and the key
+    # to continue from (or None) is returned with it. Attributes limits what
+    # is returned (but not what is read).
+    #
+    Expression = Key("UserName").eq(Username)
+    Args       = ProjectionArgs(Attributes)
+
+    if Limit is not None:
+        if StartKey is None:
+            Result = Table.query(IndexName=UserNameIndex, KeyConditionExpression=Expression, Limit=Limit, **Args)
+        else:
+            Result = Table.query(IndexName=UserNameIndex, KeyConditionExpression=Expression, Limit=Limit, ExclusiveStartKey=StartKey, **Args)
+        return(Result["Items"], Result.get("LastEvaluatedKey"))
+
+    StartKey       = {}
+    WorkspacesList = []
+    while True: # Loop until no more items come from the DDB Query
+        logger.info("DDB query loop, StartKey="+str(StartKey))
+        if len(StartKey) == 0:
+            Result = Table.query(IndexName=UserNameIndex, KeyConditionExpression=Expression, **Args)
+        else:
+            Result = Table.query(IndexName=UserNameIndex, KeyConditionExpression=Expression, ExclusiveStartKey=StartKey, **Args)
 
-    return(AuthDict)
+        WorkspacesList.extend(Result["Items"])
+
+        if "LastEvaluatedKey" in Result:
+            StartKey = Result["LastEvaluatedKey"]
+        else:
+            break
 
+    return(WorkspacesList, None)
+
+def ScanWorkspaces(Table, Username=None, Limit=None, StartKey=None, Attributes=None):
+    #
+    # Reads the whole table - either for the admin view (Username is None) or
+    # as a fallback when the UserName index isn't available. Without a Limit
+    # the table is read with a parallel scan across ScanSegments segments;
+    # with one, a single page is read and returned with the key to continue
+    # from (or None).
+    #
+    from workspaces_dynamodb import ParallelScan # Only needed for the admin view so loaded on first use
+
+    Args = ProjectionArgs(Attributes)
+    if Username is not None: Args["FilterExpression"] = Attr("UserName").eq(Username)
+
+    if Limit is not None:
+        if StartKey is not None: Args["ExclusiveStartKey"] = StartKey
+        Result = Table.scan(Limit=Limit, **Args)
+        return(Result["Items"], Result.get("LastEvaluatedKey"))
+
+    # Segments finish in any order so sort to keep the body (and its ETag) the same while the table is
+    return(sorted(ParallelScan(Table.scan, ScanSegments, **Args), key=lambda Item: Item["WorkspaceId"]), None)
+
+def MakeETag(Body):
+    return('"'+hashlib.blake2b(Body.encode(), digest_size=16).hexdigest()+'"')
+
+def ETagMatches(Headers, ETag):
+    #
+    # Header names aren't case sensitive and If-None-Match can hold a list of
+    # (possibly weak) ETags or *
+    #
+    for (Name, Value) in Headers.items():
+        if Name.lower() != "if-none-match" or Value is None: continue
+        for Tag in Value.split(","):
+            Tag = Tag.strip()
+            if Tag.startswith("W/"): Tag = Tag[2:]
+            if Tag == ETag or Tag == "*": return(True)
+    return(False)
+
+def Reply(Response, event, ETag, Body):
+    #
+    # The browser revalidates with If-None-Match on every load (no-cache) and
+    # gets an empty 304 back when nothing has changed
+    #
+    Response["headers"]["ETag"]                          = ETag
+    Response["headers"]["Cache-Control"]                 = "private, no-cache"
+    Response["headers"]["Access-Control-Expose-Headers"] = "ETag"
+    Response["headers"]["Vary"]                          = "Authorization"
+
+    if ETagMatches(event.get("headers") or {}, ETag):
+        Response["statusCode"] = 304
+        return(Response)
+
+    Response["body"] = Body
+    return(Response)
+
+def Count(Response):
+    if Response["statusCode"] == 304: Metrics.Count("NotModified")
+    return(Response)
+
+@Metrics.Handler("ListInstances")
 def lambda_handler(event, context):
     Response               = {}
     Response["statusCode"] = 200
@@ -59,64 +207,119 @@ def lambda_handler(event, context):
         Response["body"] = '{"Error":"No authorization header supplied."}'
         return(Response)
         
-    AuthInfo = ParseJWT(event["headers"]["Authorization"])
-    if "identities" not in AuthInfo:
-        logger.error("No identity information in JWT")
-        Response["body"] = '{"Error":"No identity information in authorization."}'
+    try:
+        with Metrics.Timer("Auth"):
+            User = Authorise(event["headers"]["Authorization"])
+    except AuthError as e:
+        Response["body"] = json.dumps({"Error":str(e)})
         return(Response)
-        
-    Username = AuthInfo["identities"][0]["userId"].split("\\")[1] # Username is expected to be "DOMAIN\\username"
-    ADGroups = AuthInfo["custom:ADGroups"]
+
+    Username = User.Username
+
+    #
+    # Admins can fetch the fleet summary the import keeps in the metadata
+    # table instead of counting the whole list - one read however big the
+    # fleet is. It is as of the last import.
+    #
+    if str((event.get("queryStringParameters") or {}).get("Summary", "")).lower() == "true":
+        if not User.IsAdmin:
+            logger.error("User not authorised to view the fleet summary: "+Username)
+            Response["body"] = '{"Error":"You are not authorised to view the fleet summary."}'
+            return(Response)
+
+        try:
+            with Metrics.Timer("Summary"):
+                Body = GetSummary(GetClient("dynamodb"))
+        except Exception as e:
+            logger.error("DynamoDB error: "+str(e))
+            Response["body"] = '{"Error":"DynamoDB query error."}'
+            return(Response)
+
+        if Body is None:
+            Response["body"] = '{"Error":"There is no fleet summary until the next import has run."}'
+            return(Response)
+        return(Count(Reply(Response, event, MakeETag(Body), Body)))
     
     ListAll = False
     try:
         if "queryStringParameters" in event:
             if "ListAll" in event["queryStringParameters"]:
-                if ADGroups.find("AdminGroupMember") >= 0:
+                if User.IsAdmin:
                     ListAll = True
     except:
         pass
+
+    #
+    # Callers can ask for the list a page at a time by passing Limit and then
+    # NextToken from the previous response. Without Limit everything is
+    # returned in one response.
+    #
+    Limit    = None
+    StartKey = None
+    try:
+        Parameters = event.get("queryStringParameters") or {}
+        if "Limit" in Parameters or "limit" in Parameters:
+            Limit = min(max(int(Parameters.get("Limit", Parameters.get("limit"))), 1), MaxPageSize)
+        if Parameters.get("NextToken"):
+            StartKey = DecodeToken(Parameters["NextToken"])
+            if Limit is None: Limit = MaxPageSize
+        View = Parameters.get("View")
+        if View is not None and View not in Views: raise ValueError("Unknown view "+View)
+    except Exception as e:
+        logger.error("Invalid paging parameters: "+str(e))
+        Response["body"] = '{"Error":"Invalid Limit, NextToken or View in request."}'
+        return(Response)
             
-    logger.info("Username: "+Username+" ADGroups: "+ADGroups+ " ListAll: "+str(ListAll))
+    logger.info("Username: "+Username+" Groups: "+",".join(sorted(User.Groups))+ " ListAll: "+str(ListAll)+" Limit: "+str(Limit))
 
-    Table = boto3.resource("dynamodb").Table(DDBTableName)
-    Expression = Attr("UserName").eq(Username)
-    
-    StartKey       = {}
-    WorkspacesList = []
-    while True: # Loop until no more items come from the DDB Scan
-        logger.info("DDB scan loop, StartKey="+str(StartKey))
+    #
+    # Everyone sees the same admin view so it is shared between admins. If the
+    # generation can't be read the cache is skipped rather than risk serving
+    # an out of date list.
+    #
+    CacheKey   = ("*" if ListAll else Username, ListAll, Limit, Parameters.get("NextToken"), View)
+    Generation = None
+    if ListCacheTTL > 0:
+        with Metrics.Timer("Generation"):
+            Generation = GetGeneration(GetClient("dynamodb"))
+    if Generation is not None:
+        Cached = ListCache.Get(CacheKey)
+        if Cached is not None and Cached[0] == Generation:
+            Metrics.Count("CacheHits")
+            return(Count(Reply(Response, event, Cached[1], Cached[2])))
+        Metrics.Count("CacheMisses")
+
+    Table = GetResource("dynamodb").Table(DDBTableName)
+
+    WorkspacesList = None
+    if not ListAll and UserNameIndex != "":
         try:
-            if len(StartKey) == 0:  
-                if ListAll:
-                    Result = Table.scan()
-                else:
-                    Result = Table.scan(FilterExpression=Expression)
-            else:
-                if ListAll:
-                    Result = Table.scan(ExclusiveStartKey=StartKey)
-                else:
-                    Result = Table.scan(FilterExpression=Expression, ExclusiveStartKey=StartKey)
+            with Metrics.Timer("Query"):
+                (WorkspacesList, LastKey) = QueryUserWorkspaces(Table, Username, Limit, StartKey, Views.get(View))
+        except ClientError as e:
+            # Most likely the index doesn't exist (yet) so fall back to a table scan
+            logger.warning("Could not query index "+UserNameIndex+", scanning instead: "+e.response["Error"]["Message"])
         except Exception as e:
             logger.error("DynamoDB error: "+str(e))
-            Response["body"] = '{"Error":"DynamoDB scan error."}'
+            Response["body"] = '{"Error":"DynamoDB query error."}'
             return(Response)
 
-        for Workspace in Result["Items"]:
-            logger.info("Processing "+Workspace["WorkspaceId"])
-            
-            # Need to convert Decimal() to actual numbers before returning JSON
-            if "LastConnected" in Workspace: Workspace["LastConnected"] = int(Workspace["LastConnected"])
-            if "LastTouched"   in Workspace: Workspace["LastTouched"]   = int(Workspace["LastTouched"])
-
-            WorkspacesList.append(Workspace)
-
-        if "LastEvaluatedKey" in Result:
-            StartKey = Result["LastEvaluatedKey"]
-        else:
-            break
+    if WorkspacesList is None:
+        try:
+            with Metrics.Timer("Scan"):
+                (WorkspacesList, LastKey) = ScanWorkspaces(Table, None if ListAll else Username, Limit, StartKey, Views.get(View))
+        except Exception as e:
+            logger.error("DynamoDB error: "+str(e))
+            Response["body"] = '{"Error":"DynamoDB scan error."}'
+            return(Response)
 
-    JSONObject = {"Workspaces":WorkspacesList}
-    Response["body"] = json.dumps(JSONObject)
+    with Metrics.Timer("Serialise"):
+        JSONObject = {"Workspaces":[Schema.ExpandPlain(Item) for Item in WorkspacesList]}
+        if LastKey is not None: JSONObject["NextToken"] = EncodeToken(LastKey)
+        Body = json.dumps(JSONObject, default=EncodeDecimal)
+        ETag = MakeETag(Body)
+    if Generation is not None: ListCache.Put(CacheKey, (Generation, ETag, Body))
+    Metrics.Count("Items", len(WorkspacesList))
+    Metrics.Count("ResponseBytes", len(Body))
 
-    return(Response)
\ No newline at end of file
+    return(Count(Reply(Response, event, ETag, Body)))
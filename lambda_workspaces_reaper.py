@@ -17,82 +17,219 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
-import boto3
+import time
+InitStart = time.perf_counter() # Taken first so the init report covers every import below
+
 import os
 import logging
+import json
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from workspaces_adcleanup import CleanupQueue, GetTarget
+from workspaces_clients import GetClient, Prewarm
+from workspaces_startup import InitTimer
+from workspaces_dynamodb import BatchWriter, ParallelScan
+from workspaces_metadata import BumpGeneration
+from workspaces_metrics import Metrics
+import workspaces_schema as Schema
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 DDBTableName = os.environ.get("DynamoDBTableName", "WorkspacesPortal")
+ScanSegments = int(os.environ.get("SCANSEGMENTS", "4"))
+BatchWriters = int(os.environ.get("BATCHWRITERS", "4"))
+RegionWorkers = int(os.environ.get("REGIONWORKERS", "8"))
+
+#
+# In "check" mode every row is checked with describe_workspaces, 25 at a
+# time. In "diff" mode each region is listed once and the IDs are diffed
+# against the table's, so only the rows missing from the listing are
+# checked. Either way stale rows go through the same cleanup: their AD
+# computer objects are removed through a rate limited queue (see
+# workspaces_adcleanup.py) and each row is deleted once that is done.
+#
+ReaperMode = os.environ.get("REAPERMODE", "check").lower()
+
+DescribeBatchSize = 25 # Maximum number of WorkspaceIds describe_workspaces accepts
+ReaperAttributes  = ["WorkspaceId", "Region", "ComputerName"]
+
+Init = InitTimer(__name__, InitStart)
+Init.Phase("Imports")
+Prewarm("dynamodb")
+Init.Phase("Prewarm")
+Init.Done()
 
 def Deserialise(DDBItem):
     for Key in DDBItem:
         return(DDBItem[Key])
 
-def lambda_handler(event, context):
+def FindWorkspaces(Client, WorkspaceIds):
     #
-    # First scan for Workspaces instances that don't exist any more
+    # Returns the subset of WorkspaceIds (no more than 25) that still exist
     #
-    DynamoDBClient = boto3.client("dynamodb")
+    Alive = set()
+    Args  = {"WorkspaceIds":WorkspaceIds}
+    while True:
+        Response = Client.describe_workspaces(**Args)
+        for Instance in Response["Workspaces"]:
+            Alive.add(Instance["WorkspaceId"])
 
-    StartKey       = {}
-    WorkspacesList = []
-    while True: # Loop until no more items from the DDB scan
-        logger.info("DDB scan loop, StartKey="+str(StartKey))
-        
-        try:
-            if len(StartKey) == 0:
-                Result = DynamoDBClient.scan(TableName=DDBTableName,
-                                             Select="SPECIFIC_ATTRIBUTES",
-                                             AttributesToGet=["WorkspaceId","Region","ComputerName","UserName"])
-            else:
-                Result = DynamoDBClient.scan(TableName=DDBTableName,
-                                             Select="SPECIFIC_ATTRIBUTES",
-                                             AttributesToGet=["WorkspaceId","Region","ComputerName","UserName"],
-                                             ExclusiveStartKey=StartKey)
-        except ClientError as e:
-            logger.error("DynamoDB error: "+e.response['Error']['Message'])
-            return
-
-        for Workspace in Result["Items"]:
-            WorkspacesList.append(Workspace)
-
-        if "LastEvaluatedKey" in Result:
-            StartKey = Result["LastEvaluatedKey"]
+        if Response.get("NextToken"):
+            Args["NextToken"] = Response["NextToken"]
         else:
             break
 
-    for Item in WorkspacesList:
-        WorkspaceId = Deserialise(Item["WorkspaceId"])
-        Region      = Deserialise(Item["Region"])
+    return(Alive)
 
-        logger.info("Looking for "+WorkspaceId+" in "+Region)
-        WorkspacesClient = boto3.client("workspaces", region_name=Region)
-        InstanceInfo = WorkspacesClient.describe_workspaces(WorkspaceIds=[WorkspaceId])
-        if len(InstanceInfo["Workspaces"]) > 0:
-            logger.info("  Instance alive - continuing")
+def ListLiveIds(Client, Region):
+    #
+    # Every WorkspaceId in Region, from one paginated listing
+    #
+    Live  = set()
+    Pages = iter(Client.get_paginator("describe_workspaces").paginate(PaginationConfig={"PageSize": DescribeBatchSize}))
+    while True:
+        with Metrics.Timer("Listing", Region):
+            Page = next(Pages, None)
+        if Page is None: return(Live)
+        Live.update(Instance["WorkspaceId"] for Instance in Page["Workspaces"])
+
+def ConfirmStale(Client, Region, Rows, WorkspaceIds, Counts, Phase):
+    #
+    # Checks WorkspaceIds 25 at a time and returns the rows of the ones that
+    # no longer exist. Instances that can't be checked are left alone -
+    # better to leave rows in place than remove instances that may still
+    # exist.
+    #
+    Stale = []
+    for Index in range(0, len(WorkspaceIds), DescribeBatchSize):
+        Batch = WorkspaceIds[Index:Index+DescribeBatchSize]
+        try:
+            with Metrics.Timer(Phase, Region):
+                Alive = FindWorkspaces(Client, Batch)
+        except Exception as e:
+            logger.error("Could not check instances in "+Region+" - "+str(e))
+            Counts["Unknown"] += len(Batch)
             continue
 
+        Counts["Alive"] += len(Alive)
+        Stale.extend(Rows[WorkspaceId] for WorkspaceId in Batch if WorkspaceId not in Alive)
+    return(Stale)
+
+def CheckRegion(Region, Items):
+    #
+    # Returns the rows for Region whose instances no longer exist, and counts
+    # of what was found
+    #
+    Client = GetClient("workspaces", Region)
+    Rows   = {Deserialise(Item["WorkspaceId"]):Item for Item in Items}
+    Counts = {"Checked":len(Rows), "Alive":0, "Stale":0, "Unknown":0}
+
+    if ReaperMode == "diff":
+        try:
+            Live = ListLiveIds(Client, Region)
+        except Exception as e:
+            logger.error("Could not list instances in "+Region+" - "+str(e))
+            Counts["Unknown"] = len(Rows)
+            return(([], Counts))
+
         #
-        # This instance doesn't exist any more so let's remove it from the table and from AD
+        # A listing can miss an instance that changes while it is paged
+        # through, so anything missing from it is confirmed gone before it
+        # is reaped
         #
-        if "ComputerName" in Item:
-            ComputerName = Deserialise(Item["ComputerName"])
-            logger.info("  Removing "+ComputerName+" from AD")
-
-            #
-            # Here we should connect to AD and remove the Computer object
-            # so that stale Workspaces instances aren't left lying around
-            # in the target AD.
-            #
+        Missing = sorted(Rows.keys()-Live)
+        Counts["Alive"]     = len(Rows)-len(Missing)
+        Counts["Untracked"] = len(Live-Rows.keys()) # Left for the import
+        Stale = ConfirmStale(Client, Region, Rows, Missing, Counts, "Confirm")
+    else:
+        Stale = ConfirmStale(Client, Region, Rows, list(Rows.keys()), Counts, "Check")
+
+    Counts["Stale"] = len(Stale)
+    return((Stale, Counts))
+
+@Metrics.Handler("Reaper")
+def lambda_handler(event, context):
+    #
+    # First scan for Workspaces instances that don't exist any more
+    #
+    DynamoDBClient = GetClient("dynamodb")
+
+    # Only what the reaper uses is returned, in either schema
+    (Projection, Names) = Schema.Projection(ReaperAttributes)
+
+    WorkspacesList = []
+    try:
+        with Metrics.Timer("Scan"):
+            for Workspace in ParallelScan(DynamoDBClient.scan, ScanSegments,
+                                          TableName=DDBTableName,
+                                          ProjectionExpression=Projection,
+                                          ExpressionAttributeNames=Names):
+                WorkspacesList.append(Schema.Expand(Workspace))
+    except ClientError as e:
+        logger.error("DynamoDB error: "+e.response['Error']['Message'])
+        return
+
+    logger.info("Found "+str(len(WorkspacesList))+" instances in the table")
+
+    #
+    # Group the rows by region and check the regions in parallel, each with
+    # its own client
+    #
+    ByRegion = {}
+    for Item in WorkspacesList:
+        ByRegion.setdefault(Deserialise(Item["Region"]), []).append(Item)
+
+    Regions = sorted(ByRegion)
+    for Region in Regions: logger.info("Checking "+str(len(ByRegion[Region]))+" instances in "+Region+" ("+ReaperMode+" mode)")
+
+    Summary = {"Mode":ReaperMode, "Checked":0, "Alive":0, "Stale":0, "Unknown":0}
+    Stale   = []
+    with ThreadPoolExecutor(max_workers=max(1, min(RegionWorkers, len(Regions)))) as Executor:
+        for (Region, (RegionStale, Counts)) in zip(Regions, Executor.map(lambda Region: CheckRegion(Region, ByRegion[Region]), Regions)):
+            Stale.extend(RegionStale)
+            for Counter in Counts:
+                Summary[Counter] = Summary.get(Counter, 0)+Counts[Counter]
+                Metrics.Count(Counter, Counts[Counter], Region)
+
+    #
+    # Clean up the stale rows. Rows with a computer name go onto the AD
+    # cleanup queue and are deleted once their computer object has been
+    # removed (or wasn't there). Rows whose removal failed or didn't get a
+    # turn before the function runs out of time are kept for the next run.
+    #
+    Writer = BatchWriter(DynamoDBClient, DDBTableName, Writers=BatchWriters)
+
+    def Cleaned(Item, Outcome):
+        if Outcome in ["Removed", "NotFound"]: Writer.Delete({"WorkspaceId":Item["WorkspaceId"]})
+
+    Target = GetTarget() if any("ComputerName" in Item for Item in Stale) else None
+    Queue  = CleanupQueue(Target, Cleaned) if Target is not None else None
+    for Item in Stale:
+        WorkspaceId = Deserialise(Item["WorkspaceId"])
+        Region      = Deserialise(Item["Region"])
+        if "ComputerName" not in Item:
+            Metrics.SampledInfo("stale instance", "  "+WorkspaceId+" in "+Region+" no longer exists - no computer name found so cannot remove from AD")
+        elif Queue is None:
+            Metrics.SampledInfo("stale instance", "  "+WorkspaceId+" in "+Region+" no longer exists - AD cleanup is not set up so leaving "+Deserialise(Item["ComputerName"])+" in AD")
         else:
-            logger.info("  No computer name found - cannot remove from AD")
+            Metrics.SampledInfo("stale instance", "  "+WorkspaceId+" in "+Region+" no longer exists - removing "+Deserialise(Item["ComputerName"])+" from AD")
+            Queue.Add(Item, Deserialise(Item["ComputerName"]))
+            continue
 
-        try:
-            Response = DynamoDBClient.delete_item(TableName=DDBTableName, Key={"WorkspaceId":Item["WorkspaceId"]})
-            logger.info("  Instance removed")
-        except ClientError as e:
-            logger.error("DynamoDB error: "+e.response['Error']['Message'])
-            return
\ No newline at end of file
+        Writer.Delete({"WorkspaceId":Item["WorkspaceId"]})
+
+    if Queue is not None:
+        Deadline = None # Stop in time to finish the deletes
+        if context is not None: Deadline = time.monotonic()+context.get_remaining_time_in_millis()/1000-30
+        with Metrics.Timer("ADCleanup"):
+            Summary["AD"] = Queue.Close(Deadline)
+        for Counter in Summary["AD"]: Metrics.Count("AD"+Counter, Summary["AD"][Counter])
+
+    with Metrics.Timer("Deletes"):
+        Summary["Deletes"] = Writer.Close()
+    for Counter in Summary["Deletes"]: Metrics.Count("Deletes"+Counter, Summary["Deletes"][Counter])
+    if Summary["Deletes"]["Written"] > 0: BumpGeneration(DynamoDBClient)
+    logger.info("Reaper summary: "+json.dumps(Summary))
+
+    return(Summary)
\ No newline at end of file
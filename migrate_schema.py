@@ -0,0 +1,138 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Converts the items in the Workspaces table to the compact schema (see
+# workspaces_schema.py), or back to the long form with --expand. Run it
+# after COMPACTSCHEMA has been set on the functions so that nothing writes
+# the old form again. It is safe to run while the portal is in use: each
+# item is rewritten with a conditional put that fails if the item has
+# changed since it was read, and those items are left for the next run.
+# Items already in the wanted form are skipped so it can be run repeatedly.
+#
+# Usage: python migrate_schema.py [--table name] [--expand] [--dry-run]
+#                                 [--segments n] [--workers n]
+#
+
+import argparse
+import json
+import logging
+import os
+import threading
+from botocore.exceptions import ClientError
+from workspaces_clients import GetClient
+from workspaces_dynamodb import BoundedExecutor, ParallelScan
+from workspaces_metadata import BumpGeneration
+import workspaces_schema as Schema
+
+logger = logging.getLogger()
+
+#
+# Every writer changes at least one of these (events and the import move
+# Version on, actions change InstanceState and logins LastConnected) so an
+# item whose values still match hasn't changed since it was read
+#
+GuardAttributes = ["Version", "InstanceState", "LastConnected"]
+
+def Convert(Item, Expand):
+    if Expand: return(Schema.Expand(Item))
+    return(Schema.Compact(Item))
+
+def Unchanged(Item):
+    # Condition that the stored item still has the values it was read with
+    Names  = {"#k":"WorkspaceId"}
+    Values = {}
+    Parts  = ["attribute_exists(#k)"]
+    for (Index, Stored) in enumerate(Schema.Names(GuardAttributes)):
+        Names["#g"+str(Index)] = Stored
+        if Stored in Item:
+            Values[":g"+str(Index)] = Item[Stored]
+            Parts.append("#g"+str(Index)+" = :g"+str(Index))
+        else:
+            Parts.append("attribute_not_exists(#g"+str(Index)+")")
+    return(" AND ".join(Parts), Names, Values)
+
+def Migrate(Client, TableName, Expand=False, DryRun=False, Segments=4, Workers=8):
+    Summary = {"Scanned":0, "Converted":0, "Skipped":0, "Changed":0, "Failed":0,
+               "BytesBefore":0, "BytesAfter":0}
+    Lock    = threading.Lock()
+    Errors  = []
+
+    def Count(**Counts):
+        with Lock:
+            for (Counter, Value) in Counts.items(): Summary[Counter] += Value
+
+    def Rewrite(Item):
+        Converted = Convert(Item, Expand)
+        Count(Scanned=1, BytesBefore=Schema.ItemSize(Item), BytesAfter=Schema.ItemSize(Converted))
+        if Converted == Item:
+            Count(Skipped=1)
+            return
+        if DryRun:
+            Count(Converted=1)
+            return
+
+        (Condition, Names, Values) = Unchanged(Item)
+        Args = {"ExpressionAttributeValues":Values} if len(Values) > 0 else {}
+        try:
+            Client.put_item(TableName=TableName, Item=Converted, ConditionExpression=Condition,
+                            ExpressionAttributeNames=Names, **Args)
+            Count(Converted=1)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                Count(Changed=1)
+            else:
+                logger.error("Could not convert "+Item["WorkspaceId"]["S"]+": "+e.response["Error"]["Message"])
+                Count(Failed=1)
+
+    def Check(Future):
+        if Future.exception() is not None:
+            with Lock:
+                Errors.append(Future.exception())
+
+    #
+    # Items are handed to the writers only as fast as they can rewrite them,
+    # so the scan is held back rather than read into memory ahead of them.
+    # Anything Rewrite didn't catch stops the scan and is raised once the
+    # rewrites already started have finished.
+    #
+    with BoundedExecutor(Workers) as Rewriter:
+        for Item in ParallelScan(Client.scan, Segments, TableName=TableName):
+            if len(Errors) > 0: break
+            Rewriter.Submit(Rewrite, Item, Done=Check)
+    if len(Errors) > 0: raise Errors[0]
+
+    if Summary["Converted"] > 0 and not DryRun: BumpGeneration(Client)
+    return(Summary)
+
+def main():
+    Parser = argparse.ArgumentParser(description="Convert the Workspaces portal table between the long and compact schemas")
+    Parser.add_argument("--table", default=os.environ.get("DynamoDBTableName", "WorkspacesPortal"))
+    Parser.add_argument("--expand", action="store_true", help="convert back to the long form")
+    Parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    Parser.add_argument("--segments", type=int, default=4)
+    Parser.add_argument("--workers", type=int, default=8)
+    Args = Parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    Summary = Migrate(GetClient("dynamodb"), Args.table, Args.expand, Args.dry_run, Args.segments, Args.workers)
+    print(json.dumps(Summary, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Checks on the actions state machine (workspaces_states.py).
+#
+# Usage: python -m unittest discover tests
+#
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import workspaces_states as StateMachine
+
+class CheckTests(unittest.TestCase):
+    def test_any_mode_actions_allow_unrecognised_mode(self):
+        # Reboot, Rebuild and Decommission don't depend on the running mode
+        for Action in ["Reboot", "Rebuild", "Decommission"]:
+            self.assertIsNone(StateMachine.Check(Action, "AVAILABLE", "ALWAYS_ON_SOMEDAY"))
+            self.assertIsNone(StateMachine.Check(Action, "AVAILABLE", None))
+
+    def test_start_stop_reject_unrecognised_mode(self):
+        Problem = StateMachine.Check("Stop", "AVAILABLE", "ALWAYS_ON_SOMEDAY")
+        self.assertEqual(Problem[1], StateMachine.ModeWarning)
+        Problem = StateMachine.Check("Start", "STOPPED", "ALWAYS_ON")
+        self.assertEqual(Problem[1], StateMachine.ModeWarning)
+
+    def test_state_is_checked_before_mode(self):
+        Problem = StateMachine.Check("Reboot", "STOPPED", "ALWAYS_ON_SOMEDAY")
+        self.assertEqual(Problem[1], StateMachine.Actions["Reboot"]["Warning"])
+        Problem = StateMachine.Check("Stop", "STOPPED", "ALWAYS_ON")
+        self.assertEqual(Problem[1], StateMachine.Actions["Stop"]["Warning"])
+
+    def test_allowed_transitions(self):
+        self.assertIsNone(StateMachine.Check("Stop", "AVAILABLE", "AUTO_STOP"))
+        self.assertIsNone(StateMachine.Check("Start", "STOPPED", "MANUAL"))
+
+if __name__ == "__main__":
+    unittest.main()
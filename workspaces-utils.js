@@ -24,6 +24,11 @@ CognitoClientId   = "xxxxxxxxxxxxxxxxxxxxxxxxxx";
 APIGatewayId      = "xxxxxxxxxx";
 RegionName        = "ap-southeast-2";
 S3BucketName      = "xxxxxxxxxxxx";
+PageSize          = 500; // Number of Workspaces instances fetched per request
+WatchInterval     = 2000; // Milliseconds between checks on an action's progress while states are changing
+WatchMaxInterval  = 10000; // and the most it backs off to while they aren't
+Transitions       = undefined; // The actions function's state machine, fetched once by GetTransitions
+ListRefresh       = {}; // Number of the latest refresh of each list - pages from earlier ones are dropped
 
 USER_API_URL  = "https://"+APIGatewayId+".execute-api."+RegionName+".amazonaws.com/Prod/user/"
 ADMIN_API_URL = "https://"+APIGatewayId+".execute-api."+RegionName+".amazonaws.com/Prod/admin/"
@@ -72,12 +77,14 @@ function login() {
 
  // Otherwise we're authenticated and we can do stuff
  decoded = parseJWT(accessToken);
- if (decoded["custom:ADGroups"].includes("UserGroupMember")) {
-  GetWorkspacesDetails(false);
- }
- if (decoded["custom:ADGroups"].includes("AdminGroupMember")) {
-  GetWorkspacesDetails(true);
- }
+ GetTransitions(function() {
+  if (decoded["custom:ADGroups"].includes("UserGroupMember")) {
+   GetWorkspacesDetails(false);
+  }
+  if (decoded["custom:ADGroups"].includes("AdminGroupMember")) {
+   GetWorkspacesDetails(true);
+  }
+ });
 
  UserLen  = document.getElementById("userworkspaces").innerHTML.length
  AdminLen = document.getElementById("adminworkspaces").innerHTML.length
@@ -86,19 +93,109 @@ function login() {
  }
 }
 
-function GetWorkspacesDetails(GetAllWorkspaces) {
+function GetTransitions(Then) {
+ //
+ // Fetches the state machine behind the actions so each row only offers the
+ // actions its instance can take. If it can't be fetched every action is
+ // offered and the actions function turns away the ones that don't apply.
+ //
+ var accessToken = localStorage.getItem('WorkspacesAccessToken');
+ var API_Client  = new XMLHttpRequest();
+ API_Client.onreadystatechange = function() {
+  if (API_Client.readyState == XMLHttpRequest.DONE) {
+   try {
+    var JSONResult = JSON.parse(API_Client.responseText);
+    if (JSONResult.Actions != undefined && JSONResult.ByState != undefined) {
+     Transitions = JSONResult;
+    }
+    else {
+     console.log(API_Client.responseText);
+    }
+   }
+   catch(error) {
+    console.log(error);
+   }
+   Then();
+  }
+ }
+ API_Client.open("get", ADMIN_API_URL+"?Transitions=True");
+ API_Client.setRequestHeader("Content-Type", "application/json");
+ API_Client.setRequestHeader("Authorization", accessToken);
+ API_Client.timeout = 10000;
+ API_Client.ontimeout = ProcessTimeout;
+ API_Client.send();
+}
+
+function AllowedActions(Instance, AdminList) {
+ //
+ // The actions to offer for Instance, in the order the state machine lists
+ // them. Admin only actions are only offered in the admin list.
+ //
+ var Allowed = [];
+ if (Transitions == undefined) {
+  Allowed = ["Start", "Stop", "Reboot", "Rebuild", "Decommission"];
+  return(AdminList ? Allowed : Allowed.slice(0, 4));
+ }
+
+ var Candidates = Transitions.ByState[Instance.InstanceState] || [];
+ for(var i = 0; i < Candidates.length; i++) {
+  var Rule = Transitions.Actions[Candidates[i]];
+  if (Rule.AdminOnly && !AdminList) { continue }
+  if (Rule.RunningModes != null && !Rule.RunningModes.includes(Instance.RunningMode)) { continue }
+  Allowed.push(Candidates[i]);
+ }
+ return(Allowed);
+}
+
+function GetWorkspacesDetails(GetAllWorkspaces, NextToken, Refresh) {
+ //
+ // The list is fetched a page at a time. The first page replaces whatever is
+ // on screen and each page after that is appended to the table as it arrives.
+ // Each refresh (a call without NextToken) is numbered, and once a newer one
+ // has started the pages of older ones are dropped and no more are fetched,
+ // so a refresh still paging can't add rows to the table of the next one.
+ //
+ var ListId = GetAllWorkspaces ? "adminworkspaces" : "userworkspaces";
+ if (NextToken == undefined) {
+  Refresh = (ListRefresh[ListId] || 0)+1;
+  ListRefresh[ListId] = Refresh;
+ }
+
  var accessToken = localStorage.getItem('WorkspacesAccessToken');
- var API_URL = USER_API_URL;
- if (GetAllWorkspaces) { API_URL += "?ListAll=True" }
+ var API_URL = USER_API_URL+"?Limit="+PageSize;
+ if (GetAllWorkspaces) { API_URL += "&ListAll=True&View=admin" } else { API_URL += "&View=user" }
+ if (NextToken != undefined) { API_URL += "&NextToken="+encodeURIComponent(NextToken) }
 
  var API_Client = new XMLHttpRequest();
  API_Client.onreadystatechange = function() {
   if (API_Client.readyState == XMLHttpRequest.DONE) {
-   Result = API_Client.responseText;
-   HTML = RenderWorkspacesTiles(Result, GetAllWorkspaces);
-   document.getElementById(GetAllWorkspaces ? "adminworkspaces" : "userworkspaces").innerHTML = HTML;
-   if (HTML.length > 0)  {
-    document.getElementById("noworkspaces").style.visibility = "hidden";
+   if (Refresh != ListRefresh[ListId]) { return }
+
+   var Result   = API_Client.responseText;
+   var RowsBody = document.getElementById(ListId+"rows");
+   var JSONResult;
+   try {
+    JSONResult = JSON.parse(Result);
+   }
+   catch(error) {
+    JSONResult = undefined;
+   }
+
+   if (NextToken != undefined && RowsBody != null && JSONResult != undefined && JSONResult.Workspaces != undefined) {
+    RowsBody.insertAdjacentHTML("beforeend", RenderWorkspacesRows(JSONResult.Workspaces, GetAllWorkspaces));
+   }
+   else {
+    var HTML = RenderWorkspacesTiles(Result, GetAllWorkspaces);
+    if (NextToken == undefined || HTML.length > 0) {
+     document.getElementById(ListId).innerHTML = HTML;
+    }
+    if (HTML.length > 0)  {
+     document.getElementById("noworkspaces").style.visibility = "hidden";
+    }
+   }
+
+   if (JSONResult != undefined && JSONResult.NextToken != undefined) {
+    GetWorkspacesDetails(GetAllWorkspaces, JSONResult.NextToken, Refresh);
    }
   }
  }
@@ -125,75 +222,31 @@ function RenderWorkspacesTiles(ListString, AdminList) {
  }
 
  if (JSONResult.Workspaces != undefined) {
-  var WorkspacesCount = 0;
-
-  for(i = 0; i < JSONResult.Workspaces.length; i++) {
-   var Div = "<tr>"
-   var Instance = JSONResult.Workspaces[i];
+  var WorkspacesCount = JSONResult.Workspaces.length;
+  HTML = RenderWorkspacesRows(JSONResult.Workspaces, AdminList);
 
+  if (WorkspacesCount > 0) {
+   HTML = "<tbody id='"+(AdminList ? "adminworkspaces" : "userworkspaces")+"rows'>"+HTML+"</tbody>";
    if (AdminList) {
-    Div += "<td>"+Instance.UserName+"</td>";
+    HTML = "<thead><tr><th></th><th>Username</th><th>WorkSpace ID</th><th>Region</th><th>State</th><th>Running Mode</th><th>IP Address</th><th>Connected</th><th>Reg Code</th></tr></thead>"+HTML;
    }
-
-   Div += "<td>"+Instance.WorkspaceId+" "+((Instance.ComputerName != undefined) ? "("+Instance.ComputerName+")" : "")+"</td>";
-
-   Div += "<td>"+Instance.Region+"</td>";
-   Div += "<td class='state-"+Instance.InstanceState.toLowerCase()+"'>"+Instance.InstanceState+"</td>";
-
-   if (AdminList) {
-    Div += "<td>"+Instance.RunningMode+"</td>";
+   else {
+    HTML = "<thead><tr><th>WorkSpace ID</th><th>Region</th><th>State</th><th>IP Address</th><th>Reg Code</th></tr></thead>"+HTML;
    }
-
-   Div += "<td>"+((Instance.IPAddress != undefined) ? Instance.IPAddress : "Unknown")+"</td>";
-
+   HTML = "<table class='workspacesinfo'>"+HTML;
    if (AdminList) {
-    var Connected = "";
-    if( Instance.LastConnected != undefined) {
-     Connected = new Date(0);
-     Connected.setUTCSeconds(Instance.LastConnected);
+    var BulkActions = ["Start", "Stop", "Reboot"];
+    if (Transitions != undefined) {
+     BulkActions = Object.keys(Transitions.Actions).filter(function(Action) {
+      return(Transitions.Actions[Action].Bulk && !Transitions.Actions[Action].AdminOnly);
+     });
     }
-    else {
-     Connected = "<span class='italic'>Never</span>"
+    var Links = [];
+    for(var i = 0; i < BulkActions.length; i++) {
+     Links.push("<a href='javascript:WorkspacesBulkAction(\""+BulkActions[i]+"\")' class='"+BulkActions[i].toLowerCase()+"'>"+BulkActions[i]+"</a>");
     }
-    Div += "<td>"+Connected+"</td>";
+    HTML = "<div class='bulkactions'>Selected:&nbsp;&nbsp;"+Links.join("&nbsp;&nbsp;")+"</div>"+HTML;
    }
-
-   Div += "<td>"+Instance.RegCode+"</td>";
-
-   Div += "<td class='actions'>"
-
-   if (Instance.RunningMode == "AUTO_STOP") {
-    if (Instance.InstanceState == "STOPPED") {
-     Div += "<a href='javascript:WorkspacesAction(\"Start\",\""+Instance.WorkspaceId+"\")' class='start'>Start</a>&nbsp;&nbsp;";
-    }
-    if (Instance.InstanceState == "AVAILABLE") {
-     Div += "<a href='javascript:WorkspacesAction(\"Stop\",\""+Instance.WorkspaceId+"\")' class='stop'>Stop</a>&nbsp;&nbsp;";
-    }
-   }
-
-   if (Instance.InstanceState != "STOPPED" && Instance.InstanceState != "REBOOTING") {
-    Div += "<a href='javascript:WorkspacesAction(\"Reboot\",\""+Instance.WorkspaceId+"\")' class='reboot'>Reboot</a>&nbsp;&nbsp;";
-   }
-
-   Div += "<a href='javascript:WorkspacesAction(\"Rebuild\",\""+Instance.WorkspaceId+"\")' class='rebuild'>Rebuild</a>";
-   if (AdminList) {
-    Div += "&nbsp;&nbsp;<a href='javascript:WorkspacesAction(\"Decommission\",\""+Instance.WorkspaceId+"\")' class='decommission'>Decommission</a>";
-   }
-   Div += "</td>";
-
-   Div += "</tr>";
-   HTML += Div;
-   WorkspacesCount++;
-  }
-
-  if (WorkspacesCount > 0) {
-   if (AdminList) {
-    HTML = "<tr><th>Username</th><th>WorkSpace ID</th><th>Region</th><th>State</th><th>Running Mode</th><th>IP Address</th><th>Connected</th><th>Reg Code</th></tr>"+HTML;
-   }
-   else {
-    HTML = "<tr><th>WorkSpace ID</th><th>Region</th><th>State</th><th>IP Address</th><th>Reg Code</th></tr>"+HTML;
-   }
-   HTML = "<table class='workspacesinfo'>"+HTML;
    HTML = "<h1>"+(AdminList ? "All" : "Your")+" Workspaces</h1>"+HTML;
    HTML += "</table>";
   }
@@ -218,6 +271,101 @@ function RenderWorkspacesTiles(ListString, AdminList) {
  return(HTML);
 }
 
+function RenderWorkspacesRows(Workspaces, AdminList) {
+ var HTML = "";
+
+ for(var i = 0; i < Workspaces.length; i++) {
+  var Div = "<tr>"
+  var Instance = Workspaces[i];
+
+  if (AdminList) {
+   Div += "<td><input type='checkbox' class='bulkselect' value='"+Instance.WorkspaceId+"'></td>";
+   Div += "<td>"+Instance.UserName+"</td>";
+  }
+
+  Div += "<td>"+Instance.WorkspaceId+" "+((Instance.ComputerName != undefined) ? "("+Instance.ComputerName+")" : "")+"</td>";
+
+  Div += "<td>"+Instance.Region+"</td>";
+  Div += "<td class='state-"+Instance.InstanceState.toLowerCase()+"'>"+Instance.InstanceState+"</td>";
+
+  if (AdminList) {
+   Div += "<td>"+Instance.RunningMode+"</td>";
+  }
+
+  Div += "<td>"+((Instance.IPAddress != undefined) ? Instance.IPAddress : "Unknown")+"</td>";
+
+  if (AdminList) {
+   var Connected = "";
+   if( Instance.LastConnected != undefined) {
+    Connected = new Date(0);
+    Connected.setUTCSeconds(Instance.LastConnected);
+   }
+   else {
+    Connected = "<span class='italic'>Never</span>"
+   }
+   Div += "<td>"+Connected+"</td>";
+  }
+
+  Div += "<td>"+Instance.RegCode+"</td>";
+
+  var Actions = AllowedActions(Instance, AdminList);
+  var Links   = [];
+  for(var j = 0; j < Actions.length; j++) {
+   Links.push("<a href='javascript:WorkspacesAction(\""+Actions[j]+"\",\""+Instance.WorkspaceId+"\")' class='"+Actions[j].toLowerCase()+"'>"+Actions[j]+"</a>");
+  }
+  Div += "<td class='actions'>"+Links.join("&nbsp;&nbsp;")+"</td>";
+
+  Div += "</tr>";
+  HTML += Div;
+ }
+
+ return(HTML);
+}
+
+function WatchJob(JobId, Delay, Shown) {
+ //
+ // Actions are sent with Async=True so the actions function keeps watching
+ // the instances and records their real states. This polls the job and
+ // reloads the lists whenever a state changes, until the watcher finishes.
+ //
+ setTimeout(function() {
+  var accessToken = localStorage.getItem('WorkspacesAccessToken');
+  var API_Client  = new XMLHttpRequest();
+  API_Client.onreadystatechange = function() {
+   if (API_Client.readyState == XMLHttpRequest.DONE) {
+    var JSONResult;
+    try {
+     JSONResult = JSON.parse(API_Client.responseText);
+    }
+    catch(error) {
+     console.log(error);
+     console.log(API_Client.responseText);
+     return;
+    }
+    if (JSONResult.States == undefined) {
+     console.log(API_Client.responseText);
+     return;
+    }
+
+    var States = JSON.stringify(JSONResult.States);
+    if (States != Shown) {
+     GetWorkspacesDetails(false);
+     GetWorkspacesDetails(true);
+    }
+    if (JSONResult.Status == "Running") {
+     WatchJob(JobId, (States != Shown) ? WatchInterval : Math.min(Delay*2, WatchMaxInterval), States);
+    }
+   }
+  }
+  API_Client.open("get", ADMIN_API_URL+"?JobId="+encodeURIComponent(JobId));
+  API_Client.setRequestHeader("Content-Type", "application/json");
+  API_Client.setRequestHeader("Authorization", accessToken);
+  API_Client.timeout = 10000;
+  API_Client.ontimeout = ProcessTimeout;
+  API_Client.send();
+ }, Delay);
+}
+
 function ProcessTimeout() {
  console.log("Query to API Gateway timed out");
 }
@@ -226,7 +374,7 @@ function WorkspacesAction(Action, InstanceId) {
  var accessToken = localStorage.getItem('WorkspacesAccessToken');
  var API_URL = ADMIN_API_URL;
 
- API_URL += "?Action="+Action+"&InstanceId="+InstanceId;
+ API_URL += "?Action="+Action+"&InstanceId="+InstanceId+"&Async=True";
 
  var API_Client = new XMLHttpRequest();
  API_Client.onreadystatechange = function() {
@@ -240,6 +388,9 @@ function WorkspacesAction(Action, InstanceId) {
     if (JSONResult.Success != undefined) {
      HTML = "<div class='success'>"+JSONResult.Success+"</div>";
     }
+    if (JSONResult.JobId != undefined) {
+     WatchJob(JSONResult.JobId, WatchInterval);
+    }
     if (JSONResult.Warning != undefined) {
      HTML = "<div class='warning'>"+JSONResult.Warning+"</div>";
     }
@@ -268,4 +419,75 @@ function WorkspacesAction(Action, InstanceId) {
  API_Client.timeout = 10000;
  API_Client.ontimeout = ProcessTimeout;
  API_Client.send();
-}
\ No newline at end of file
+}
+function WorkspacesBulkAction(Action) {
+ //
+ // Sends every ticked instance to the actions function in a single request.
+ // Each instance gets its own result so some can succeed while others fail.
+ //
+ var accessToken = localStorage.getItem('WorkspacesAccessToken');
+ var Selected    = document.querySelectorAll("input.bulkselect:checked");
+ var InstanceIds = [];
+
+ for(var i = 0; i < Selected.length; i++) {
+  InstanceIds.push(Selected[i].value);
+ }
+ if (InstanceIds.length == 0) {
+  document.getElementById("response").innerHTML = "<div class='warning'>No Workspaces selected.</div>";
+  return;
+ }
+
+ var API_Client = new XMLHttpRequest();
+ API_Client.onreadystatechange = function() {
+  if (API_Client.readyState == XMLHttpRequest.DONE) {
+   var HTML = "";
+
+   Result = API_Client.responseText;
+   try {
+    JSONResult = JSON.parse(Result);
+
+    if (JSONResult.Summary != undefined) {
+     var Summary = JSONResult.Summary;
+     HTML = "<div class='"+(Summary.Failed > 0 ? "error" : (Summary.Warnings > 0 ? "warning" : "success"))+"'>"+
+            Action+": "+Summary.Succeeded+" in progress, "+Summary.Warnings+" skipped, "+Summary.Failed+" failed.</div>";
+
+     if (JSONResult.JobId != undefined) {
+      WatchJob(JSONResult.JobId, WatchInterval);
+     }
+
+     for(var i = 0; i < JSONResult.Results.length; i++) {
+      var Item = JSONResult.Results[i];
+      if (Item.Warning != undefined) {
+       HTML += "<div class='warning'>"+Item.InstanceId+": "+Item.Warning+"</div>";
+      }
+      if (Item.Error != undefined) {
+       HTML += "<div class='error'>"+Item.InstanceId+": "+Item.Error+"</div>";
+      }
+     }
+    }
+    if (JSONResult.Error != undefined) {
+     HTML = "<div class='error'>"+JSONResult.Error+"</div>";
+    }
+   }
+   catch(error) {
+    console.log(error);
+    console.log(Result);
+
+    HTML += "<div class='error'>Sorry - could not parse JSON response.</div>";
+   }
+
+   document.getElementById("response").innerHTML = HTML;
+
+   document.getElementById("userworkspaces").innerHTML = "";
+   document.getElementById("adminworkspaces").innerHTML = "";
+   GetWorkspacesDetails(false);
+   GetWorkspacesDetails(true);
+  }
+ }
+ API_Client.open("post", ADMIN_API_URL);
+ API_Client.setRequestHeader("Content-Type", "application/json");
+ API_Client.setRequestHeader("Authorization", accessToken);
+ API_Client.timeout = 30000;
+ API_Client.ontimeout = ProcessTimeout;
+ API_Client.send(JSON.stringify({"Action":Action, "InstanceIds":InstanceIds, "Async":true}));
+}
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#
+# Removes the AD computer objects of Workspaces instances that no longer
+# exist. This file needs to be packaged into the zip file of each function
+# that imports it, along with the ldap3 package.
+#
+# Removals go onto a CleanupQueue that spreads them over ADSHARDS worker
+# threads (each with its own LDAP connection, as connections can't be shared
+# between threads) and holds them all to ADRATE removals per second so a
+# mass decommission doesn't flood the domain controllers. Nothing is removed
+# unless ADSERVER is set.
+#
+# ADSERVER is an LDAP URL (for example ldaps://dc1.example.com), ADBASEDN
+# the container searched for computer objects and ADSECRET the name of a
+# Secrets Manager secret holding {"Username":"...","Password":"..."} for an
+# account that can delete them.
+#
+
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import zlib
+from workspaces_clients import GetClient
+from workspaces_metrics import Metrics
+
+try:
+    import ldap3
+    from ldap3.utils.conv import escape_filter_chars
+except ImportError:
+    ldap3 = None
+
+logger = logging.getLogger()
+
+ADServer = os.environ.get("ADSERVER", "")
+ADBaseDN = os.environ.get("ADBASEDN", "")
+ADSecret = os.environ.get("ADSECRET", "")
+ADRate   = float(os.environ.get("ADRATE", "10"))
+ADShards = int(os.environ.get("ADSHARDS", "4"))
+
+TreeDelete = "1.2.840.113556.1.4.805" # Lets a computer object be deleted along with anything under it (BitLocker keys, say)
+
+class LDAPConnection:
+    def __init__(self, Connection, BaseDN):
+        self.Connection = Connection
+        self.BaseDN     = BaseDN
+
+    def Remove(self, ComputerName):
+        # Returns True if the computer object was deleted and False if there wasn't one
+        self.Connection.search(self.BaseDN,
+                               "(&(objectClass=computer)(sAMAccountName="+escape_filter_chars(ComputerName)+"$))",
+                               attributes=[])
+        Entries = [Entry for Entry in self.Connection.response if Entry.get("type") == "searchResEntry"]
+        if len(Entries) == 0: return(False)
+
+        if not self.Connection.delete(Entries[0]["dn"], controls=[(TreeDelete, True, None)]):
+            raise Exception("Could not delete "+Entries[0]["dn"]+": "+str(self.Connection.result.get("description")))
+        return(True)
+
+    def Close(self):
+        self.Connection.unbind()
+
+class LDAPTarget:
+    def __init__(self, Server, BaseDN, Username, Password):
+        self.Server   = Server
+        self.BaseDN   = BaseDN
+        self.Username = Username
+        self.Password = Password
+
+    def Connect(self):
+        Server     = ldap3.Server(self.Server, get_info=ldap3.NONE, connect_timeout=5)
+        Connection = ldap3.Connection(Server, user=self.Username, password=self.Password,
+                                      auto_bind=True, receive_timeout=10, raise_exceptions=False)
+        return(LDAPConnection(Connection, self.BaseDN))
+
+def GetTarget():
+    # The directory to remove computer objects from, or None if that hasn't been set up
+    if ADServer == "": return(None)
+
+    if ldap3 is None:
+        logger.error("ADSERVER is set but the ldap3 package is missing - not removing computer objects")
+        return(None)
+
+    try:
+        Secret = json.loads(GetClient("secretsmanager").get_secret_value(SecretId=ADSecret)["SecretString"])
+        return(LDAPTarget(ADServer, ADBaseDN, Secret["Username"], Secret["Password"]))
+    except Exception as e:
+        logger.error("Could not read AD credentials from "+ADSecret+": "+str(e))
+        return(None)
+
+class RateLimiter:
+    #
+    # Token bucket shared by every shard: Rate tokens a second, up to Burst
+    # saved up
+    #
+    def __init__(self, Rate, Burst=None, Clock=time.monotonic):
+        self.Rate   = Rate
+        self.Burst  = Burst if Burst is not None else max(1.0, Rate)
+        self.Clock  = Clock
+        self.Lock   = threading.Lock()
+        self.Tokens = self.Burst
+        self.Last   = Clock()
+
+    def Wait(self, Deadline=None):
+        # Takes a token, waiting for one if need be. Returns False if that would go past Deadline (a Clock time)
+        while True:
+            with self.Lock:
+                Now         = self.Clock()
+                self.Tokens = min(self.Burst, self.Tokens+(Now-self.Last)*self.Rate)
+                self.Last   = Now
+                if Deadline is not None and Now >= Deadline: return(False)
+                if self.Tokens >= 1:
+                    self.Tokens -= 1
+                    return(True)
+                Delay = (1-self.Tokens)/self.Rate
+
+            if Deadline is not None and Now+Delay > Deadline: return(False)
+            time.sleep(Delay)
+
+class CleanupQueue:
+    #
+    # Removes computer objects from Target on Shards threads at no more than
+    # Rate a second in total. Each name is always sent to the same shard.
+    # OnDone(Key, Outcome) is called (from a shard thread) once a removal
+    # finishes with an Outcome of "Removed", "NotFound", "Failed" or, if
+    # Close() ran out of time first, "Deferred".
+    #
+    def __init__(self, Target, OnDone, Shards=ADShards, Rate=ADRate, MaxAttempts=3, BaseDelay=0.5, Clock=time.monotonic):
+        self.Target      = Target
+        self.OnDone      = OnDone
+        self.MaxAttempts = MaxAttempts
+        self.BaseDelay   = BaseDelay
+        self.Clock       = Clock
+        self.Limiter     = RateLimiter(Rate, Clock=Clock)
+        self.Deadline    = None
+        self.Lock        = threading.Lock()
+        self.Counts      = {"Removed":0, "NotFound":0, "Failed":0, "Deferred":0}
+
+        self.Queues  = [queue.Queue() for Shard in range(max(1, Shards))]
+        self.Threads = [threading.Thread(target=self.Run, args=(Work,), daemon=True) for Work in self.Queues]
+        for Thread in self.Threads: Thread.start()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *Args):
+        self.Close()
+
+    def Add(self, Key, ComputerName):
+        self.Queues[zlib.crc32(ComputerName.upper().encode()) % len(self.Queues)].put((Key, ComputerName))
+
+    def Finish(self, Key, Outcome):
+        with self.Lock:
+            self.Counts[Outcome] += 1
+        try:
+            self.OnDone(Key, Outcome)
+        except Exception as e:
+            logger.error("Could not record AD cleanup of "+str(Key)+": "+str(e))
+
+    def Run(self, Work):
+        Connection = None
+        while True:
+            Task = Work.get()
+            if Task is None: break
+            (Key, ComputerName) = Task
+
+            Outcome = "Failed"
+            for Attempt in range(self.MaxAttempts):
+                if not self.Limiter.Wait(self.Deadline):
+                    Outcome = "Deferred"
+                    break
+                try:
+                    if Connection is None: Connection = self.Target.Connect()
+                    with Metrics.Timer("ADRemove"):
+                        Outcome = "Removed" if Connection.Remove(ComputerName) else "NotFound"
+                    break
+                except Exception as e:
+                    logger.error("AD error removing "+ComputerName+" (attempt "+str(Attempt+1)+"): "+str(e))
+                    if Connection is not None:
+                        try:
+                            Connection.Close()
+                        except Exception:
+                            pass
+                    Connection = None # Start again with a fresh connection
+                    time.sleep(random.uniform(0, self.BaseDelay*(2**Attempt)))
+
+            self.Finish(Key, Outcome)
+
+        if Connection is not None:
+            try:
+                Connection.Close()
+            except Exception:
+                pass
+
+    def Close(self, Deadline=None):
+        #
+        # Waits for everything queued to be removed, or until Deadline (a
+        # Clock time) after which whatever is left is deferred. Returns the
+        # counts of each outcome.
+        #
+        self.Deadline = Deadline
+        for Work in self.Queues: Work.put(None)
+        for Thread in self.Threads: Thread.join()
+        with self.Lock:
+            return(dict(self.Counts))
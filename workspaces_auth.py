@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Shared handling of the Cognito tokens sent by the web front end. This file
+# needs to be packaged into the zip file of each function that imports it.
+#
+# Tokens are checked by the API Gateway authorizer before the functions see
+# them. If JWKSFILE names a JSON Web Key Set (the jwks.json published for the
+# user pool) packaged with the function, signatures are checked here as well.
+# Decoded tokens are cached until they expire, so a burst of requests with
+# the same token only decodes and verifies it once.
+#
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import time
+from workspaces_cache import TTLCache
+
+logger = logging.getLogger()
+
+AdminGroup = os.environ.get("ADMINGROUP", "AdminGroupMember")
+JWKSFile   = os.environ.get("JWKSFILE", "")
+Issuer     = os.environ.get("JWTISSUER", "")   # Checked against "iss" if set
+Audience   = os.environ.get("JWTAUDIENCE", "") # Checked against "aud" (or "client_id") if set
+
+TokenCache = TTLCache(MaxSize=int(os.environ.get("AUTHCACHESIZE", "1024")))
+
+# DER encoded DigestInfo header for a SHA-256 hash, as used in RS256 signatures
+SHA256Prefix = bytes.fromhex("3031300d060960864801650304020105000420")
+
+class AuthError(Exception):
+    # The message is safe to return to the caller
+    pass
+
+class Identity:
+    #
+    # What the functions need to know about the caller. Groups is worked out
+    # once per token so membership checks are set lookups.
+    #
+    __slots__ = ("Username", "Groups", "IsAdmin", "Expires", "Claims")
+
+    def __init__(self, Username, Groups, Expires, Claims):
+        self.Username = Username
+        self.Groups   = Groups
+        self.IsAdmin  = AdminGroup in Groups
+        self.Expires  = Expires
+        self.Claims   = Claims
+
+def Base64Decode(Text):
+    MissingPadding = len(Text)%4
+    if MissingPadding != 0: Text += "="*(4-MissingPadding)
+    return(base64.urlsafe_b64decode(Text))
+
+def LoadKeys(Path):
+    with open(Path) as File:
+        KeySet = json.load(File)
+
+    Keys = {}
+    for Key in KeySet.get("keys", []):
+        if Key.get("kty") != "RSA": continue
+        Keys[Key.get("kid")] = (int.from_bytes(Base64Decode(Key["n"]), "big"), int.from_bytes(Base64Decode(Key["e"]), "big"))
+
+    logger.info("Loaded "+str(len(Keys))+" signing keys from "+Path)
+    return(Keys)
+
+Keys = None
+if JWKSFile != "":
+    try:
+        Keys = LoadKeys(JWKSFile)
+    except Exception as e:
+        logger.error("Could not load signing keys from "+JWKSFile+" - every token will be rejected: "+str(e))
+        Keys = {}
+
+def SetKeys(KeySet):
+    #
+    # Used by local harnesses to check signatures against a key set of their
+    # own (a parsed JWKS document), or None to stop checking signatures
+    #
+    global Keys
+    if KeySet is None:
+        Keys = None
+    else:
+        Keys = {Key.get("kid"):(int.from_bytes(Base64Decode(Key["n"]), "big"), int.from_bytes(Base64Decode(Key["e"]), "big"))
+                for Key in KeySet.get("keys", []) if Key.get("kty") == "RSA"}
+    TokenCache.Clear()
+
+def VerifySignature(Header, SigningInput, Signature):
+    #
+    # RS256 (RSASSA-PKCS1-v1_5 with SHA-256), which is what Cognito uses
+    #
+    if Header.get("alg") != "RS256" or Header.get("kid") not in Keys: return(False)
+
+    (Modulus, Exponent) = Keys[Header["kid"]]
+    Length = (Modulus.bit_length()+7)//8
+    if len(Signature) != Length: return(False)
+
+    Decrypted = pow(int.from_bytes(Signature, "big"), Exponent, Modulus).to_bytes(Length, "big")
+    Digest    = SHA256Prefix+hashlib.sha256(SigningInput).digest()
+    Expected  = b"\x00\x01"+b"\xff"*(Length-len(Digest)-3)+b"\x00"+Digest
+    return(hmac.compare_digest(Decrypted, Expected))
+
+def ParseGroups(Text):
+    # custom:ADGroups holds one or more group names, e.g. "[AdminGroupMember, UserGroupMember]"
+    return(frozenset([Group for Group in re.split(r"[\s,\[\]]+", Text or "") if Group != ""]))
+
+def Decode(Token):
+    try:
+        (HeaderPart, ClaimsPart, SignaturePart) = Token.split(".")
+        Header = json.loads(Base64Decode(HeaderPart)) if Keys is not None else {}
+        Claims = json.loads(Base64Decode(ClaimsPart))
+    except Exception as e:
+        logger.error("Could not parse JWT: "+str(e))
+        raise AuthError("Could not parse authorization.")
+
+    if Keys is not None and not VerifySignature(Header, (HeaderPart+"."+ClaimsPart).encode(), Base64Decode(SignaturePart)):
+        logger.error("JWT signature is not valid")
+        raise AuthError("Authorization is not valid.")
+
+    Expires = Claims.get("exp")
+    if Expires is not None and Expires <= time.time():
+        raise AuthError("Authorization has expired.")
+
+    if Issuer != "" and Claims.get("iss") != Issuer:
+        logger.error("JWT issuer is not valid: "+str(Claims.get("iss")))
+        raise AuthError("Authorization is not valid.")
+
+    if Audience != "" and Audience not in (Claims.get("aud"), Claims.get("client_id")):
+        logger.error("JWT audience is not valid: "+str(Claims.get("aud", Claims.get("client_id"))))
+        raise AuthError("Authorization is not valid.")
+
+    if "identities" not in Claims:
+        logger.error("No identity information in JWT")
+        raise AuthError("No identity information in authorization.")
+
+    try:
+        Username = Claims["identities"][0]["userId"].split("\\")[1] # Username is expected to be "DOMAIN\\username"
+    except Exception as e:
+        logger.error("Unexpected identity in JWT: "+str(Claims["identities"])+" - "+str(e))
+        raise AuthError("No identity information in authorization.")
+
+    return(Identity(Username, ParseGroups(Claims.get("custom:ADGroups")), Expires, Claims))
+
+def Authorise(Token):
+    #
+    # Returns the Identity for Token or raises AuthError. Only tokens with an
+    # expiry time are cached, and only until then.
+    #
+    Key = hashlib.sha256(Token.encode()).digest()
+
+    User = TokenCache.Get(Key)
+    if User is not None:
+        if User.Expires > time.time(): return(User)
+        TokenCache.Delete(Key)
+
+    User = Decode(Token)
+    if User.Expires is not None: TokenCache.Put(Key, User, TTL=User.Expires-time.time())
+    return(User)
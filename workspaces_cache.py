@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# In-container caching for the Workspaces portal Lambda functions. This file
+# needs to be packaged into the zip file of each function that imports it.
+#
+
+import collections
+import threading
+import time
+
+class TTLCache:
+    #
+    # Least recently used cache whose entries also expire TTL seconds after
+    # they were stored (or after the TTL given to Put). Once there are more
+    # than MaxSize entries the least recently used are dropped. Safe to use
+    # from several threads. Hits, misses, expiries and evictions are counted
+    # so callers can report how well the cache is working.
+    #
+    def __init__(self, MaxSize=1000, TTL=300, Clock=time.monotonic):
+        self.MaxSize = MaxSize
+        self.TTL     = TTL
+        self.Clock   = Clock
+        self.Entries = collections.OrderedDict() # Key -> (expiry time, value), oldest use first
+        self.Lock    = threading.Lock()
+
+        self.Hits      = 0
+        self.Misses    = 0
+        self.Expired   = 0
+        self.Evictions = 0
+
+    def __len__(self):
+        with self.Lock:
+            return(len(self.Entries))
+
+    def Get(self, Key, Default=None):
+        with self.Lock:
+            Entry = self.Entries.get(Key)
+            if Entry is None:
+                self.Misses += 1
+                return(Default)
+
+            if Entry[0] <= self.Clock():
+                del self.Entries[Key]
+                self.Expired += 1
+                self.Misses  += 1
+                return(Default)
+
+            self.Entries.move_to_end(Key)
+            self.Hits += 1
+            return(Entry[1])
+
+    def Put(self, Key, Value, TTL=None):
+        if TTL is None: TTL = self.TTL
+        with self.Lock:
+            self.Entries[Key] = (self.Clock()+TTL, Value)
+            self.Entries.move_to_end(Key)
+            while len(self.Entries) > self.MaxSize:
+                self.Entries.popitem(last=False)
+                self.Evictions += 1
+
+    def Delete(self, Key):
+        with self.Lock:
+            self.Entries.pop(Key, None)
+
+    def Clear(self):
+        with self.Lock:
+            self.Entries.clear()
+
+    def Stats(self):
+        with self.Lock:
+            return({"Size":len(self.Entries), "Hits":self.Hits, "Misses":self.Misses,
+                    "Expired":self.Expired, "Evictions":self.Evictions})
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Process-wide cache of boto3 clients for the Workspaces portal Lambda
+# functions. Clients are created once per service and region and then reused
+# by every invocation that lands on the same warm container, keeping their
+# connection pools (and TLS sessions) open between calls. This file needs to
+# be packaged into the zip file of each function that imports it.
+#
+
+import boto3
+import logging
+import os
+import threading
+from botocore.config import Config
+from workspaces_metrics import Instrument
+
+ClientConfig = Config(max_pool_connections=int(os.environ.get("MAXPOOLCONNECTIONS", "25")),
+                      tcp_keepalive=True,
+                      retries={"mode":"adaptive", "max_attempts":int(os.environ.get("MAXATTEMPTS", "5"))})
+
+#
+# Per-service overrides. Synchronous Lambda invocations (used to run import
+# workers) can take as long as the worker's timeout, and are not retried so
+# that a slow worker isn't started twice.
+#
+ServiceConfigs = {"lambda":ClientConfig.merge(Config(read_timeout=900, retries={"mode":"standard", "total_max_attempts":1}))}
+
+logger = logging.getLogger()
+
+Session   = boto3.session.Session()
+Instrument(Session) # Every client built from the session reports its calls to workspaces_metrics
+Lock      = threading.Lock() # Creating clients from one session isn't thread safe
+Clients   = {}
+Resources = {}
+
+def GetClient(Service, Region=None):
+    Key = (Service, Region)
+    if Key not in Clients:
+        with Lock:
+            if Key not in Clients:
+                Clients[Key] = Session.client(Service, region_name=Region, config=ServiceConfigs.get(Service, ClientConfig))
+    return(Clients[Key])
+
+def GetResource(Service, Region=None):
+    Key = (Service, Region)
+    if Key not in Resources:
+        with Lock:
+            if Key not in Resources:
+                Resources[Key] = Session.resource(Service, region_name=Region, config=ClientConfig)
+    return(Resources[Key])
+
+def Prewarm(Service, Region=None, Resource=False):
+    #
+    # Called while a function initialises so that loading the service model
+    # and building the client happens in the init phase rather than in the
+    # first request. Failures are only logged - the client will be built
+    # again (and the error reported properly) when it is first used.
+    #
+    try:
+        if Resource:
+            GetResource(Service, Region)
+        else:
+            GetClient(Service, Region)
+    except Exception as e:
+        logger.warning("Could not pre-warm "+Service+" client: "+str(e))
+
+#
+# Used by local harnesses to put stand-in clients in place of real ones
+#
+def SetClient(Service, Client, Region=None):
+    with Lock:
+        Clients[(Service, Region)] = Client
+
+def SetResource(Service, Resource, Region=None):
+    with Lock:
+        Resources[(Service, Region)] = Resource
+
+def ResetClients():
+    with Lock:
+        Clients.clear()
+        Resources.clear()
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Ways of running a batch of worker events for a coordinating Lambda function.
+# Each dispatcher has a Dispatch(Events, Deadline) method that runs the events
+# at the same time and returns one result per event, in the same order. A
+# worker that fails returns {"Status":"Failed", "Error":...} rather than
+# raising, so one bad worker doesn't hide the results of the others. This file needs to
+# be packaged into the zip file of each function that imports it.
+#
+
+import json
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from workspaces_clients import GetClient
+
+logger = logging.getLogger()
+
+def Failed(Error):
+    return({"Status":"Failed", "Error":str(Error)})
+
+class LambdaDispatcher:
+    #
+    # Runs each event in its own synchronous (RequestResponse) invocation of
+    # FunctionName - normally the coordinating function itself. Workers time
+    # out independently of the coordinator, so they should be given a
+    # deadline in their events that leaves it time to use their results.
+    #
+    def __init__(self, FunctionName, Workers=8):
+        self.FunctionName = FunctionName
+        self.Workers      = Workers
+
+    def Invoke(self, Event):
+        try:
+            Response = GetClient("lambda").invoke(FunctionName=self.FunctionName,
+                                                  InvocationType="RequestResponse",
+                                                  Payload=json.dumps(Event))
+            Result = json.loads(Response["Payload"].read())
+        except Exception as e:
+            logger.error("Could not invoke worker: "+str(e))
+            return(Failed(e))
+
+        if "FunctionError" in Response:
+            logger.error("Worker failed: "+json.dumps(Result))
+            return(Failed(Result.get("errorMessage", Response["FunctionError"])))
+
+        return(Result)
+
+    def Dispatch(self, Events, Deadline=None):
+        #
+        # Workers still running at Deadline (seconds since the epoch) are
+        # reported as failed rather than waited for
+        #
+        if len(Events) == 0: return([])
+        Executor = ThreadPoolExecutor(max_workers=min(self.Workers, len(Events)))
+        Futures  = [Executor.submit(self.Invoke, Event) for Event in Events]
+        Timeout  = None
+        if Deadline is not None: Timeout = max(0, Deadline-time.time())
+        wait(Futures, timeout=Timeout)
+        Executor.shutdown(wait=False)
+        return([Future.result() if Future.done() else Failed("Worker did not return before the deadline") for Future in Futures])
+
+def InvokeAsync(FunctionName, Event):
+    #
+    # Queues one asynchronous (Event) invocation of FunctionName and returns
+    # straight away. Lambda retries it if the function fails.
+    #
+    GetClient("lambda").invoke(FunctionName=FunctionName, InvocationType="Event", Payload=json.dumps(Event))
+
+def RunLocally(Handler, Event):
+    try:
+        return(Handler(Event, None))
+    except Exception as e:
+        logger.error("Worker failed: "+str(e))
+        return(Failed(e))
+
+class ProcessPoolDispatcher:
+    #
+    # Local stand-in for LambdaDispatcher. Each event is passed to Handler (a
+    # module level function such as a lambda_handler) in a separate process.
+    # Processes are forked where possible so that stand-in clients set up by
+    # a local harness are inherited by the workers.
+    #
+    def __init__(self, Handler, Workers=4):
+        self.Handler = Handler
+        self.Workers = Workers
+
+    def Dispatch(self, Events, Deadline=None):
+        # Workers are always waited for - they should stop by any deadline in their events
+        if len(Events) == 0: return([])
+
+        Context = None
+        if "fork" in multiprocessing.get_all_start_methods(): Context = multiprocessing.get_context("fork")
+
+        with ProcessPoolExecutor(max_workers=min(self.Workers, len(Events)), mp_context=Context) as Executor:
+            return(list(Executor.map(RunLocally, [self.Handler]*len(Events), Events)))
@@ -0,0 +1,273 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Shared DynamoDB helpers for the Workspaces portal Lambda functions. This file
+# needs to be packaged into the zip file of each function that imports it.
+#
+
+import logging
+import queue
+import random
+import threading
+import time
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+BatchSize    = 25  # Maximum number of requests DynamoDB accepts in one BatchWriteItem call
+BatchGetSize = 100 # Maximum number of keys DynamoDB accepts in one BatchGetItem call
+
+RetryableErrors = {"ProvisionedThroughputExceededException",
+                   "ThrottlingException",
+                   "RequestLimitExceeded",
+                   "InternalServerError"}
+
+class BatchWriter:
+    #
+    # Groups put and delete requests into BatchWriteItem calls of 25 and sends
+    # them from a small pool of writer threads. UnprocessedItems (and throttled
+    # calls) are retried with jittered exponential backoff. Requests can be
+    # added from several threads at once.
+    #
+    def __init__(self, Client, TableName, Writers=4, MaxAttempts=8, BaseDelay=0.05, MaxDelay=5.0):
+        self.Client      = Client
+        self.TableName   = TableName
+        self.MaxAttempts = MaxAttempts
+        self.BaseDelay   = BaseDelay
+        self.MaxDelay    = MaxDelay
+
+        self.Executor = ThreadPoolExecutor(max_workers=Writers)
+        self.InFlight = threading.BoundedSemaphore(Writers*2) # Stop callers running too far ahead of the writers
+        self.Lock     = threading.Lock()
+        self.Buffer   = []
+
+        self.Written = 0
+        self.Retried = 0
+        self.Failed  = 0
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *Args):
+        self.Close()
+
+    def Put(self, Item):
+        self.Add({"PutRequest":{"Item":Item}})
+
+    def Delete(self, Key):
+        self.Add({"DeleteRequest":{"Key":Key}})
+
+    def Add(self, Request):
+        Batch = None
+        with self.Lock:
+            self.Buffer.append(Request)
+            if len(self.Buffer) >= BatchSize:
+                Batch       = self.Buffer
+                self.Buffer = []
+
+        if Batch is not None: self.Submit(Batch)
+
+    def Submit(self, Batch):
+        self.InFlight.acquire()
+        Future = self.Executor.submit(self.WriteBatch, Batch)
+        Future.add_done_callback(lambda Done: self.InFlight.release())
+
+    def Backoff(self, Attempt):
+        time.sleep(random.uniform(0, min(self.MaxDelay, self.BaseDelay*(2**Attempt))))
+
+    def Count(self, Written=0, Retried=0, Failed=0):
+        with self.Lock:
+            self.Written += Written
+            self.Retried += Retried
+            self.Failed  += Failed
+
+    def WriteBatch(self, Batch):
+        Attempt = 0
+        while len(Batch) > 0:
+            try:
+                Response = self.Client.batch_write_item(RequestItems={self.TableName:Batch})
+                Unprocessed = Response.get("UnprocessedItems", {}).get(self.TableName, [])
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in RetryableErrors or Attempt+1 >= self.MaxAttempts:
+                    logger.error("DynamoDB batch write error: "+e.response["Error"]["Message"])
+                    self.Count(Failed=len(Batch))
+                    return
+                Unprocessed = Batch
+            except Exception as e:
+                logger.error("DynamoDB batch write error: "+str(e))
+                self.Count(Failed=len(Batch))
+                return
+
+            self.Count(Written=len(Batch)-len(Unprocessed))
+            if len(Unprocessed) == 0: return
+
+            Attempt += 1
+            if Attempt >= self.MaxAttempts:
+                logger.error("Giving up on "+str(len(Unprocessed))+" unprocessed DynamoDB items")
+                self.Count(Failed=len(Unprocessed))
+                return
+
+            self.Count(Retried=len(Unprocessed))
+            self.Backoff(Attempt)
+            Batch = Unprocessed
+
+    def Flush(self):
+        with self.Lock:
+            Batch       = self.Buffer
+            self.Buffer = []
+
+        if len(Batch) > 0: self.Submit(Batch)
+
+    def Close(self):
+        self.Flush()
+        self.Executor.shutdown(wait=True)
+        return(self.Summary())
+
+    def Summary(self):
+        with self.Lock:
+            return({"Written":self.Written, "Retried":self.Retried, "Failed":self.Failed})
+
+class BoundedExecutor:
+    #
+    # Thread pool whose Submit() blocks once Workers*2 calls are queued or
+    # running, so a fast producer (a scan or a listing, say) can't queue up
+    # work - and the items that go with it - faster than it is done. For
+    # calls that can't be batched, such as conditional writes. Done, if
+    # given, is called with each future as it finishes.
+    #
+    def __init__(self, Workers=4):
+        self.Executor = ThreadPoolExecutor(max_workers=Workers)
+        self.InFlight = threading.BoundedSemaphore(Workers*2)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *Args):
+        self.Close()
+
+    def Submit(self, Function, *Args, Done=None):
+        self.InFlight.acquire()
+        try:
+            Future = self.Executor.submit(Function, *Args)
+        except Exception:
+            self.InFlight.release()
+            raise
+        Future.add_done_callback(lambda Finished: self.InFlight.release())
+        if Done is not None: Future.add_done_callback(Done)
+        return(Future)
+
+    def Close(self):
+        # Waits for everything submitted to finish
+        self.Executor.shutdown(wait=True)
+
+def BatchGet(Client, TableName, Keys, MaxAttempts=8, BaseDelay=0.05, MaxDelay=5.0):
+    #
+    # Reads the items for Keys (at most 100) with BatchGetItem. Any
+    # UnprocessedKeys are retried with jittered exponential backoff; keys
+    # that are still unprocessed after MaxAttempts raise an exception.
+    #
+    Items   = []
+    Request = {TableName:{"Keys":Keys}}
+    Attempt = 0
+    while True:
+        Response = Client.batch_get_item(RequestItems=Request)
+        Items.extend(Response["Responses"].get(TableName, []))
+
+        Request = Response.get("UnprocessedKeys") or {}
+        if len(Request) == 0: return(Items)
+
+        Attempt += 1
+        if Attempt >= MaxAttempts:
+            raise Exception("Giving up on "+str(len(Request[TableName]["Keys"]))+" unprocessed DynamoDB keys")
+        time.sleep(random.uniform(0, min(MaxDelay, BaseDelay*(2**Attempt))))
+
+def ParallelScan(Scan, Segments=4, **Args):
+    #
+    # Generator that walks a table with a parallel scan. Each of the Segments
+    # is read by its own thread (using Segment/TotalSegments) and items are
+    # yielded as soon as any segment returns a page, so results arrive in no
+    # particular order. Scan is the scan method to call - Table.scan for a
+    # boto3 resource or a client scan with TableName already bound - and Args
+    # are passed to every call.
+    #
+    if Segments <= 1:
+        StartKey = {}
+        while True: # Loop until no more items from the DDB scan
+            if len(StartKey) == 0:
+                Result = Scan(**Args)
+            else:
+                Result = Scan(ExclusiveStartKey=StartKey, **Args)
+
+            for Item in Result["Items"]: yield(Item)
+
+            if "LastEvaluatedKey" in Result:
+                StartKey = Result["LastEvaluatedKey"]
+            else:
+                return
+
+    Pages = queue.Queue(maxsize=Segments*2) # Bounded so a slow consumer holds back the scanners
+    Stop  = threading.Event()
+
+    def Send(Message):
+        while not Stop.is_set():
+            try:
+                Pages.put(Message, timeout=0.1)
+                return(True)
+            except queue.Full:
+                pass
+        return(False)
+
+    def ScanSegment(Segment):
+        try:
+            StartKey = {}
+            while not Stop.is_set():
+                if len(StartKey) == 0:
+                    Result = Scan(Segment=Segment, TotalSegments=Segments, **Args)
+                else:
+                    Result = Scan(Segment=Segment, TotalSegments=Segments, ExclusiveStartKey=StartKey, **Args)
+
+                if not Send(("Items", Result["Items"])): return
+
+                if "LastEvaluatedKey" in Result:
+                    StartKey = Result["LastEvaluatedKey"]
+                else:
+                    break
+        except Exception as e:
+            Send(("Error", e))
+        finally:
+            Send(("Done", Segment))
+
+    Executor = ThreadPoolExecutor(max_workers=Segments)
+    try:
+        for Segment in range(Segments): Executor.submit(ScanSegment, Segment)
+
+        Finished = 0
+        while Finished < Segments:
+            (Kind, Value) = Pages.get()
+            if Kind == "Items":
+                for Item in Value: yield(Item)
+            elif Kind == "Error":
+                raise Value
+            else:
+                Finished += 1
+    finally:
+        Stop.set() # Lets the scanners exit if we finish early or hit an error
+        Executor.shutdown(wait=True)
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Portal wide values kept in the metadata table (one item per Name). This
+# file needs to be packaged into the zip file of each function that imports
+# it.
+#
+# The Generation item counts changes to the Workspaces table. Every function
+# that writes to the table bumps it afterwards, so anything derived from the
+# table (such as the cached lists in lambda_workspaces_list_instances) is
+# known to be current for as long as the generation stays the same.
+#
+# Job items (Name "Job#<id>") record the progress of asynchronous actions
+# for the front end to poll. They expire (through the table's TTL on
+# ExpiresAt) JOBTTL seconds after they were last written.
+#
+# The Summary item holds the fleet summary (counts of instances by region,
+# state, running mode, directory and time since last connection) that the
+# import writes at the end of each run, as JSON so it can be served as is.
+#
+
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger()
+
+MetadataTableName = os.environ.get("MetadataTableName", "WorkspacesPortalMetadata")
+JobTTL            = int(os.environ.get("JOBTTL", "3600"))
+
+def GetGeneration(Client):
+    # Returns None if the generation can't be read, in which case nothing should be served from a cache
+    try:
+        Result = Client.get_item(TableName=MetadataTableName,
+                                 Key={"Name":{"S":"Generation"}},
+                                 ProjectionExpression="#v",
+                                 ExpressionAttributeNames={"#v":"Value"},
+                                 ConsistentRead=True) # So a list read straight after an action sees its bump
+    except Exception as e:
+        logger.warning("Could not read the table generation: "+str(e))
+        return(None)
+
+    return(int(Result.get("Item", {}).get("Value", {}).get("N", "0")))
+
+def BumpGeneration(Client):
+    try:
+        Client.update_item(TableName=MetadataTableName,
+                           Key={"Name":{"S":"Generation"}},
+                           UpdateExpression="ADD #v :one",
+                           ExpressionAttributeNames={"#v":"Value"},
+                           ExpressionAttributeValues={":one":{"N":"1"}})
+    except Exception as e:
+        logger.error("Could not update the table generation, cached lists may be out of date until they expire: "+str(e))
+
+def PutJob(Client, JobId, Job):
+    #
+    # Job is {"Owner", "Action", "Status", "States":{WorkspaceId:state}} and
+    # is written whole - each job has a single writer
+    #
+    Now = int(time.time())
+    Client.put_item(TableName=MetadataTableName,
+                    Item={"Name":     {"S":"Job#"+JobId},
+                          "Owner":    {"S":Job["Owner"]},
+                          "Action":   {"S":Job["Action"]},
+                          "Status":   {"S":Job["Status"]},
+                          "States":   {"M":{WorkspaceId:{"S":State} for WorkspaceId, State in Job["States"].items()}},
+                          "Updated":  {"N":str(Now)},
+                          "ExpiresAt":{"N":str(Now+JobTTL)}})
+
+def GetJob(Client, JobId):
+    # Returns None if there is no such job (or it has expired)
+    Item = Client.get_item(TableName=MetadataTableName, Key={"Name":{"S":"Job#"+JobId}}).get("Item")
+    if Item is None or int(Item["ExpiresAt"]["N"]) < time.time(): return(None)
+
+    return({"Owner":  Item["Owner"]["S"],
+            "Action": Item["Action"]["S"],
+            "Status": Item["Status"]["S"],
+            "States": {WorkspaceId:State["S"] for WorkspaceId, State in Item["States"]["M"].items()},
+            "Updated":int(Item["Updated"]["N"])})
+
+def PutSummary(Client, Summary):
+    Client.put_item(TableName=MetadataTableName,
+                    Item={"Name":   {"S":"Summary"},
+                          "Value":  {"S":json.dumps(Summary, sort_keys=True)},
+                          "Updated":{"N":str(int(time.time()))}})
+
+def GetSummary(Client):
+    # Returns the fleet summary as JSON, or None if no import has written one yet
+    Item = Client.get_item(TableName=MetadataTableName, Key={"Name":{"S":"Summary"}}).get("Item")
+    if Item is None: return(None)
+    return(Item["Value"]["S"])
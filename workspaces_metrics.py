@@ -0,0 +1,222 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Per-invocation metrics for the Workspaces portal Lambda functions, written
+# as CloudWatch Embedded Metric Format (EMF) records when the invocation
+# ends. CloudWatch turns them into metrics in the METRICSNAMESPACE namespace
+# (default WorkspacesPortal) without any PutMetricData calls. This file
+# needs to be packaged into the zip file of each function that imports it.
+#
+#  - Phase timers: time spent in each phase of a function, optionally per
+#    region, as Duration with Function/Phase (and Function/Phase/Region)
+#    dimensions. Phases that run in parallel threads add up, so a phase can
+#    take longer in total than the invocation did.
+#  - API calls: every boto3 call made through workspaces_clients is timed,
+#    with its botocore retries and errors, as Latency/Calls/Retries/Errors
+#    with Function/Service/Operation dimensions. Up to METRICSMAXSAMPLES
+#    latencies per operation are kept (a random sample beyond that).
+#  - Counts: anything else a function wants to count, optionally per region.
+#  - Sampled logs: per-instance log lines are written for the first and then
+#    one in every LOGSAMPLE instances, and the number left out is logged
+#    (and counted) at the end.
+#
+# Set METRICS to "false" to stop the records being written.
+#
+
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+logger = logging.getLogger()
+
+Namespace  = os.environ.get("METRICSNAMESPACE", "WorkspacesPortal")
+Enabled    = os.environ.get("METRICS", "true").lower() == "true"
+LogSample  = max(1, int(os.environ.get("LOGSAMPLE", "100")))
+MaxSamples = int(os.environ.get("METRICSMAXSAMPLES", "500"))
+Stream     = sys.stdout # EMF records must be whole log events, so they are written directly rather than through logging
+
+MaxValues = 100 # Most values EMF accepts for one metric in one record
+
+class Timer:
+    def __init__(self, Recorder, Phase, Region):
+        self.Recorder = Recorder
+        self.Phase    = Phase
+        self.Region   = Region
+
+    def __enter__(self):
+        self.Start = time.perf_counter()
+        return(self)
+
+    def __exit__(self, *Args):
+        self.Recorder.AddTime(self.Phase, (time.perf_counter()-self.Start)*1000, self.Region)
+
+class Recorder:
+    def __init__(self):
+        self.Lock   = threading.Lock() # Functions record from several threads
+        self.Random = random.Random()
+        self.Depth  = 0
+        self.Reset(None)
+
+    def Reset(self, Function):
+        with self.Lock:
+            self.Function = Function
+            self.Phases   = {} # (Phase, Region) -> milliseconds
+            self.Counts   = {} # (Name, Region) -> count
+            self.Apis     = {} # (Service, Operation) -> totals and latency samples
+            self.Sampled  = {} # Kind -> lines seen
+
+    def Timer(self, Phase, Region=None):
+        return(Timer(self, Phase, Region))
+
+    def AddTime(self, Phase, Milliseconds, Region=None):
+        with self.Lock:
+            self.Phases[(Phase, Region)] = self.Phases.get((Phase, Region), 0.0)+Milliseconds
+
+    def Count(self, Name, Value=1, Region=None):
+        with self.Lock:
+            self.Counts[(Name, Region)] = self.Counts.get((Name, Region), 0)+Value
+
+    def Api(self, Service, Operation, Milliseconds, Retries, Error):
+        with self.Lock:
+            Api = self.Apis.setdefault((Service, Operation), {"Calls":0, "Retries":0, "Errors":0, "Latency":[]})
+            Api["Calls"]   += 1
+            Api["Retries"] += Retries
+            Api["Errors"]  += 1 if Error else 0
+            if len(Api["Latency"]) < MaxSamples:
+                Api["Latency"].append(round(Milliseconds, 2))
+            else: # Reservoir sample so the kept latencies stay representative of every call
+                Slot = self.Random.randrange(Api["Calls"])
+                if Slot < MaxSamples: Api["Latency"][Slot] = round(Milliseconds, 2)
+
+    def SampledInfo(self, Kind, Message):
+        with self.Lock:
+            Seen = self.Sampled.get(Kind, 0)
+            self.Sampled[Kind] = Seen+1
+        if Seen%LogSample == 0: logger.info(Message)
+
+    def Record(self, Dimensions, Properties, Metrics):
+        Record = {"_aws":{"Timestamp":int(time.time()*1000),
+                          "CloudWatchMetrics":[{"Namespace":Namespace,
+                                                "Dimensions":Dimensions,
+                                                "Metrics":[{"Name":Name, "Unit":Unit} for (Name, Unit, Value) in Metrics]}]}}
+        Record.update(Properties)
+        for (Name, Unit, Value) in Metrics: Record[Name] = Value
+        return(Record)
+
+    def Records(self):
+        Base    = {"Function":self.Function}
+        Records = []
+
+        for ((Phase, Region), Milliseconds) in sorted(self.Phases.items(), key=lambda Item: (Item[0][0], Item[0][1] or "")):
+            if Region is None:
+                Records.append(self.Record([["Function", "Phase"]], dict(Base, Phase=Phase),
+                                           [("Duration", "Milliseconds", round(Milliseconds, 2))]))
+            else:
+                Records.append(self.Record([["Function", "Phase"], ["Function", "Phase", "Region"]], dict(Base, Phase=Phase, Region=Region),
+                                           [("Duration", "Milliseconds", round(Milliseconds, 2))]))
+
+        ByRegion = {}
+        for ((Name, Region), Value) in self.Counts.items(): ByRegion.setdefault(Region, []).append((Name, "Count", Value))
+        for Region in sorted(ByRegion, key=lambda Region: Region or ""):
+            if Region is None:
+                Records.append(self.Record([["Function"]], Base, sorted(ByRegion[Region])))
+            else:
+                Records.append(self.Record([["Function"], ["Function", "Region"]], dict(Base, Region=Region), sorted(ByRegion[Region])))
+
+        for ((Service, Operation), Api) in sorted(self.Apis.items()):
+            Properties = dict(Base, Service=Service, Operation=Operation)
+            Latency    = Api["Latency"]
+            Records.append(self.Record([["Function", "Service", "Operation"]], Properties,
+                                       [("Latency", "Milliseconds", Latency[:MaxValues]), ("Calls", "Count", Api["Calls"]),
+                                        ("Retries", "Count", Api["Retries"]), ("Errors", "Count", Api["Errors"])]))
+            for Index in range(MaxValues, len(Latency), MaxValues):
+                Records.append(self.Record([["Function", "Service", "Operation"]], Properties,
+                                           [("Latency", "Milliseconds", Latency[Index:Index+MaxValues])]))
+
+        return(Records)
+
+    def Flush(self):
+        with self.Lock:
+            Suppressed = {Kind:Seen-(Seen+LogSample-1)//LogSample for Kind, Seen in self.Sampled.items()}
+        for (Kind, Count) in sorted(Suppressed.items()):
+            if Count == 0: continue
+            logger.info("Logged 1 in "+str(LogSample)+" "+Kind+" lines, "+str(Count)+" not logged")
+            self.Count("LogLinesSuppressed", Count)
+
+        with self.Lock:
+            Records = self.Records()
+        if Enabled: Stream.write("".join([json.dumps(Record, separators=(",", ":"))+"\n" for Record in Records]))
+        return(Records)
+
+    def Handler(self, Function):
+        #
+        # Decorator for lambda_handler: starts a fresh set of metrics, times
+        # the whole invocation as the Total phase and writes the records at
+        # the end, even if the handler raised. A handler called from inside
+        # another (a worker run in the same process) adds to its metrics.
+        #
+        def Wrap(Handle):
+            @functools.wraps(Handle)
+            def Run(event, context):
+                if self.Depth > 0: return(Handle(event, context))
+
+                self.Reset(Function)
+                self.Depth += 1
+                try:
+                    with self.Timer("Total"):
+                        return(Handle(event, context))
+                finally:
+                    self.Depth -= 1
+                    self.Flush()
+            return(Run)
+        return(Wrap)
+
+Metrics = Recorder()
+
+#
+# botocore event hooks, registered on the session that workspaces_clients
+# creates every client from
+#
+def BeforeCall(model, context, **Args):
+    context["MetricsStart"]     = time.perf_counter()
+    context["MetricsOperation"] = (model.service_model.service_id, model.name)
+
+def AfterCall(http_response, parsed, model, context, **Args):
+    if "MetricsStart" not in context: return
+    context["MetricsDone"] = True
+    Retries = (parsed or {}).get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    Metrics.Api(model.service_model.service_id, model.name, (time.perf_counter()-context["MetricsStart"])*1000,
+                Retries, http_response.status_code >= 300)
+
+def AfterCallError(exception, context, **Args):
+    # Connection errors and the like, where no response came back at all
+    if "MetricsStart" not in context or "MetricsDone" in context: return
+    (Service, Operation) = context["MetricsOperation"]
+    Metrics.Api(Service, Operation, (time.perf_counter()-context["MetricsStart"])*1000, 0, True)
+
+def Instrument(Session):
+    Session.events.register("before-call", BeforeCall)
+    Session.events.register("after-call", AfterCall)
+    Session.events.register("after-call-error", AfterCallError)
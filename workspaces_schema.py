@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Storage schema for the Workspaces table. This file needs to be packaged
+# into the zip file of each function that imports it.
+#
+# Items can be stored in the original (long) form or in a compact form that
+# uses short attribute names, stores InstanceState and RunningMode as numbers
+# and LastTouched in whole seconds. Every item is read through Expand() so
+# both forms (and items part way between them) can be in the table at once.
+# Functions only write the compact form when COMPACTSCHEMA is "true" - set
+# it on every function that writes once they are all running this code, and
+# then convert the existing items with migrate_schema.py.
+#
+# WorkspaceId and UserName keep their names because they are the keys of
+# the table and the UserName index.
+#
+
+import math
+import os
+from decimal import Decimal
+
+CompactWrites = os.environ.get("COMPACTSCHEMA", "false").lower() == "true"
+
+ShortNames = {"Region":       "r",
+              "DirectoryId":  "d",
+              "InstanceState":"s",
+              "RunningMode":  "m",
+              "RegCode":      "rc",
+              "ComputerName": "c",
+              "IPAddress":    "ip",
+              "LastConnected":"lc",
+              "LastTouched":  "t",
+              "Version":      "v"}
+LongNames = {Short:Long for Long, Short in ShortNames.items()}
+
+#
+# Values are stored as their position in these lists so only ever add to the
+# end. Anything not in a list (a state added to Workspaces later, say) is
+# stored as a string as before.
+#
+Enums = {"InstanceState":["PENDING", "AVAILABLE", "IMPAIRED", "UNHEALTHY", "REBOOTING", "STARTING",
+                          "REBUILDING", "RESTORING", "MAINTENANCE", "ADMIN_MAINTENANCE", "TERMINATING",
+                          "TERMINATED", "SUSPENDED", "UPDATING", "STOPPING", "STOPPED", "ERROR"],
+         "RunningMode":  ["AUTO_STOP", "ALWAYS_ON", "MANUAL"]}
+EnumCodes = {Name:{Value:Code for Code, Value in enumerate(Values)} for Name, Values in Enums.items()}
+
+def Name(Long):
+    # The name to write an attribute under
+    if CompactWrites: return(ShortNames.get(Long, Long))
+    return(Long)
+
+def OtherName(Long):
+    # The name an attribute may still be stored under from the other form, or None
+    if Long not in ShortNames: return(None)
+    if CompactWrites: return(Long)
+    return(ShortNames[Long])
+
+def Names(Longs):
+    # Every name each of Longs may be stored under
+    Result = []
+    for Long in Longs:
+        Result.append(Long)
+        if Long in ShortNames: Result.append(ShortNames[Long])
+    return(Result)
+
+def Projection(Longs):
+    #
+    # ProjectionExpression and ExpressionAttributeNames that fetch Longs in
+    # either form. Placeholders are used because some short names (and
+    # Region) are reserved words.
+    #
+    Placeholders = {"#p"+str(Index):Stored for Index, Stored in enumerate(Names(Longs))}
+    return(",".join(Placeholders.keys()), Placeholders)
+
+def EncodeValue(Long, Value):
+    # Typed ({"S":...}) value of a long name to the value stored in compact form
+    if Long in EnumCodes and Value.get("S") in EnumCodes[Long]: return({"N":str(EnumCodes[Long][Value["S"]])})
+    if Long == "LastTouched": return({"N":str(int(float(Value["N"])))})
+    return(Value)
+
+def DecodeValue(Long, Value):
+    if Long in Enums and "N" in Value: return({"S":Enums[Long][int(Value["N"])]})
+    return(Value)
+
+def StoredValue(Long, Value):
+    # The value to write for an attribute, in whichever form is being written
+    if CompactWrites: return(EncodeValue(Long, Value))
+    return(Value)
+
+def Compact(Item):
+    # Typed item in either form to the compact form
+    Item = Expand(Item)
+    return({ShortNames.get(Long, Long):EncodeValue(Long, Value) for Long, Value in Item.items()})
+
+def Expand(Item):
+    #
+    # Typed item in either form (or a mix) to the long form. Where an
+    # attribute is stored under both names the short one is newer.
+    #
+    Result = {}
+    for (Stored, Value) in Item.items():
+        if Stored in LongNames: continue
+        Result[Stored] = Value
+    for (Stored, Value) in Item.items():
+        if Stored not in LongNames: continue
+        Result[LongNames[Stored]] = DecodeValue(LongNames[Stored], Value)
+    return(Result)
+
+def ExpandPlain(Item):
+    # The same for items read through a boto3 resource, where values are plain Python types
+    Result = {}
+    for (Stored, Value) in Item.items():
+        if Stored in LongNames: continue
+        Result[Stored] = Value
+    for (Stored, Value) in Item.items():
+        if Stored not in LongNames: continue
+        Long = LongNames[Stored]
+        if Long in Enums and isinstance(Value, Decimal): Value = Enums[Long][int(Value)]
+        Result[Long] = Value
+    return(Result)
+
+def ForWrite(Item):
+    # Typed long form item to whichever form is being written
+    if CompactWrites: return(Compact(Item))
+    return(Item)
+
+def IsCompact(Item):
+    return(not any([Long in Item for Long in ShortNames]) and
+           not any([Long in EnumCodes and Item.get(ShortNames[Long], {}).get("S") in EnumCodes[Long] for Long in Enums]))
+
+def ItemSize(Item):
+    #
+    # Size DynamoDB charges for a typed item: attribute names plus values,
+    # with numbers taking a byte per two significant digits plus one
+    #
+    Size = 0
+    for (Stored, Value) in Item.items():
+        (Type, Raw) = list(Value.items())[0]
+        if Type == "N": Size += len(Stored.encode())+math.ceil(len(Raw.lstrip("-").replace(".", "").strip("0") or "0")/2)+1
+        else:           Size += len(Stored.encode())+len(str(Raw).encode())
+    return(Size)
@@ -0,0 +1,54 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Records how long each Lambda function spends in its init phase (module
+# import and pre-warming clients) so cold start time can be tracked. Each
+# function logs one "Init report" line when it has finished initialising.
+# This file needs to be packaged into the zip file of each function that
+# imports it.
+#
+
+import json
+import logging
+import time
+
+logger = logging.getLogger()
+
+Reports = {} # Module name -> report, for local harnesses
+
+class InitTimer:
+    def __init__(self, Module, Start=None):
+        self.Module = Module
+        self.Start  = Start if Start is not None else time.perf_counter()
+        self.Last   = self.Start
+        self.Phases = {}
+
+    def Phase(self, Name):
+        Now = time.perf_counter()
+        self.Phases[Name] = round((Now-self.Last)*1000, 2)
+        self.Last = Now
+
+    def Done(self):
+        Report = {"Module":self.Module,
+                  "Phases":self.Phases,
+                  "TotalMs":round((time.perf_counter()-self.Start)*1000, 2)}
+        Reports[self.Module] = Report
+        logger.info("Init report: "+json.dumps(Report))
+        return(Report)
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#
+# The state machine behind the portal's actions. This file needs to be
+# packaged into the zip file of each function that imports it.
+#
+# Each action lists the states (and running modes) it can be started from,
+# the state it moves the instance to, the Workspaces API call that starts it
+# and the warnings shown when it can't be done. Everything else - checking a
+# request, making the API call, what the front end offers for each instance -
+# is driven from this table, so a new action or a change to the rules only
+# needs an entry here. The actions function serves the table to the front
+# end with a Transitions=True request.
+#
+
+import workspaces_schema as Schema
+
+# Every state we know of. INOPERABLE isn't in the schema's list because it is no longer reported.
+AllStates = Schema.Enums["InstanceState"]+["INOPERABLE"]
+
+Actions = {"Start":       {"From":        ["STOPPED"],
+                           "RunningModes":["AUTO_STOP", "MANUAL"],
+                           "To":          "STARTING",
+                           "Method":      "start_workspaces",
+                           "RequestKey":  "StartWorkspaceRequests",
+                           "MaxBatch":    25,
+                           "AdminOnly":   False,
+                           "Warning":     "You cannot start a Workspace that is not in a STOPPED state."},
+           "Stop":        {"From":        ["AVAILABLE", "IMPAIRED", "UNHEALTHY", "ERROR"],
+                           "RunningModes":["AUTO_STOP", "MANUAL"],
+                           "To":          "STOPPING",
+                           "Method":      "stop_workspaces",
+                           "RequestKey":  "StopWorkspaceRequests",
+                           "MaxBatch":    25,
+                           "AdminOnly":   False,
+                           "Warning":     "You cannot stop a Workspace that is not in an AVAILABLE, IMPAIRED, UNHEALTHY or ERROR state."},
+           "Reboot":      {"From":        ["AVAILABLE", "IMPAIRED", "INOPERABLE"],
+                           "RunningModes":None,
+                           "To":          "REBOOTING",
+                           "Method":      "reboot_workspaces",
+                           "RequestKey":  "RebootWorkspaceRequests",
+                           "MaxBatch":    25,
+                           "AdminOnly":   False,
+                           "Warning":     "You cannot reboot a Workspace unless it is in an AVAILABLE, IMPAIRED or INOPERABLE state."},
+           "Rebuild":     {"From":        ["AVAILABLE", "ERROR"],
+                           "RunningModes":None,
+                           "To":          "REBUILDING",
+                           "Method":      "rebuild_workspaces",
+                           "RequestKey":  "RebuildWorkspaceRequests",
+                           "MaxBatch":    1,
+                           "AdminOnly":   False,
+                           "Warning":     "You cannot rebuild a Workspace unless it is in an AVAILABLE or ERROR state."},
+           "Decommission":{"From":        [State for State in AllStates if State != "SUSPENDED"],
+                           "RunningModes":None,
+                           "To":          "TERMINATING",
+                           "Method":      "terminate_workspaces",
+                           "RequestKey":  "TerminateWorkspaceRequests",
+                           "MaxBatch":    25,
+                           "AdminOnly":   True,
+                           "Warning":     "You cannot decommission a Workspace when it is in a SUSPENDED state."}}
+
+ModeWarning = "You can only start or stop a Workspace that is in AUTO_STOP or MANUAL running mode."
+
+# States an instance only passes through on its way to another
+TransitionalStates = {"PENDING", "STARTING", "STOPPING", "REBOOTING", "REBUILDING", "RESTORING", "TERMINATING", "UPDATING"}
+
+# Every (action, state) the table allows, worked out once so checking an instance is a set lookup
+Allowed = {(Action, State) for Action, Rule in Actions.items() for State in Rule["From"]}
+
+# State -> the actions that can be started from it, in table order
+ByState = {State:[Action for Action, Rule in Actions.items() if State in Rule["From"]] for State in AllStates}
+
+def Check(Action, State, Mode=None):
+    #
+    # Returns None if Action can be performed on a Workspace in State and
+    # running Mode, otherwise a tuple of (log message, warning for the user).
+    # Actions without RunningModes can be done in any mode - including one
+    # we don't know of or None (not recorded for the instance).
+    #
+    Rule = Actions[Action]
+    if (Action, State) not in Allowed:
+        return(("Cannot "+Action.lower()+" - state is "+State, Rule["Warning"]))
+    if Rule["RunningModes"] is not None and Mode not in Rule["RunningModes"]:
+        return(("Cannot "+Action.lower()+" - running mode is "+str(Mode), ModeWarning))
+    return(None)
+
+def Describe():
+    # The table as served to the front end - everything except how the API is called
+    return({"Actions":{Action:{"From":Rule["From"],
+                               "RunningModes":Rule["RunningModes"],
+                               "To":Rule["To"],
+                               "Bulk":Rule["MaxBatch"] > 1,
+                               "AdminOnly":Rule["AdminOnly"]} for Action, Rule in Actions.items()},
+            "ByState":ByState})
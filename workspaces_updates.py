@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+#
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+#
+# Versioned updates to single Workspaces instances in the table, shared by
+# the functions that learn about changes between imports (events, and the
+# watcher in the actions function). This file needs to be packaged into the
+# zip file of each function that imports it.
+#
+
+import json
+import logging
+from botocore.exceptions import ClientError
+from workspaces_metrics import Metrics
+import workspaces_schema as Schema
+
+logger = logging.getLogger()
+
+def MakeVersion(Seconds):
+    #
+    # Every change to an instance's state carries the time it happened, in
+    # microseconds, as its Version. A change is only applied if it is newer
+    # than the Version already on the item so events that arrive late or out
+    # of order can't undo a later change. The import uses the same scale.
+    #
+    return(int(Seconds*1000000))
+
+def ApplyUpdate(DynamoDB, TableName, Update):
+    #
+    # Update is (WorkspaceId, attributes to set, guard attribute, guard
+    # value). Returns "Applied", "Stale" (the guard value wasn't newer) or
+    # "Unknown" (the instance isn't in the table).
+    #
+    (WorkspaceId, Attributes, Guard, GuardValue) = Update
+
+    #
+    # Attributes are written in the form set by COMPACTSCHEMA and removed
+    # from the other form, so an item that hasn't been converted yet isn't
+    # left with two values. The guard is checked under both names.
+    #
+    Names   = {"#g":Schema.Name(Guard), "#og":Schema.OtherName(Guard)}
+    Values  = {":g":{"N":str(GuardValue)}}
+    Sets    = ["#g = :g"]
+    Removes = ["#og"]
+    for (Index, (Name, Value)) in enumerate(Attributes.items()):
+        if Name == Guard: continue
+        Names["#a"+str(Index)]  = Schema.Name(Name)
+        Values[":a"+str(Index)] = Schema.StoredValue(Name, Value)
+        Sets.append("#a"+str(Index)+" = :a"+str(Index))
+        if Schema.OtherName(Name) is not None:
+            Names["#o"+str(Index)] = Schema.OtherName(Name)
+            Removes.append("#o"+str(Index))
+
+    try:
+        DynamoDB.update_item(TableName=TableName,
+                             Key={"WorkspaceId":{"S":WorkspaceId}},
+                             UpdateExpression="SET "+", ".join(Sets)+" REMOVE "+", ".join(Removes),
+                             ConditionExpression="attribute_exists(WorkspaceId) AND (attribute_not_exists(#g) OR #g < :g) AND (attribute_not_exists(#og) OR #og < :g)",
+                             ExpressionAttributeNames=Names,
+                             ExpressionAttributeValues=Values,
+                             ReturnValuesOnConditionCheckFailure="ALL_OLD")
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException": raise
+
+        #
+        # Instances the import hasn't seen yet are left for it to add with
+        # all of their details rather than creating a partial item here
+        #
+        if "Item" not in e.response:
+            Metrics.SampledInfo("unknown instance", "Ignoring update for unknown instance "+WorkspaceId)
+            return("Unknown")
+
+        Metrics.SampledInfo("out of date", "Ignoring out of date update for "+WorkspaceId+": "+json.dumps(Attributes))
+        return("Stale")
+
+    Metrics.SampledInfo("update", "Updated "+WorkspaceId+": "+json.dumps(Attributes))
+    return("Applied")